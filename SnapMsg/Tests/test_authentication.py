@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app import authentication
+from app.authentication import get_admin_from_token, get_user_from_token, identity_cache
+from app.http_client import ServiceClient
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_cache():
+    identity_cache.clear()
+    yield
+    identity_cache.clear()
+
+
+@pytest.fixture
+def service_calls(monkeypatch):
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        if request.url.path == "/auth/get-email-from-token":
+            if b"valid-token" in request.content and b"invalid-token" not in request.content:
+                return httpx.Response(200, json={"email": "mocked_email@example.com"})
+            return httpx.Response(401)
+        return httpx.Response(200, json={"username": "johndoe"})
+
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(authentication, "auth_client", ServiceClient("auth", "http://auth", transport=transport))
+    monkeypatch.setattr(authentication, "profile_client", ServiceClient("profile", "http://profile", transport=transport))
+    return calls
+
+
+def test_user_identity_is_cached(service_calls):
+    first = asyncio.run(get_user_from_token("valid-token"))
+    second = asyncio.run(get_user_from_token("valid-token"))
+
+    assert first == second == {"email": "mocked_email@example.com", "token": "valid-token", "username": "johndoe"}
+    assert service_calls == ["/auth/get-email-from-token", "/profiles/by-email"]
+
+
+def test_tokens_are_not_kept_in_the_cache(service_calls):
+    asyncio.run(get_user_from_token("valid-token"))
+    asyncio.run(get_admin_from_token("valid-token"))
+
+    token_hash = hashlib.sha256(b"valid-token").hexdigest()
+    assert identity_cache.get(("user", token_hash)) == {"email": "mocked_email@example.com", "username": "johndoe"}
+    assert identity_cache.get(("admin", token_hash)) == {"email": "mocked_email@example.com"}
+
+
+def test_admin_identity_is_cached_separately(service_calls):
+    asyncio.run(get_user_from_token("valid-token"))
+    admin = asyncio.run(get_admin_from_token("valid-token"))
+    asyncio.run(get_admin_from_token("valid-token"))
+
+    assert admin == {"email": "mocked_email@example.com", "token": "valid-token"}
+    assert len(service_calls) == 3
+
+
+def test_invalid_token_is_cached(service_calls):
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(get_user_from_token("invalid-token"))
+        assert exc_info.value.status_code == 401
+
+    assert len(service_calls) == 1
+
+
+def test_concurrent_requests_share_one_resolution(service_calls):
+    async def resolve_concurrently():
+        return await asyncio.gather(*(get_user_from_token("valid-token") for _ in range(5)))
+
+    identities = asyncio.run(resolve_concurrently())
+
+    assert all(identity["email"] == "mocked_email@example.com" for identity in identities)
+    assert len(service_calls) == 2
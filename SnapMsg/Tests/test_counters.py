@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+
+from app.counters import WriteBehindCounters, WriteBehindHooks
+
+BUCKET = datetime.datetime(2024, 1, 1, 12)
+
+
+class RecordingRepository:
+    def __init__(self):
+        self.likes = []
+        self.hashtag_scores = []
+        self.fail = False
+
+    async def increment_snap_likes(self, likes):
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        self.likes.append(likes)
+
+    async def increment_hashtag_scores(self, scores):
+        self.hashtag_scores.append(scores)
+
+
+class RecordingHooks(WriteBehindHooks):
+    def __init__(self):
+        self.events = []
+
+    def recorded(self, counter, key, amount):
+        self.events.append(("recorded", counter, key, amount))
+
+    def flushed(self, counter, increments):
+        self.events.append(("flushed", counter, increments))
+
+    def failed(self, counter, increments, exc):
+        self.events.append(("failed", counter, increments))
+
+
+def test_increments_are_coalesced_until_flushed():
+    repository = RecordingRepository()
+    counters = WriteBehindCounters(repository)
+
+    async def burst():
+        for _ in range(3):
+            await counters.add_likes("snap", 1)
+            await counters.add_hashtag_scores(["#tag", "#tag"], BUCKET, 1)
+        await counters.add_likes("other", 1)
+        await counters.add_likes("other", -1)
+        assert repository.likes == []
+        await counters.flush()
+
+    asyncio.run(burst())
+
+    assert repository.likes == [{"snap": 3}]
+    assert repository.hashtag_scores == [{("#tag", BUCKET): 6}]
+    assert len(counters) == 0
+
+
+def test_flushes_when_max_pending_is_reached():
+    repository = RecordingRepository()
+    counters = WriteBehindCounters(repository, max_pending=2)
+
+    async def likes():
+        await counters.add_likes("first", 1)
+        await counters.add_likes("first", 1)
+        assert repository.likes == []
+        await counters.add_likes("second", 1)
+
+    asyncio.run(likes())
+
+    assert repository.likes == [{"first": 2, "second": 1}]
+
+
+def test_failed_flush_keeps_increments_for_the_next_one():
+    repository = RecordingRepository()
+    hooks = RecordingHooks()
+    counters = WriteBehindCounters(repository, hooks=hooks)
+
+    async def flush_twice():
+        await counters.add_likes("snap", 1)
+        repository.fail = True
+        await counters.flush()
+        await counters.add_likes("snap", 1)
+        repository.fail = False
+        await counters.flush()
+
+    asyncio.run(flush_twice())
+
+    assert repository.likes == [{"snap": 2}]
+    assert hooks.events == [
+        ("recorded", "likes", "snap", 1),
+        ("failed", "likes", {"snap": 1}),
+        ("recorded", "likes", "snap", 1),
+        ("flushed", "likes", {"snap": 2}),
+    ]
+
+
+def test_stop_writes_buffered_increments():
+    repository = RecordingRepository()
+    counters = WriteBehindCounters(repository, flush_interval=60)
+
+    async def run():
+        counters.start()
+        await counters.add_likes("snap", 1)
+        await counters.stop()
+
+    asyncio.run(run())
+
+    assert repository.likes == [{"snap": 1}]
+
+
+def test_flush_likes_writes_only_that_snap():
+    repository = RecordingRepository()
+    counters = WriteBehindCounters(repository)
+
+    async def run():
+        await counters.add_likes("snap", 2)
+        await counters.add_likes("other", 1)
+        await counters.add_hashtag_scores(["#tag"], BUCKET, 1)
+        await counters.flush_likes("snap")
+        await counters.flush_likes("missing")
+
+    asyncio.run(run())
+
+    assert repository.likes == [{"snap": 2}]
+    assert repository.hashtag_scores == []
+    assert counters.pending == {"likes": {"other": 1}, "hashtag_scores": {("#tag", BUCKET): 1}}
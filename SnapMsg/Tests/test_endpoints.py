@@ -1,22 +1,42 @@
+import asyncio
+import datetime
 from http.client import HTTPException
 from fastapi.testclient import TestClient
 import sys
 import os
 import pytest
 import urllib.parse
+from bson import ObjectId
 from app.authentication import get_user_from_token, get_admin_from_token
+from app import repositories
 from app.db import db
+from app.indexes import ensure_indexes
 from httpx import WSGITransport
 
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from app.main import app
+from app.services import trending_bucket
 
 @pytest.fixture(autouse=True)
 def clear_database():
     db.twitsnaps.drop()
+    db.timelines.drop()
+    db.timeline_sizes.drop()
+    db.followers.drop()
+    db.pull_authors.drop()
+    db.hashtag_scores.drop()
+    db.hashtags.drop()
+    db.hashtag_candidates.drop()
     yield
     db.twitsnaps.drop()
+    db.timelines.drop()
+    db.timeline_sizes.drop()
+    db.followers.drop()
+    db.pull_authors.drop()
+    db.hashtag_scores.drop()
+    db.hashtags.drop()
+    db.hashtag_candidates.drop()
 
 def mock_get_user_from_token(_token: str = None):
     return {"email": "mocked_email@example.com", "token": "", "username": "johndoe"}
@@ -40,6 +60,13 @@ app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
 transport = WSGITransport(app=app)
 client = TestClient(app)
 
+
+@pytest.fixture(scope="module", autouse=True)
+def running_app():
+    # Serve every request from one event loop, like uvicorn, so the async Mongo client is reused.
+    with client:
+        yield
+
 def test_create_snap():
     data = {"message": "Hello World!", "is_private": False}
 
@@ -104,6 +131,45 @@ def test_get_all_snaps():
     assert data["data"][2]["message"] == "Snap 1"
 
 
+def test_get_all_snaps_paginated():
+    for i in range(5):
+        client.post("/snaps/", json={"message": f"Snap {i}", "is_private": False})
+
+    response = client.get("/snaps/all-snaps?limit=2")
+    data = response.json()
+    assert [snap["message"] for snap in data["data"]] == ["Snap 4", "Snap 3"]
+
+    response = client.get(f"/snaps/all-snaps?limit=2&cursor={data['next_cursor']}")
+    data = response.json()
+    assert [snap["message"] for snap in data["data"]] == ["Snap 2", "Snap 1"]
+
+    response = client.get(f"/snaps/all-snaps?limit=2&cursor={data['next_cursor']}")
+    data = response.json()
+    assert [snap["message"] for snap in data["data"]] == ["Snap 0"]
+    assert data["next_cursor"] is None
+
+
+def test_get_all_snaps_with_sparse_fields():
+    client.post("/snaps/", json={"message": "Snap #tag", "is_private": False})
+
+    response = client.get("/snaps/all-snaps", params={"fields": "username,message,created_at,likes"})
+    assert response.status_code == 200
+    [snap] = response.json()["data"]
+    assert snap.keys() == {"_id", "username", "message", "created_at", "likes"}
+
+
+def test_get_all_snaps_with_unknown_fields():
+    response = client.get("/snaps/all-snaps", params={"fields": "message,password"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown fields: password."
+
+
+def test_get_all_snaps_invalid_cursor():
+    response = client.get("/snaps/all-snaps?cursor=not-a-cursor")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor."
+
+
 def test_get_all_snaps_no_snaps():
     
     response = client.get("/snaps/all-snaps", headers={"Authorization ": "Bearer mocktoken"})
@@ -123,6 +189,64 @@ def test_create_snap_with_hashtags():
     assert response_data["hashtags"] == ["#test", "#snap"]
 
 
+def test_create_snaps_in_batch():
+    snaps = [
+        {"message": "First #batch", "is_private": False},
+        {"message": "x" * 281, "is_private": False},
+        {"message": "Third #batch", "is_private": True},
+    ]
+
+    response = client.post("/snaps/batch", json={"snaps": snaps}, headers={"Authorization": "Bearer mocktoken"})
+    assert response.status_code == 207
+    results = response.json()["data"]
+    assert [result["status"] for result in results] == [201, 400, 201]
+    assert results[0]["hashtags"] == ["#batch"]
+    assert results[1]["detail"] == "Message exceeds 280 characters."
+
+    snaps = client.get("/snaps/").json()["data"]
+    assert {snap["_id"] for snap in snaps} == {results[0]["id"], results[2]["id"]}
+
+    assert client.get("/snaps/trending-topics/").json()["data"] == ["#batch"]
+
+
+def test_create_snaps_in_ordered_batch_stops_at_first_failure():
+    snaps = [
+        {"message": "First", "is_private": False},
+        {"message": "x" * 281, "is_private": False},
+        {"message": "Third", "is_private": False},
+    ]
+
+    response = client.post("/snaps/batch", json={"snaps": snaps, "ordered": True}, headers={"Authorization": "Bearer mocktoken"})
+    assert [result["status"] for result in response.json()["data"]] == [201, 400, 424]
+    assert len(client.get("/snaps/").json()["data"]) == 1
+
+
+def test_create_snaps_in_ordered_batch_stops_at_storage_failure(monkeypatch):
+    existing_id = client.post("/snaps/", json={"message": "Existing", "is_private": False}).json()["data"]["id"]
+    new_snap_documents = repositories.new_snap_documents
+
+    def colliding_snap_documents(*args):
+        documents = new_snap_documents(*args)
+        documents[1]["_id"] = ObjectId(existing_id)
+        return documents
+
+    monkeypatch.setattr(repositories, "new_snap_documents", colliding_snap_documents)
+    snaps = [{"message": message, "is_private": False} for message in ("First", "Second", "Third")]
+
+    response = client.post("/snaps/batch", json={"snaps": snaps, "ordered": True}, headers={"Authorization": "Bearer mocktoken"})
+    results = response.json()["data"]
+    assert [result["status"] for result in results] == [201, 500, 424]
+    assert results[1]["detail"] == "The snap could not be stored."
+    assert [snap["message"] for snap in client.get("/snaps/").json()["data"]] == ["First", "Existing"]
+
+
+def test_create_snaps_batch_too_large():
+    snaps = [{"message": "Snap", "is_private": False}] * 101
+
+    response = client.post("/snaps/batch", json={"snaps": snaps}, headers={"Authorization": "Bearer mocktoken"})
+    assert response.status_code == 422
+
+
 def test_update_snap_with_hashtags():
    
     response = client.post("/snaps/", json={"message": "Initial Message", "is_private": False}, headers={"Authorization": "Bearer mocktoken"})
@@ -174,6 +298,28 @@ def test_get_snap_by_id():
     data = response.json()
     assert data["data"]["message"] == "Snap"
 
+def test_get_snap_by_id_not_modified():
+    snap_id = client.post("/snaps/", json={"message": "Snap", "is_private": False}).json()["data"]["id"]
+
+    response = client.get(f"/snaps/{snap_id}")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    async def unused_get_snap_by_id(db, snap_id):
+        raise AssertionError("A matching ETag must not load the snap")
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr("app.controllers.snap_service.get_snap_by_id", unused_get_snap_by_id)
+        response = client.get(f"/snaps/{snap_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    client.put(f"/snaps/{snap_id}", json={"message": "Edited snap", "is_private": False})
+    response = client.get(f"/snaps/{snap_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["data"]["message"] == "Edited snap"
+    assert response.headers["ETag"] != etag
+
 def test_like_snap():
     response = client.post("/snaps/", json={"message": "Snap", "is_private": False}, headers={"Authorization": "Bearer mock"})
 
@@ -211,6 +357,67 @@ def test_unlike_snap_not_liked():
     assert response_unlike.status_code == 400
     assert response_unlike.json()['detail'] == "You have not liked this snap."
 
+def test_like_counter_stays_consistent_with_repeated_requests():
+    response = client.post("/snaps/", json={"message": "Snap", "is_private": False})
+    snap_id = response.json()["data"]["id"]
+
+    def likes():
+        return db.twitsnaps.find_one({"_id": ObjectId(snap_id)})["likes"]
+
+    client.post(f"/snaps/like?snap_id={snap_id}")
+    client.post(f"/snaps/like?snap_id={snap_id}")
+    assert likes() == 1
+
+    client.post(f"/snaps/unlike?snap_id={snap_id}")
+    client.post(f"/snaps/unlike?snap_id={snap_id}")
+    assert likes() == 0
+
+def test_apply_interactions_in_batch():
+    snap_id = client.post("/snaps/", json={"message": "Snap #sync", "is_private": False}).json()["data"]["id"]
+    missing_id = "66f9a1c9dcf674a1a9c6e2f0"
+    operations = [
+        {"action": "like", "snap_id": snap_id},
+        {"action": "like", "snap_id": snap_id},
+        {"action": "favourite", "snap_id": snap_id},
+        {"action": "unfavourite", "snap_id": snap_id},
+        {"action": "unfavourite", "snap_id": snap_id},
+        {"action": "share", "snap_id": snap_id},
+        {"action": "like", "snap_id": missing_id},
+    ]
+
+    response = client.post("/snaps/interactions/batch", json={"operations": operations})
+    assert response.status_code == 207
+    results = response.json()["data"]
+    assert [result["status"] for result in results] == [200, 400, 200, 200, 400, 200, 404]
+    assert results[1]["detail"] == "You have already liked this snap."
+    assert results[4]["detail"] == "You have not favourited this snap."
+
+    assert db.twitsnaps.find_one({"_id": ObjectId(snap_id)})["likes"] == 1
+    assert [snap["id"] for snap in client.get("/snaps/liked/").json()["data"]] == [snap_id]
+    assert client.get("/snaps/favourites/").json()["data"] == []
+    assert [snap["id"] for snap in client.get("/snaps/shared/").json()["data"]] == [snap_id]
+
+    response = client.post("/snaps/interactions/batch", json={"operations": [{"action": "unlike", "snap_id": snap_id}]})
+    assert response.json()["data"][0]["status"] == 200
+    assert db.twitsnaps.find_one({"_id": ObjectId(snap_id)})["likes"] == 0
+
+def test_apply_interactions_counts_only_applied_likes(monkeypatch):
+    snap_id = client.post("/snaps/", json={"message": "Snap", "is_private": False}).json()["data"]["id"]
+    client.post(f"/snaps/like?snap_id={snap_id}")
+
+    async def stale_liked_snap_ids(self, user_email, snap_ids):
+        return stale_likes
+
+    monkeypatch.setattr("app.repositories.AsyncSnapRepository.get_liked_snap_ids", stale_liked_snap_ids)
+    stale_likes = set()
+    client.post("/snaps/interactions/batch", json={"operations": [{"action": "like", "snap_id": snap_id}]})
+    assert db.twitsnaps.find_one({"_id": ObjectId(snap_id)})["likes"] == 1
+
+    client.post(f"/snaps/unlike?snap_id={snap_id}")
+    stale_likes = {snap_id}
+    client.post("/snaps/interactions/batch", json={"operations": [{"action": "unlike", "snap_id": snap_id}]})
+    assert db.twitsnaps.find_one({"_id": ObjectId(snap_id)})["likes"] == 0
+
 def test_favourite_snap():
     response = client.post("/snaps/", json={"message": "Snap", "is_private": False}, headers={"Authorization": "Bearer mock"})
 
@@ -259,6 +466,34 @@ def test_get_liked_snaps():
     assert data["data"][0]["message"] == "Snap"
 
 
+def test_get_liked_snaps_skips_blocked():
+    response_1 = client.post("/snaps/", json={"message": "Snap 1", "is_private": False})
+    response_2 = client.post("/snaps/", json={"message": "Snap 2", "is_private": False})
+    client.post(f"/snaps/like?snap_id={response_1.json()['data']['id']}")
+    client.post(f"/snaps/like?snap_id={response_2.json()['data']['id']}")
+    app.dependency_overrides[get_admin_from_token] = mock_get_admin_from_token
+    client.post(f"/snaps/block?snap_id={response_2.json()['data']['id']}")
+
+    response_liked = client.get("/snaps/liked/")
+    assert response_liked.status_code == 200
+    data = response_liked.json()["data"]
+    assert [snap["message"] for snap in data] == ["Snap 1"]
+    assert data[0]["id"] == response_1.json()["data"]["id"]
+
+
+def test_get_shared_snaps():
+    response = client.post("/snaps/", json={"message": "Snap", "is_private": False})
+    snap_id = response.json()["data"]["id"]
+    client.post(f"/snaps/snap-share?snap_id={snap_id}")
+
+    response_shared = client.get("/snaps/shared/")
+    assert response_shared.status_code == 200
+    data = response_shared.json()["data"]
+    assert len(data) == 1
+    assert data[0]["id"] == snap_id
+    assert data[0]["retweet_user"] == "johndoe"
+
+
 def test_block_snap():
     response = client.post("/snaps/", json={"message": "Snap", "is_private": False}, headers={"Authorization ": "Bearer mock"})
     snap_id = response.json()["data"]["id"]
@@ -322,6 +557,108 @@ def test_get_trending_topics():
     data = response.json()
     assert data["data"] == ["#fun"]
 
+def test_get_trending_topics_not_modified():
+    client.post("/snaps/", json={"message": "Snap with #fun", "is_private": False})
+    response = client.get("/snaps/trending-topics/")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "public, max-age=60"
+
+    response = client.get("/snaps/trending-topics/", headers={"If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+
+    client.post("/snaps/", json={"message": "Snap with #news", "is_private": False})
+    response = client.get("/snaps/trending-topics/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["data"] == ["#fun", "#news"]
+
+def test_get_snaps_by_username_not_modified(monkeypatch):
+    async def mock_get_profile_by_username(username):
+        return {"email": "mocked_email@example.com"}
+
+    monkeypatch.setattr("app.controllers.get_profile_by_username", mock_get_profile_by_username)
+    client.post("/snaps/", json={"message": "First snap", "is_private": False})
+    response = client.get("/snaps/by-username/johndoe")
+    assert [snap["message"] for snap in response.json()["data"]] == ["First snap"]
+    etag = response.headers["ETag"]
+
+    response = client.get("/snaps/by-username/johndoe", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.post("/snaps/", json={"message": "Second snap", "is_private": False})
+    response = client.get("/snaps/by-username/johndoe", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [snap["message"] for snap in response.json()["data"]] == ["Second snap", "First snap"]
+
+def test_search_snaps_by_text():
+    # clear_database drops the snaps collection, and the text index with it.
+    ensure_indexes(db)
+    client.post("/snaps/", json={"message": "Learning python today", "is_private": False})
+    response = client.post("/snaps/", json={"message": "Python python everywhere", "is_private": False})
+    blocked_id = client.post("/snaps/", json={"message": "Blocked python snap", "is_private": False}).json()["data"]["id"]
+    client.post("/snaps/", json={"message": "Nothing to see here", "is_private": False})
+    app.dependency_overrides[get_admin_from_token] = mock_get_admin_from_token
+    client.post(f"/snaps/block?snap_id={blocked_id}")
+
+    response = client.get("/snaps/search", params={"q": "python", "limit": 1})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [snap["message"] for snap in first_page["data"]] == ["Python python everywhere"]
+
+    response = client.get("/snaps/search", params={"q": "python", "limit": 1, "cursor": first_page["next_cursor"]})
+    second_page = response.json()
+    assert [snap["message"] for snap in second_page["data"]] == ["Learning python today"]
+
+    response = client.get("/snaps/search", params={"q": "python", "limit": 1, "cursor": second_page["next_cursor"]})
+    assert response.json() == {"data": [], "next_cursor": None}
+
+
+def test_search_snaps_by_text_empty_query():
+    response = client.get("/snaps/search", params={"q": " "})
+    assert response.status_code == 400
+
+def test_suggest_hashtags():
+    client.post("/snaps/", json={"message": "#autocomplete #autosave", "is_private": False})
+    response = client.post("/snaps/", json={"message": "Also #autosave", "is_private": False})
+    snap_id = response.json()["data"]["id"]
+
+    response = client.get("/snaps/hashtags/suggest", params={"prefix": "AUTO"})
+    assert response.status_code == 200
+    assert response.json()["data"] == ["#autosave", "#autocomplete"]
+
+    client.put(f"/snaps/{snap_id}", json={"message": "Now #autopilot", "is_private": False})
+    client.post("/snaps/", json={"message": "More #autopilot", "is_private": False})
+    assert client.get("/snaps/hashtags/suggest", params={"prefix": "#auto", "limit": 2}).json()["data"] == ["#autopilot", "#autocomplete"]
+
+    client.delete(f"/snaps/{snap_id}")
+    assert client.get("/snaps/hashtags/suggest", params={"prefix": "#autop"}).json()["data"] == ["#autopilot"]
+
+def test_trending_buckets_are_utc_hours():
+    moment = datetime.datetime(2024, 1, 1, 12, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=-3)))
+    local_moment = moment.astimezone().replace(tzinfo=None)
+
+    assert trending_bucket(moment) == trending_bucket(local_moment) == datetime.datetime(2024, 1, 1, 15)
+
+
+def test_get_trending_topics_weights_interactions():
+    client.post("/snaps/", json={"message": "Snap with #low", "is_private": False})
+    response = client.post("/snaps/", json={"message": "Snap with #high", "is_private": False})
+    snap_id = response.json()["data"]["id"]
+    client.post(f"/snaps/snap-share?snap_id={snap_id}")
+
+    response = client.get("/snaps/trending-topics/?window=1h")
+    assert response.status_code == 200
+    assert response.json()["data"] == ["#high", "#low"]
+
+    client.delete(f"/snaps/{snap_id}")
+    response = client.get("/snaps/trending-topics/")
+    assert response.json()["data"] == ["#low"]
+
+
+def test_get_trending_topics_invalid_window():
+    response = client.get("/snaps/trending-topics/?window=2d")
+    assert response.status_code == 400
+
+
 def test_snap_share():
     response = client.post("/snaps/", json={"message": "Snap", "is_private": False}, headers={"Authorization": "Bearer mock"})
     snap_id = response.json()["data"]["id"]
@@ -348,5 +685,194 @@ def test_get_users_interactions():
     assert data["data"][response.json()['data']['id']]["retweets"][0]["username"] == "pepito"
 
 
+def mock_feed_profile_service(monkeypatch, followed_emails, interests=None):
+    async def mock_get_followed_users(token, username):
+        return followed_emails
 
-   
+    async def mock_get_profile_by_username(username):
+        return {"interests": interests or []}
+
+    async def mock_get_verified_users():
+        return []
+
+    monkeypatch.setattr("app.controllers.get_followed_users", mock_get_followed_users)
+    monkeypatch.setattr("app.controllers.get_profile_by_username", mock_get_profile_by_username)
+    monkeypatch.setattr("app.controllers.get_verified_users", mock_get_verified_users)
+
+
+def test_get_feed_snaps_from_timeline(monkeypatch):
+    mock_feed_profile_service(monkeypatch, ["mocked_email@example.com"])
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    client.get("/snaps/feed/")
+
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+    response = client.post("/snaps/", json={"message": "Fresh snap", "is_private": False})
+    snap_id = response.json()["data"]["id"]
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    response_feed = client.get("/snaps/feed/")
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+
+    assert response_feed.status_code == 200
+    data = response_feed.json()["data"]
+    assert len(data) == 1
+    assert data[0]["_id"] == snap_id
+    assert data[0]["message"] == "Fresh snap"
+
+
+def test_get_feed_snaps_backfills_new_follow(monkeypatch):
+    client.post("/snaps/", json={"message": "Old snap", "is_private": False})
+    response = client.post("/snaps/", json={"message": "Shared snap", "is_private": False})
+    client.post(f"/snaps/snap-share?snap_id={response.json()['data']['id']}")
+
+    mock_feed_profile_service(monkeypatch, ["mocked_email@example.com"])
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    response_feed = client.get("/snaps/feed/")
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+
+    data = response_feed.json()["data"]
+    assert [snap["message"] for snap in data] == ["Shared snap", "Shared snap", "Old snap"]
+    assert data[0]["retweet_user"] == "johndoe"
+    assert data[1]["retweet_user"] == ""
+
+
+def test_get_feed_snaps_pulls_authors_with_many_followers(monkeypatch):
+    monkeypatch.setattr("app.services.FANOUT_MAX_FOLLOWERS", 1)
+    mock_feed_profile_service(monkeypatch, ["mocked_email@example.com"])
+    for follower in (mock_get_user_from_token_user_2, mock_get_user_from_token_user_3):
+        app.dependency_overrides[get_user_from_token] = follower
+        client.get("/snaps/feed/")
+
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+    snap_ids = [client.post("/snaps/", json={"message": message, "is_private": False}).json()["data"]["id"] for message in ("Popular snap", "Pulled snap")]
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    response_feed = client.get("/snaps/feed/")
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+
+    assert db.pull_authors.count_documents({"email": "mocked_email@example.com"}) == 1
+    assert db.timelines.count_documents({"snap_id": {"$in": snap_ids}}) == 0
+    assert [snap["message"] for snap in response_feed.json()["data"]][:2] == ["Pulled snap", "Popular snap"]
+
+
+def test_fan_out_trims_timelines(monkeypatch):
+    monkeypatch.setattr("app.services.TIMELINE_MAX_ENTRIES", 2)
+    monkeypatch.setattr("app.repositories.TIMELINE_TRIM_SLACK", 1)
+    mock_feed_profile_service(monkeypatch, ["mocked_email@example.com"])
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    client.get("/snaps/feed/")
+
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+    snap_ids = [client.post("/snaps/", json={"message": f"Snap {number}", "is_private": False}).json()["data"]["id"] for number in range(5)]
+
+    timeline = db.timelines.find({"owner": "mocked_email_2@example.com"}).sort("created_at", -1)
+    assert [entry["snap_id"] for entry in timeline][:2] == snap_ids[:2:-1]
+    assert db.timelines.count_documents({"owner": "mocked_email_2@example.com"}) <= 3
+
+
+def test_get_feed_snaps_viewer_state(monkeypatch):
+    response = client.post("/snaps/", json={"message": "Liked snap", "is_private": False})
+    snap_id = response.json()["data"]["id"]
+    client.post(f"/snaps/snap-share?snap_id={snap_id}")
+    client.post("/snaps/", json={"message": "Other snap", "is_private": False})
+
+    mock_feed_profile_service(monkeypatch, ["mocked_email@example.com"])
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    client.post(f"/snaps/like?snap_id={snap_id}")
+    client.post(f"/snaps/favourite?snap_id={snap_id}")
+    response_feed = client.get("/snaps/feed/")
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+
+    data = response_feed.json()["data"]
+    assert [(snap["message"], snap["is_liked"], snap["is_favourited"], snap["is_shared"]) for snap in data] == [
+        ("Other snap", False, False, False),
+        ("Liked snap", True, True, False),
+        ("Liked snap", True, True, False),
+    ]
+
+
+def test_get_feed_snaps_with_sparse_fields(monkeypatch):
+    response = client.post("/snaps/", json={"message": "Liked snap", "is_private": False})
+    snap_id = response.json()["data"]["id"]
+
+    mock_feed_profile_service(monkeypatch, ["mocked_email@example.com"])
+
+    async def unexpected_get_verified_users():
+        raise AssertionError("verified users should not be fetched")
+
+    monkeypatch.setattr("app.controllers.get_verified_users", unexpected_get_verified_users)
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    client.post(f"/snaps/like?snap_id={snap_id}")
+    response_feed = client.get("/snaps/feed/", params={"fields": "message,is_liked"})
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+
+    assert response_feed.json()["partial"] is False
+    [snap] = response_feed.json()["data"]
+    assert snap.keys() == {"_id", "snap_id", "message", "is_liked"}
+    assert snap["is_liked"] is True
+
+
+def test_get_feed_snaps_relevant_to_interests(monkeypatch):
+    client.post("/snaps/", json={"message": "First #python", "is_private": False})
+    client.post("/snaps/", json={"message": "Second #mongo", "is_private": False})
+    blocked_id = client.post("/snaps/", json={"message": "Blocked #python", "is_private": False}).json()["data"]["id"]
+    deleted_id = client.post("/snaps/", json={"message": "Deleted #mongo", "is_private": False}).json()["data"]["id"]
+    client.post("/snaps/", json={"message": "Third #python #mongo", "is_private": False})
+    client.post("/snaps/", json={"message": "Unrelated #rust", "is_private": False})
+    client.delete(f"/snaps/{deleted_id}")
+    app.dependency_overrides[get_admin_from_token] = mock_get_admin_from_token
+    client.post(f"/snaps/block?snap_id={blocked_id}")
+
+    mock_feed_profile_service(monkeypatch, [], interests=["python", "mongo"])
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    response_feed = client.get("/snaps/feed/")
+    assert [snap["message"] for snap in response_feed.json()["data"]] == ["Third #python #mongo", "Second #mongo", "First #python"]
+
+    client.post(f"/snaps/unblock?snap_id={blocked_id}")
+    response_feed = client.get("/snaps/feed/")
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+    assert [snap["message"] for snap in response_feed.json()["data"]] == ["Third #python #mongo", "Blocked #python", "Second #mongo", "First #python"]
+
+
+def test_get_feed_snaps_partial_when_optional_source_is_late(monkeypatch):
+    client.post("/snaps/", json={"message": "Timeline snap", "is_private": False})
+    mock_feed_profile_service(monkeypatch, ["mocked_email@example.com"])
+
+    async def slow_get_profile_by_username(username):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr("app.controllers.get_profile_by_username", slow_get_profile_by_username)
+    monkeypatch.setattr("app.controllers.FEED_DEADLINE", 0.5)
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    response_feed = client.get("/snaps/feed/")
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+
+    assert response_feed.status_code == 200
+    assert response_feed.json()["partial"] is True
+    assert [snap["message"] for snap in response_feed.json()["data"]] == ["Timeline snap"]
+    assert "timeline;dur=" in response_feed.headers["Server-Timing"]
+
+
+def test_get_feed_snaps_times_out_when_timeline_is_late(monkeypatch):
+    mock_feed_profile_service(monkeypatch, [])
+
+    async def slow_get_followed_users(token, username):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr("app.controllers.get_followed_users", slow_get_followed_users)
+    monkeypatch.setattr("app.controllers.FEED_DEADLINE", 0.5)
+    response_feed = client.get("/snaps/feed/")
+
+    assert response_feed.status_code == 504
+
+
+def test_get_users_interactions_since():
+    response = client.post("/snaps/", json={"message": "Snap", "is_private": False})
+    snap_id = response.json()["data"]["id"]
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token_user_2
+    client.post(f"/snaps/like?snap_id={snap_id}")
+    app.dependency_overrides[get_user_from_token] = mock_get_user_from_token
+
+    response_users = client.get("/snaps/users-interactions/", params={"since": "2999-01-01T00:00:00"})
+    assert response_users.status_code == 200
+    data = response_users.json()
+    assert data["data"][snap_id] == {"likes": [], "retweets": []}
+    assert data["next_cursor"] is None
@@ -0,0 +1,84 @@
+import asyncio
+
+from app.hashtags import HashtagSuggestions, HashtagTrie, hashtag_usage
+
+
+def test_suggests_most_used_hashtags_for_prefix():
+    trie = HashtagTrie(top_k=2)
+    for hashtag, count in [("#python", 5), ("#pycon", 3), ("#pytest", 4), ("#rust", 9)]:
+        trie.add(hashtag, count)
+
+    assert trie.suggest("#py") == ["#python", "#pytest"]
+    assert trie.suggest("#pyc") == ["#pycon"]
+    assert trie.suggest("#go") == []
+    assert trie.suggest("#", 1) == ["#rust"]
+
+
+def test_growing_count_promotes_hashtag():
+    trie = HashtagTrie(top_k=2)
+    for hashtag, count in [("#python", 5), ("#pycon", 3), ("#pytest", 4)]:
+        trie.add(hashtag, count)
+
+    trie.add("#pycon", 3)
+
+    assert trie.suggest("#py") == ["#pycon", "#python"]
+
+
+def test_shrinking_count_recomputes_suggestions():
+    trie = HashtagTrie(top_k=2)
+    for hashtag, count in [("#python", 5), ("#pycon", 3), ("#pytest", 4)]:
+        trie.add(hashtag, count)
+    trie.suggest("#py")
+
+    trie.add("#python", -5)
+
+    assert trie.suggest("#py") == ["#pytest", "#pycon"]
+    assert "#python" not in trie.counts
+
+
+def test_hashtag_usage_counts_each_snap_once():
+    assert hashtag_usage(["#old", "#kept"], ["#kept", "#new", "#new"]) == {"#new": 1, "#old": -1}
+
+
+class RecordingRepository:
+    def __init__(self, counts):
+        self.counts = counts
+        self.loads = 0
+
+    async def get_hashtag_counts(self):
+        self.loads += 1
+        await asyncio.sleep(0)
+        return dict(self.counts)
+
+    async def increment_hashtag_counts(self, counts):
+        for hashtag, amount in counts.items():
+            self.counts[hashtag] = self.counts.get(hashtag, 0) + amount
+
+
+def test_suggestions_load_once_and_apply_local_writes():
+    repository = RecordingRepository({"#python": 2})
+    suggestions = HashtagSuggestions(repository)
+
+    async def scenario():
+        first = await asyncio.gather(*(suggestions.suggest("#py") for _ in range(3)))
+        await suggestions.record({"#pytest": 1, "#python": -2})
+        return first, await suggestions.suggest("#py")
+
+    first, after_write = asyncio.run(scenario())
+
+    assert first == [["#python"]] * 3
+    assert after_write == ["#pytest"]
+    assert repository.loads == 1
+    assert repository.counts == {"#python": 0, "#pytest": 1}
+
+
+def test_suggestions_rebuild_missing_counts():
+    class UncountedRepository(RecordingRepository):
+        async def rebuild_hashtag_counts(self):
+            self.counts = {"#python": 3, "#pytest": 1}
+            return dict(self.counts)
+
+    repository = UncountedRepository({})
+    suggestions = HashtagSuggestions(repository)
+
+    assert asyncio.run(suggestions.suggest("#py")) == ["#python", "#pytest"]
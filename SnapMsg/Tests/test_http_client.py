@@ -0,0 +1,127 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.http_client import CircuitBreaker, ServiceClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def service_client(responses, **kwargs):
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        response = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = ServiceClient("profile", "http://profile", backoff=0, transport=httpx.MockTransport(handler), **kwargs)
+    return client, calls
+
+
+def test_retries_unavailable_responses():
+    client, calls = service_client([httpx.Response(503), httpx.ConnectError("refused"), httpx.Response(200, json={"ok": True})])
+
+    response = asyncio.run(client.get("/profiles/verified-users"))
+
+    assert response.json() == {"ok": True}
+    assert len(calls) == 3
+
+
+def test_does_not_retry_client_errors():
+    client, calls = service_client([httpx.Response(404)])
+
+    response = asyncio.run(client.get("/profiles/by-username"))
+
+    assert response.status_code == 404
+    assert len(calls) == 1
+
+
+def test_gives_up_after_retries():
+    client, calls = service_client([httpx.Response(503)], retries=2)
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(client.get("/profiles/verified-users"))
+
+    assert exc_info.value.status_code == 503
+    assert len(calls) == 3
+
+
+def test_circuit_opens_after_consecutive_failures():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    client, calls = service_client([httpx.Response(503), httpx.Response(503), httpx.Response(200)], retries=0, breaker=breaker)
+
+    for _ in range(3):
+        with pytest.raises(HTTPException):
+            asyncio.run(client.get("/profiles/verified-users"))
+    assert len(calls) == 2
+    assert breaker.state == "open"
+
+    clock.now = 30
+    assert asyncio.run(client.get("/profiles/verified-users")).status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_call_reopens_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 30
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_cancelled_trial_call_lets_another_trial_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 30
+    started = asyncio.Event()
+
+    async def handler(request: httpx.Request):
+        if not started.is_set():
+            started.set()
+            await asyncio.Event().wait()
+        return httpx.Response(200)
+
+    client = ServiceClient("profile", "http://profile", backoff=0, breaker=breaker, transport=httpx.MockTransport(handler))
+
+    async def scenario():
+        trial = asyncio.create_task(client.get("/profiles/verified-users"))
+        await started.wait()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert breaker.state == "half-open"
+        return await client.get("/profiles/verified-users")
+
+    assert asyncio.run(scenario()).status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_unexpected_error_in_trial_call_reopens_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 30
+    client, calls = service_client([httpx.DecodingError("bad body")], breaker=breaker)
+
+    with pytest.raises(httpx.DecodingError):
+        asyncio.run(client.get("/profiles/verified-users"))
+
+    assert breaker.state == "open"
+    assert not breaker.trial_running
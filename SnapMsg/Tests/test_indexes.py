@@ -0,0 +1,184 @@
+import inspect
+
+import pytest
+from bson import ObjectId
+from pymongo import monitoring
+
+from app.db import create_client
+from app.indexes import ensure_indexes, missing_indexes
+from app.repositories import AsyncSnapRepository, SnapRepository
+from app.schemas import SnapUpdate
+
+EXPLAIN_DATABASE = "twitsnaps_explain"
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+SESSION_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "apiVersion", "apiStrict", "apiDeprecationErrors", "txnNumber", "writeConcern", "readConcern"}
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """
+    Keeps a copy of every explainable command sent while recording.
+    """
+    def __init__(self):
+        self.recording = False
+        self.commands = []
+
+    def started(self, event):
+        if not self.recording or event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        command = {key: value for key, value in event.command.items() if key not in SESSION_FIELDS}
+        if event.command_name in ("update", "delete"):
+            statements_field = event.command_name + "s"
+            for statement in command[statements_field]:
+                self.commands.append({**command, statements_field: [statement]})
+        else:
+            self.commands.append(command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def collection_scans(explain):
+    """
+    Find the COLLSCAN stages of the winning plans of an explain output.
+    """
+    found = []
+
+    def visit(node, in_winning_plan):
+        if isinstance(node, dict):
+            if in_winning_plan and node.get("stage") == "COLLSCAN":
+                found.append(node)
+            for key, value in node.items():
+                if key != "rejectedPlans":
+                    visit(value, in_winning_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for value in node:
+                visit(value, in_winning_plan)
+
+    visit(explain, False)
+    return found
+
+
+def exercise_repository(repository: SnapRepository):
+    """
+    Call every public repository method at least once.
+    """
+    snap = repository.create_snap("author@example.com", "Hello #tag", False, ["#tag"], "author")
+    snap_id = snap["_id"]
+    after = (snap["created_at"], ObjectId(snap_id))
+    repository.create_snaps("author@example.com", [("Batch #tag", False, ["#tag"])], "author")
+
+    repository.get_snaps("author@example.com")
+    repository.get_snaps("author@example.com", after, 10)
+    repository.get_snap_by_id(snap_id)
+    repository.get_snap_version(snap_id)
+    repository.update_snap(snap_id, SnapUpdate(message="Hi #tag", is_private=False, hashtags=["#tag"]))
+    repository.get_all_snaps(after, 10)
+    repository.search_snaps_by_hashtag("#tag", after, 10)
+    repository.search_snaps("hello", (1.0, ObjectId(snap_id)), 10)
+    repository.get_snaps_from_users(["author@example.com"], after, 10)
+    repository.push_hashtag_candidates([snap])
+    repository.get_relevant_snaps(["tag"], after, 10)
+    repository.get_hashtag_candidates(["#tag", "#other"])
+    repository.rebuild_hashtag_candidates(["#tag"])
+    repository.get_snaps_by_ids([snap_id])
+    repository.get_liked_snap_ids("reader@example.com", [snap_id])
+    repository.get_favourited_snap_ids("reader@example.com", [snap_id])
+    repository.get_shared_snap_ids("reader@example.com", [snap_id])
+
+    repository.like_snap(snap_id, "reader@example.com", "reader")
+    repository.get_snap_likes(snap_id)
+    repository.get_all_snap_likes("reader@example.com")
+    repository.get_users_and_time_snap_likes(snap_id)
+    repository.unlike_snap(snap_id, "reader@example.com")
+
+    repository.favourite_snap(snap_id, "reader@example.com")
+    repository.get_snap_favourites("reader@example.com")
+    repository.get_all_snap_favourites("reader@example.com")
+    repository.unfavourite_snap(snap_id, "reader@example.com")
+    repository.apply_interactions("reader@example.com", "reader", {snap_id: True}, {snap_id: False}, [snap_id])
+
+    repository.snap_share(snap_id, "reader@example.com", "reader")
+    repository.get_snap_shares(snap_id)
+    repository.count_snap_shares(snap_id)
+    repository.get_snap_shares_by_email("reader@example.com", after, 10)
+    repository.get_users_and_time_snap_shares(snap_id)
+    repository.get_users_interactions("author@example.com", after, 10, snap["created_at"])
+
+    repository.block_snap(snap_id, "admin@example.com")
+    repository.unblock_snap(snap_id, "admin@example.com")
+    repository.get_snaps_unblocked("admin@example.com")
+    repository.get_last_24_hours_snaps()
+    repository.increment_hashtag_scores({("#tag", snap["created_at"].replace(minute=0, second=0, microsecond=0)): 20})
+    repository.increment_snap_likes({snap_id: 1})
+    repository.get_top_hashtags(snap["created_at"].replace(minute=0, second=0, microsecond=0), 5)
+    repository.increment_hashtag_counts({"#tag": 1})
+    repository.get_hashtag_counts()
+    repository.rebuild_hashtag_counts()
+
+    repository.add_follow_edges("reader@example.com", ["author@example.com"])
+    repository.get_followed_emails("reader@example.com")
+    repository.get_follower_emails("author@example.com")
+    repository.count_followers("author@example.com", 10)
+    repository.mark_pull_author("author@example.com")
+    repository.get_pull_authors(["author@example.com"])
+    entries = repository.get_timeline_entries_from_users(["author@example.com"], 10)
+    repository.push_timeline_entries(["reader@example.com"], entries)
+    repository.push_timeline_entries(["reader@example.com"], entries, 0)
+    repository.get_timeline("reader@example.com", after, 10)
+    repository.trim_timeline("reader@example.com", 1)
+    repository.remove_timeline_authors("reader@example.com", ["author@example.com"])
+    repository.remove_snap_from_timelines(snap_id)
+    repository.remove_follow_edges("reader@example.com", ["author@example.com"])
+
+    repository.delete_snap(snap_id)
+
+
+@pytest.fixture(scope="module")
+def explained_database():
+    recorder = CommandRecorder()
+    client = create_client(event_listeners=[recorder])
+    client.drop_database(EXPLAIN_DATABASE)
+    database = client[EXPLAIN_DATABASE]
+    ensure_indexes(database)
+    yield database, recorder
+    client.drop_database(EXPLAIN_DATABASE)
+    client.close()
+
+
+def test_all_indexes_created(explained_database):
+    database, _ = explained_database
+    assert missing_indexes(database) == {}
+
+
+def test_repository_queries_use_indexes(explained_database):
+    database, recorder = explained_database
+    repository = SnapRepository(database)
+
+    called = set()
+    public_methods = {name for name, _ in inspect.getmembers(AsyncSnapRepository, inspect.iscoroutinefunction) if not name.startswith("_")}
+    for name in public_methods:
+        method = getattr(repository, name)
+
+        def recorded(*args, _name=name, _method=method, **kwargs):
+            called.add(_name)
+            return _method(*args, **kwargs)
+
+        setattr(repository, name, recorded)
+
+    recorder.recording = True
+    exercise_repository(repository)
+    recorder.recording = False
+
+    assert public_methods - called == set(), "add the new repository methods to exercise_repository"
+
+    collection_scans_by_command = {}
+    for command in recorder.commands:
+        explain = database.command({"explain": command, "verbosity": "queryPlanner"})
+        scans = collection_scans(explain)
+        if scans:
+            collection_scans_by_command[str(command)] = scans
+
+    assert collection_scans_by_command == {}
@@ -0,0 +1,67 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import httpx
+from prometheus_client import REGISTRY
+
+from app.http_client import ServiceClient
+from app.metrics import InstrumentedSnapRepository, MetricsMiddleware, MongoCommandMetrics, metrics, repository_method
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class RecordingRepository:
+    def __init__(self, listener):
+        self.listener = listener
+
+    async def get_snap_by_id(self, snap_id):
+        self.listener.succeeded(SimpleNamespace(command_name="find", duration_micros=1500))
+        return {"id": snap_id}
+
+
+def test_mongo_commands_are_labelled_with_the_repository_method():
+    listener = MongoCommandMetrics()
+    repository = InstrumentedSnapRepository(RecordingRepository(listener))
+    before = sample("snapmsg_mongo_command_duration_seconds_count", repository_method="get_snap_by_id", command="find")
+
+    assert asyncio.run(repository.get_snap_by_id("snap")) == {"id": "snap"}
+
+    assert sample("snapmsg_mongo_command_duration_seconds_count", repository_method="get_snap_by_id", command="find") == before + 1
+    assert repository_method.get() == "other"
+
+
+def test_outbound_attempts_are_timed_by_status():
+    responses = iter([httpx.Response(503), httpx.Response(200)])
+    client = ServiceClient("metrics-test", "http://service", backoff=0, transport=httpx.MockTransport(lambda request: next(responses)))
+
+    asyncio.run(client.get("/profiles"))
+
+    for status in ("503", "200"):
+        assert sample("snapmsg_outbound_request_duration_seconds_count", service="metrics-test", method="GET", status=status) == 1
+
+
+def test_requests_are_timed_by_route_template():
+    async def endpoint(scope, receive, send):
+        scope["route"] = SimpleNamespace(path_regex=re.compile("^/(?P<snap_id>[^/]+)$"), path_format="/{snap_id}")
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    labels = {"method": "GET", "route": "/snaps/{snap_id}", "status": "404"}
+    before = sample("snapmsg_request_duration_seconds_count", **labels)
+
+    asyncio.run(MetricsMiddleware(endpoint)({"type": "http", "method": "GET", "path": "/snaps/abc"}, None, send))
+
+    assert sample("snapmsg_request_duration_seconds_count", **labels) == before + 1
+
+
+def test_metrics_endpoint_reports_threadpool_saturation():
+    response = asyncio.run(metrics())
+
+    assert b"snapmsg_threadpool_size" in response.body
+    assert sample("snapmsg_threadpool_busy") == 0
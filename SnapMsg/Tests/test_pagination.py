@@ -0,0 +1,62 @@
+import datetime
+
+from bson import ObjectId
+
+from app.pagination import decode_cursor, decode_score_cursor, encode_score_cursor, merge_pages
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def item(minute, item_id=None):
+    return {"_id": str(item_id or ObjectId()), "created_at": START + datetime.timedelta(minutes=minute)}
+
+
+def test_merge_pages_interleaves_sorted_sources():
+    first = [item(9), item(5), item(1)]
+    second = [item(8), item(4)]
+
+    page, cursor = merge_pages([first, second], 10)
+
+    assert page == [first[0], second[0], first[1], second[1], first[2]]
+    assert cursor is None
+
+
+def test_merge_pages_deduplicates_keeping_first_source():
+    shared_id = ObjectId()
+    timeline = [item(5, shared_id)]
+    relevant = [item(5, shared_id), item(3)]
+
+    page, _ = merge_pages([timeline, relevant], 10)
+
+    assert [snap["_id"] for snap in page] == [str(shared_id), relevant[1]["_id"]]
+    assert page[0] is timeline[0]
+
+
+def test_merge_pages_stops_consuming_sources_once_full():
+    consumed = []
+
+    def source(minutes):
+        for minute in minutes:
+            snap = item(minute)
+            consumed.append(minute)
+            yield snap
+
+    page, cursor = merge_pages([source([9, 7, 5, 3, 1]), source([8, 6, 4, 2, 0])], 3)
+
+    assert len(page) == 3
+    assert decode_cursor(cursor) == (page[-1]["created_at"], ObjectId(page[-1]["_id"]))
+    assert len(consumed) < 10
+
+
+def test_merge_pages_continues_after_full_source():
+    page, cursor = merge_pages([[item(2), item(1)], []], 2)
+
+    assert len(page) == 2
+    assert cursor is not None
+
+
+def test_score_cursor_round_trips_exactly():
+    item_id = ObjectId()
+    score = 19740.123456789012
+
+    assert decode_score_cursor(encode_score_cursor(score, item_id)) == (score, item_id)
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from app.db import db
+from app.repositories import SnapRepository, concurrently, run_synchronously
+
+
+async def answer(value):
+    return value
+
+
+def test_run_synchronously_awaits_calls_one_after_the_other():
+    async def calls():
+        return await concurrently(answer(1), answer(2))
+
+    assert run_synchronously(calls()) == [1, 2]
+
+
+def test_run_synchronously_refuses_coroutines_that_suspend():
+    async def suspends():
+        await asyncio.sleep(0)
+        return "never"
+
+    with pytest.raises(RuntimeError, match="suspended"):
+        run_synchronously(suspends())
+
+
+@pytest.fixture
+def snap_repository():
+    db.twitsnaps.drop()
+    db.hashtag_candidates.drop()
+    yield SnapRepository(db)
+    db.twitsnaps.drop()
+    db.hashtag_candidates.drop()
+
+
+def test_relevant_snaps_skip_candidates_blocked_since_listed(snap_repository):
+    snaps = [snap_repository.create_snap("author@example.com", f"Snap {number} #tag", False, ["#tag"], "author") for number in range(4)]
+    snap_repository.rebuild_hashtag_candidates(["#tag"])
+    db.twitsnaps.update_many({"_id": {"$in": [ObjectId(snap["_id"]) for snap in snaps[2:]]}}, {"$set": {"is_blocked": True}})
+
+    page = snap_repository.get_relevant_snaps(["tag"], None, 2)
+
+    assert [snap["_id"] for snap in page] == [snaps[1]["_id"], snaps[0]["_id"]]
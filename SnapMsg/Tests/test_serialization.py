@@ -0,0 +1,35 @@
+import datetime
+import json
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from app.serialization import SnapJSONResponse
+
+
+def snap(index):
+    return {
+        "_id": ObjectId(),
+        "email": "author@example.com",
+        "username": "author",
+        "message": f"Snap {index} #tag",
+        "created_at": datetime.datetime(2024, 1, 1, 12, 30, 15, 123456),
+        "is_private": False,
+        "hashtags": ["#tag"],
+        "likes": index,
+        "is_blocked": False,
+    }
+
+
+def test_encodes_like_jsonable_encoder():
+    content = {"data": [snap(index) for index in range(3)], "next_cursor": None}
+
+    encoded = json.loads(SnapJSONResponse(content).body)
+
+    assert encoded == json.loads(json.dumps(jsonable_encoder(content, custom_encoder={ObjectId: str})))
+    assert encoded["data"][0]["created_at"] == "2024-01-01T12:30:15.123456"
+    assert encoded["data"][0]["_id"] == str(content["data"][0]["_id"])
+
+
+def test_encodes_sets_as_lists():
+    assert json.loads(SnapJSONResponse({"tags": {"#tag"}}).body) == {"tags": ["#tag"]}
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+
+from bson import ObjectId
+from prometheus_client import REGISTRY
+
+from app.snap_cache import CachedSnapRepository, LocalSnapCache, RedisSnapCache
+
+SNAP_ID = str(ObjectId())
+
+
+class RecordingRepository:
+    def __init__(self):
+        self.snap = {"id": SNAP_ID, "message": "Hello", "likes": 0, "version": 0, "created_at": datetime.datetime(2024, 1, 1, 12, 30, 0, 123000)}
+        self.reads = 0
+
+    async def get_snap_version(self, snap_id):
+        self.reads += 1
+        return self.snap["version"]
+
+    async def get_snap_by_id(self, snap_id):
+        self.reads += 1
+        await asyncio.sleep(0)
+        return dict(self.snap) if isinstance(self.snap, dict) else self.snap
+
+    async def update_snap(self, snap_id, update_data):
+        self.snap["message"] = update_data
+        return 1
+
+    async def block_snap(self, snap_id, user_email):
+        self.snap = "Snap is blocked"
+        return 1
+
+    async def increment_snap_likes(self, likes):
+        self.snap["likes"] += likes[SNAP_ID]
+
+    async def get_all_snaps(self):
+        return [self.snap]
+
+
+class RedisStandIn:
+    """
+    Keeps the keys of the Redis commands used by RedisSnapCache in a dict.
+    """
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    async def aclose(self):
+        pass
+
+
+def test_reads_are_served_from_the_cache_until_a_write():
+    repository = RecordingRepository()
+    cached = CachedSnapRepository(repository, LocalSnapCache())
+
+    async def scenario():
+        first, second = await asyncio.gather(cached.get_snap_by_id(SNAP_ID), cached.get_snap_by_id(SNAP_ID))
+        first["message"] = "Changed by the caller"
+        assert (await cached.get_snap_by_id(SNAP_ID))["message"] == "Hello"
+        assert repository.reads == 1
+
+        await cached.update_snap(SNAP_ID, "Updated")
+        assert (await cached.get_snap_by_id(SNAP_ID))["message"] == "Updated"
+        await cached.increment_snap_likes({SNAP_ID: 2})
+        assert (await cached.get_snap_by_id(SNAP_ID))["likes"] == 2
+        await cached.block_snap(SNAP_ID, "admin@example.com")
+        assert await cached.get_snap_by_id(SNAP_ID) == "Snap is blocked"
+
+    asyncio.run(scenario())
+
+    assert repository.reads == 4
+    assert (cached.hits, cached.misses) == (2, 4)
+    assert cached.hit_rate == 2 / 6
+
+
+def test_versions_are_read_from_cached_snaps():
+    repository = RecordingRepository()
+    cached = CachedSnapRepository(repository, LocalSnapCache())
+
+    async def scenario():
+        assert await cached.get_snap_version(SNAP_ID) == 0
+        await cached.get_snap_by_id(SNAP_ID)
+        assert await cached.get_snap_version(SNAP_ID) == 0
+
+    asyncio.run(scenario())
+
+    assert repository.reads == 2
+
+
+def test_other_methods_reach_the_repository():
+    repository = RecordingRepository()
+    cached = CachedSnapRepository(repository, LocalSnapCache())
+
+    assert asyncio.run(cached.get_all_snaps()) == [repository.snap]
+
+
+def test_redis_cache_round_trips_snaps():
+    repository = RecordingRepository()
+    server = RedisStandIn()
+    cached = CachedSnapRepository(repository, RedisSnapCache(server))
+    hits, misses = (REGISTRY.get_sample_value(f"snapmsg_snap_cache_{outcome}_total", {"backend": "redis"}) or 0 for outcome in ("hits", "misses"))
+
+    async def scenario():
+        await cached.get_snap_by_id(SNAP_ID)
+        assert await cached.get_snap_by_id(SNAP_ID) == repository.snap
+        await cached.update_snap(SNAP_ID, "Updated")
+        assert server.values == {}
+        assert (await cached.get_snap_by_id(SNAP_ID))["message"] == "Updated"
+
+    asyncio.run(scenario())
+
+    assert repository.reads == 2
+    assert (cached.hits, cached.misses) == (1, 2)
+    assert REGISTRY.get_sample_value("snapmsg_snap_cache_hits_total", {"backend": "redis"}) == hits + 1
+    assert REGISTRY.get_sample_value("snapmsg_snap_cache_misses_total", {"backend": "redis"}) == misses + 2
+
+
+def test_redis_cache_falls_back_to_the_database():
+    class UnreachableServer(RedisStandIn):
+        async def get(self, key):
+            raise ConnectionError("cache unavailable")
+
+    repository = RecordingRepository()
+    cached = CachedSnapRepository(repository, RedisSnapCache(UnreachableServer()))
+
+    assert asyncio.run(cached.get_snap_by_id(SNAP_ID)) == repository.snap
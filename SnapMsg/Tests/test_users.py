@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+
+from app.http_client import ServiceClient
+from app.users import VerifiedUsersRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def verified_users_registry(handler, clock):
+    client = ServiceClient("profile", "http://profile", retries=0, transport=httpx.MockTransport(handler))
+    return VerifiedUsersRegistry(client, refresh_interval=60, clock=clock)
+
+
+def test_verified_users_are_refreshed_with_conditional_requests():
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=["johndoe", "janedoe"], headers={"ETag": '"v1"'})
+
+    clock = FakeClock()
+    registry = verified_users_registry(handler, clock)
+
+    assert asyncio.run(registry.get()) == frozenset({"johndoe", "janedoe"})
+    assert asyncio.run(registry.get()) == frozenset({"johndoe", "janedoe"})
+    assert len(requests) == 1
+
+    clock.now = 60
+    assert asyncio.run(registry.get()) == frozenset({"johndoe", "janedoe"})
+    assert len(requests) == 2
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+
+
+def test_verified_users_are_served_stale_when_profile_service_fails():
+    responses = [httpx.Response(200, json=["johndoe"]), httpx.Response(503), httpx.Response(500)]
+
+    def handler(request: httpx.Request):
+        return responses.pop(0)
+
+    clock = FakeClock()
+    registry = verified_users_registry(handler, clock)
+
+    assert asyncio.run(registry.get()) == frozenset({"johndoe"})
+    for _ in range(2):
+        clock.now += 60
+        assert asyncio.run(registry.get()) == frozenset({"johndoe"})
+    assert responses == []
+
+
+def test_concurrent_reads_share_one_refresh():
+    requests = []
+
+    async def handler(request: httpx.Request):
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=["johndoe"])
+
+    registry = verified_users_registry(handler, FakeClock())
+
+    async def read_concurrently():
+        return await asyncio.gather(*(registry.get() for _ in range(5)))
+
+    assert all(usernames == frozenset({"johndoe"}) for usernames in asyncio.run(read_concurrently()))
+    assert len(requests) == 1
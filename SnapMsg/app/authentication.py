@@ -1,20 +1,24 @@
+import hashlib
 from dotenv import load_dotenv
 from fastapi import HTTPException, Header
-import requests
 import os
 
-from .users import PROFILE_SERVICE_URL
+from .users import profile_client
+from .cache import TTLCache
+from .http_client import ServiceClient
 from .config import logger
+from .constants import IDENTITY_CACHE_MAXSIZE, IDENTITY_CACHE_TTL, INVALID_TOKEN_CACHE_TTL
 
 load_dotenv()
 
-def get_profile_by_email(email: str):
+async def get_profile_by_email(email: str):
     """
     Get a user profile by email.
     """
     logger.info(f"Getting profile by email {email}")
-    response = requests.get(
-        PROFILE_SERVICE_URL + f'/profiles/by-email?email={email}',
+    response = await profile_client.get(
+        '/profiles/by-email',
+        params={"email": email},
         headers={"accept": "application/json"}
     )
     
@@ -26,48 +30,88 @@ def get_profile_by_email(email: str):
 
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL")
 
-def get_user_from_token(token: str = Header(None)):
+auth_client = ServiceClient("auth", AUTH_SERVICE_URL)
+
+identity_cache = TTLCache(maxsize=IDENTITY_CACHE_MAXSIZE, ttl=IDENTITY_CACHE_TTL)
+
+
+async def get_email_from_token(token: str):
     """
-    This function gets the user from the token and keeps the token for further use.
+    Ask the auth service for the email of the token's owner.
     """
-    if not token:
-        raise HTTPException(status_code=401, detail="Token missing")
-
-    logger.info(f"Getting user email from token {token}")
-    response = requests.get(
-        AUTH_SERVICE_URL + "/auth/get-email-from-token",
+    response = await auth_client.get(
+        "/auth/get-email-from-token",
         headers={"Content-Type": "application/json"},
         json={"token": token}
     )
 
-    if response.status_code == 200:
-        user_email = response.json().get("email")
+    if response.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return response.json().get("email")
 
-        username = get_profile_by_email(user_email)["username"]
 
-        logger.info(f"User email: {user_email}")
-        return {"email": user_email, "token": token, "username": username}
-    else:
-        raise HTTPException(status_code=401, detail="Invalid token")
+async def resolve_cached_identity(kind: str, token: str, resolve):
+    """
+    Resolve the identity behind a token through the identity cache.
+
+    Identities are cached by a hash of the token and without it, so tokens are never kept
+    in the cache; the token of the request is added to the identity returned. Rejected
+    tokens are cached for a shorter time, and concurrent requests with the same token share
+    a single resolution.
+    """
+    key = (kind, hashlib.sha256(token.encode()).hexdigest())
+
+    async def load():
+        try:
+            return await resolve(token), None
+        except HTTPException as exc:
+            if exc.status_code != 401:
+                raise
+            return exc, INVALID_TOKEN_CACHE_TTL
+
+    identity = await identity_cache.get_or_load_async(key, load)
+    if isinstance(identity, HTTPException):
+        raise HTTPException(status_code=identity.status_code, detail=identity.detail)
+    return {**identity, "token": token}
+
+
+async def resolve_user(token: str):
+    """
+    Resolve the email and username of the user owning the token.
+    """
+    logger.info(f"Getting user email from token")
+    user_email = await get_email_from_token(token)
+    username = (await get_profile_by_email(user_email))["username"]
+
+    logger.info(f"User email: {user_email}")
+    return {"email": user_email, "username": username}
+
+
+async def resolve_admin(token: str):
+    """
+    Resolve the email of the admin user owning the token.
+    """
+    logger.info(f"Getting admin user email from token")
+    admin_user_email = await get_email_from_token(token)
+
+    logger.info(f"Admin User email: {admin_user_email}")
+    return {"email": admin_user_email}
+
+
+async def get_user_from_token(token: str = Header(None)):
+    """
+    This function gets the user from the token and keeps the token for further use.
+    """
+    if not token:
+        raise HTTPException(status_code=401, detail="Token missing")
+
+    return await resolve_cached_identity("user", token, resolve_user)
     
-def get_admin_from_token(token: str = Header(None)):
+async def get_admin_from_token(token: str = Header(None)):
     """
     This function gets the admin user from the token and keeps the token for further use.
     """
     if not token:
         raise HTTPException(status_code=401, detail="Token missing")
 
-    logger.info(f"Getting admin user email from token {token}")
-    response = requests.get(
-        AUTH_SERVICE_URL + "/auth/get-email-from-token",
-        headers={"Content-Type": "application/json"},
-        json={"token": token}
-    )
-
-    if response.status_code == 200:
-        admin_user_email = response.json().get("email")
-
-        logger.info(f"Admin User email: {admin_user_email}")
-        return {"email": admin_user_email, "token": token}
-    else:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+    return await resolve_cached_identity("admin", token, resolve_admin)
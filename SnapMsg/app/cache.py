@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe, bounded LRU cache whose entries expire after a time to live.
+
+    get_or_load and get_or_load_async make concurrent misses on the same key share a
+    single load.
+    """
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._loading: Dict[Hashable, Future] = {}
+        self._loading_async: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _get(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: Hashable, value: Any, ttl: Optional[float]):
+        self._entries[key] = (value, self.clock() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None):
+        """
+        Get the value cached under key, or default if it is missing or expired.
+        """
+        with self._lock:
+            value = self._get(key)
+        return default if value is _MISSING else value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Cache a value under key, for ttl seconds or the cache's default time to live.
+        """
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def delete(self, key: Hashable):
+        """
+        Remove key from the cache, if present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Tuple[Any, Optional[float]]]):
+        """
+        Get the value cached under key, calling load on a miss.
+
+        load returns the value and the time to live to cache it with (None for the default).
+        While a load is running, other callers asking for the same key wait for its result
+        instead of loading it again. Exceptions raised by load are not cached.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not _MISSING:
+                return value
+            flight = self._loading.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._loading[key] = Future()
+
+        if not leader:
+            return flight.result()
+
+        try:
+            value, ttl = load()
+        except BaseException as exc:
+            with self._lock:
+                del self._loading[key]
+            flight.set_exception(exc)
+            raise
+
+        with self._lock:
+            self._set(key, value, ttl)
+            del self._loading[key]
+        flight.set_result(value)
+        return value
+
+    async def get_or_load_async(self, key: Hashable, load: Callable[[], Awaitable[Tuple[Any, Optional[float]]]]):
+        """
+        Coroutine version of get_or_load, for loads that run on the event loop.
+
+        If the task running a load is cancelled, the tasks waiting for it start over.
+        """
+        while True:
+            with self._lock:
+                value = self._get(key)
+                if value is not _MISSING:
+                    return value
+                flight = self._loading_async.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._loading_async[key] = asyncio.get_running_loop().create_future()
+
+            if leader:
+                break
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+
+        try:
+            value, ttl = await load()
+        except BaseException as exc:
+            with self._lock:
+                del self._loading_async[key]
+            if isinstance(exc, Exception):
+                flight.set_exception(exc)
+                flight.exception()
+            else:
+                flight.cancel()
+            raise
+
+        with self._lock:
+            self._set(key, value, ttl)
+            del self._loading_async[key]
+        flight.set_result(value)
+        return value
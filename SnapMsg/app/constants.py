@@ -1 +1,73 @@
-MAX_MESSAGE_LENGTH = 280
\ No newline at end of file
+MAX_MESSAGE_LENGTH = 280
+
+# Timelines: authors with more followers than this are pulled at read time
+# instead of being pushed into every follower's timeline.
+FANOUT_MAX_FOLLOWERS = 1000
+TIMELINE_BACKFILL_SIZE = 200
+TIMELINE_MAX_ENTRIES = 800
+# A timeline pushed past TIMELINE_MAX_ENTRIES by this many entries is trimmed back to it.
+TIMELINE_TRIM_SLACK = 100
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Trending hashtags: scores are kept in hourly buckets and summed over a window.
+TRENDING_WINDOWS = {"1h": 1, "24h": 24, "7d": 24 * 7}
+TRENDING_DEFAULT_WINDOW = "24h"
+TRENDING_TOP_K = 5
+TRENDING_SNAP_SCORE = 10
+TRENDING_LIKE_SCORE = 1
+TRENDING_SHARE_SCORE = 2
+
+# Token to identity resolution: resolved identities and rejected tokens are cached
+# for a while to spare the round trips to the auth and profile services.
+IDENTITY_CACHE_MAXSIZE = 10000
+IDENTITY_CACHE_TTL = 60
+INVALID_TOKEN_CACHE_TTL = 10
+
+# Calls to other microservices: per-attempt timeout and overall deadline in seconds.
+HTTP_TIMEOUT = 5.0
+HTTP_DEADLINE = 10.0
+HTTP_RETRIES = 2
+HTTP_BACKOFF = 0.1
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_CIRCUIT_FAILURE_THRESHOLD = 5
+HTTP_CIRCUIT_RESET_TIMEOUT = 30.0
+
+# Verified users are refetched from the profile service every this many seconds.
+VERIFIED_USERS_REFRESH_INTERVAL = 60.0
+
+# Overall time budget, in seconds, to assemble a feed page from its sources.
+FEED_DEADLINE = 3.0
+
+# Write-behind counters: flush when this many counters have pending increments, or every interval seconds.
+WRITE_BEHIND_MAX_PENDING = 1000
+WRITE_BEHIND_FLUSH_INTERVAL = 1.0
+
+# Maximum number of snaps accepted by POST /snaps/batch.
+SNAP_BATCH_MAX_SIZE = 100
+
+# Maximum number of operations accepted by POST /snaps/interactions/batch.
+SNAP_INTERACTIONS_BATCH_MAX_SIZE = 100
+
+# Hashtag autocomplete: suggestions per prefix, and how often the in-memory dictionary is reloaded.
+HASHTAG_SUGGEST_TOP_K = 10
+HASHTAG_SUGGEST_REFRESH_INTERVAL = 60.0
+
+# Message search ranks by text relevance plus recency: a snap this many seconds newer gains
+# as much as one point of text score.
+SEARCH_RECENCY_SCALE = 86400
+
+# Relevant snaps: each hashtag keeps the ids of its newest snaps, and interests are served from these lists only.
+RELEVANT_CANDIDATES_PER_HASHTAG = 500
+
+# Snap cache in front of get_snap_by_id: entries kept by the in-process LRU, and seconds a cached snap may be served.
+SNAP_CACHE_MAXSIZE = 10000
+SNAP_CACHE_TTL = 30
+
+# Cache-Control of the conditional GET endpoints: snaps are revalidated with their ETag on
+# every poll, trending topics may be reused for a minute.
+CACHE_CONTROL_SNAP = "no-cache"
+CACHE_CONTROL_SNAP_LIST = "no-cache"
+CACHE_CONTROL_TRENDING = "public, max-age=60"
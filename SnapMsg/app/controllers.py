@@ -1,18 +1,58 @@
+import datetime
 import os
-from fastapi import APIRouter, Depends, HTTPException, status
-import requests
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
 
-from .users import get_followed_users, get_profile_by_username
+from .users import get_followed_users, get_profile_by_username, get_verified_users
 from .authentication import get_admin_from_token, get_user_from_token
-from .db import get_db, db
-from .constants import MAX_MESSAGE_LENGTH
-from .schemas import ErrorResponse, SnapCreate, SnapResponse, SnapUpdate
+from .db import MONGO_DRIVER, get_async_db, get_db, db
+from .constants import (
+    CACHE_CONTROL_SNAP,
+    CACHE_CONTROL_SNAP_LIST,
+    CACHE_CONTROL_TRENDING,
+    FEED_DEADLINE,
+    HASHTAG_SUGGEST_TOP_K,
+    MAX_MESSAGE_LENGTH,
+    TRENDING_DEFAULT_WINDOW,
+)
+from .pagination import PageParams, RankedPageParams, encode_score_cursor, merge_pages, next_cursor
+from .schemas import (
+    ErrorResponse,
+    SnapBatchCreate,
+    SnapBatchResponse,
+    SnapCreate,
+    SnapInteractionBatch,
+    SnapInteractionBatchResponse,
+    SnapResponse,
+    SnapUpdate,
+)
 from .services import SnapService
-from .repositories import SnapRepository
+from .repositories import AsyncSnapRepository, SnapRepository, ThreadedSnapRepository
+from .loaders import SnapLoader
+from .counters import DirectCounters, WriteBehindCounters
+from .feed import FeedAssembly
+from .snap_cache import CachedSnapRepository, create_snap_cache
+from .etags import conditional_json, not_modified, version_etag
+from .metrics import InstrumentedSnapRepository
+from .serialization import VIEWER_STATE_FIELDS, FieldsParams, SnapJSONResponse
 
 snap_router = APIRouter()
-snap_service = SnapService(SnapRepository(db),os.getenv("AUTH_SERVICE_URL"))
+snap_repository = InstrumentedSnapRepository(ThreadedSnapRepository(SnapRepository(db)) if MONGO_DRIVER == "sync" else AsyncSnapRepository(get_async_db))
+snap_cache = create_snap_cache()
+if snap_cache is not None:
+    snap_repository = CachedSnapRepository(snap_repository, snap_cache)
+counters = WriteBehindCounters(snap_repository) if os.getenv("WRITE_BEHIND_COUNTERS", "false").lower() == "true" else DirectCounters(snap_repository)
+snap_service = SnapService(snap_repository, os.getenv("AUTH_SERVICE_URL"), counters)
+
+
+def get_snap_loader(fields: FieldsParams = Depends()):
+    """
+    Provides a snap loader shared by everything that runs during one request, fetching the
+    requested fields.
+    """
+    return SnapLoader(snap_service.snap_repository, fields.stored)
+
 
 @snap_router.post(
         "/",
@@ -24,7 +64,7 @@ snap_service = SnapService(SnapRepository(db),os.getenv("AUTH_SERVICE_URL"))
             status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse},
             status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse},
         })
-def create_snap(snap: SnapCreate, user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def create_snap(snap: SnapCreate, user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
     """
     Create a new TwitSnap post for authenticated users.
     """
@@ -34,40 +74,56 @@ def create_snap(snap: SnapCreate, user_data: dict = Depends(get_user_from_token)
     if len(snap.message) > MAX_MESSAGE_LENGTH:
         raise HTTPException(status_code=400, detail="Message exceeds 280 characters.")
     
-    snap_created = snap_service.create_snap(db, user_email, snap.message, snap.is_private, username)
+    snap_created = await snap_service.create_snap(db, user_email, snap.message, snap.is_private, username)
     return {"data":{ "id": snap_created["_id"], "message": snap_created["message"], "is_private": snap_created["is_private"], "hashtags": snap_created["hashtags"]}}
 
 
+@snap_router.post(
+        "/batch",
+        summary="Create several TwitSnaps",
+        response_model=SnapBatchResponse,
+        status_code=status.HTTP_207_MULTI_STATUS,
+        responses={
+            status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse},
+        })
+async def create_snaps(batch: SnapBatchCreate, user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+    """
+    Create several TwitSnap posts at once, reporting the result of each one in order.
+    """
+    results = await snap_service.create_snaps(db, user_data["email"], batch.snaps, user_data["username"], batch.ordered)
+    return {"data": results}
+
+
 @snap_router.put("/{snap_id}", response_model=SnapResponse)
-def update_snap(snap_id: str, snap_update: SnapUpdate, user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def update_snap(snap_id: str, snap_update: SnapUpdate, user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
     """
     Update a TwitSnap post, only if the user is the owner.
     """
     user_email = user_data["email"]
-    snap_service.update_snap(db, user_email, snap_id, snap_update)
+    await snap_service.update_snap(db, user_email, snap_id, snap_update)
 
     return {"data": {"id": snap_id, "message": snap_update.message, "is_private": snap_update.is_private, "hashtags": snap_update.hashtags}}
 
 
 @snap_router.delete("/{snap_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_snap(snap_id: str, user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def delete_snap(snap_id: str, user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
     """
     Delete a TwitSnap post, only if the user is the owner.
     """
     user_email = user_data["email"]
-    snap_service.delete_snap(db, snap_id, user_email)
+    await snap_service.delete_snap(db, snap_id, user_email)
     return {"detail": "Snap deleted successfully"}
 
 
 @snap_router.get("/")
-def get_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def get_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db), page: PageParams = Depends(), fields: FieldsParams = Depends()):
     """
     Get all public or private TwitSnaps based on the user's following status.
     """
     user_email = user_data["email"]
-    snaps = snap_service.get_snaps(db, user_email)
+    snaps = await snap_service.get_snaps(db, user_email, page.after, page.limit, fields.stored)
 
-    return {"data": snaps}
+    return SnapJSONResponse({"data": fields.select(snaps), "next_cursor": next_cursor(snaps, page.limit)})
 
 @snap_router.get(
     "/all-snaps",
@@ -78,219 +134,270 @@ def get_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depe
         status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ErrorResponse},
     }
 )
-def get_all_snaps(db: Session = Depends(get_db)):
+async def get_all_snaps(db: Session = Depends(get_db), page: PageParams = Depends(), fields: FieldsParams = Depends()):
     """
     Fetch all public and private TwitSnaps.
     """
-    snaps = snap_service.get_all_snaps(db)
-    return {"data": snaps}
+    snaps = await snap_service.get_all_snaps(db, page.after, page.limit, fields.stored)
+    return SnapJSONResponse({"data": fields.select(snaps), "next_cursor": next_cursor(snaps, page.limit)})
 
 @snap_router.get("/feed/", summary="Get TwitSnaps for feed")
-def get_feed_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def get_feed_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db), page: PageParams = Depends(), snap_loader: SnapLoader = Depends(get_snap_loader), fields: FieldsParams = Depends()):
     """
     Get TwitSnaps from followed users and relevant content snaps.
+
+    The sources of the feed run concurrently within FEED_DEADLINE seconds. Relevant snaps,
+    verified badges and viewer state are optional: when one of them fails or is late the
+    feed is returned without it and marked as partial. Per-source timings are returned in
+    the Server-Timing header. Annotations left out of the requested fields are not computed.
     """
     token = user_data["token"]
     username = user_data["username"]
     email = user_data["email"]
 
-    followed_users = get_followed_users(token, username)
-
-    followed_snaps = snap_service.get_snaps_from_followed_users(db, followed_users)
-
-    interest = get_profile_by_username(username)["interests"]
-
-    relevant_snaps = snap_service.get_relevant_snaps(interest)
-
-    retweets = snap_service.get_followed_retweeted_snaps(followed_users)
+    feed = FeedAssembly(FEED_DEADLINE)
 
-    snaps = followed_snaps + relevant_snaps + retweets
+    async def timeline():
+        followed_users = await feed.add("followed", get_followed_users(token, username))
+        return await snap_service.get_timeline_snaps(email, followed_users, page.after, page.limit, snap_loader, fields.stored)
 
-    snaps = sorted(snaps, key=lambda x: x["created_at"], reverse=True)
+    async def relevant():
+        profile = await feed.add("profile", get_profile_by_username(username))
+        return await snap_service.get_relevant_snaps(profile["interests"], page.after, page.limit, fields.stored)
 
-    response = requests.get(f"https://profile-microservice.onrender.com/profiles/verified-users")
-    verified_users = response.json()
+    try:
+        feed.add("timeline", timeline())
+        feed.add("relevant", relevant())
+        if fields.wants("is_verified"):
+            feed.add("verified", get_verified_users())
 
-    print("email: ", email)
-    shared = snap_service.get_shared_snaps(email)
-    liked = snap_service.get_liked_snaps(email)
-    favourited = snap_service.get_favourite_snaps(email)
+        timeline_pages = await feed.result("timeline")
+        relevant_snaps = await feed.result("relevant", [])
+        snaps, cursor = merge_pages(timeline_pages + [relevant_snaps], page.limit)
 
-    print("shared", [x["id"] for x in shared])
-    print("liked", [x["id"] for x in liked])
-    print("favourited", [x["id"] for x in favourited])
-    print("verified", verified_users)
+        viewer_state = [flag for flag in VIEWER_STATE_FIELDS if fields.wants(flag)]
+        if viewer_state:
+            for snap in snaps:
+                snap.update(dict.fromkeys(viewer_state, False))
+            feed.add("viewer_state", snap_service.annotate_viewer_state(email, snaps, viewer_state))
+            await feed.result("viewer_state", None)
 
+        if fields.wants("is_verified"):
+            verified_users = await feed.result("verified", frozenset())
+            for snap in snaps:
+                snap["is_verified"] = snap["username"] in verified_users
+    finally:
+        feed.cancel()
 
-    for snap in snaps:
-        snap["is_shared"] = snap["_id"] in [x["id"] for x in shared]
-        snap["is_liked"] = snap["_id"] in [x["id"] for x in liked]
-        snap["is_favourited"] = snap["_id"] in [x["id"] for x in favourited]
-        snap["is_verified"] = snap["username"] in verified_users
-
-
-    snaps = list({dic["_id"]: dic for dic in snaps}.values())
-
-    return {"data": snaps}
+    return SnapJSONResponse(
+        {"data": fields.select(snaps), "next_cursor": cursor, "partial": feed.partial},
+        headers={"Server-Timing": feed.server_timing()},
+    )
 
 
 @snap_router.get("/by-hashtag", summary="Search snaps by hashtag")
-def search_snaps(hashtag: str, db: Session = Depends(get_db)):
+async def search_snaps(hashtag: str, db: Session = Depends(get_db), page: PageParams = Depends(), fields: FieldsParams = Depends()):
     """
     Search for TwitSnaps by hashtag.
     """
-    snaps = snap_service.search_snaps_by_hashtag(db, hashtag)
-    return {"data": snaps}
+    snaps = await snap_service.search_snaps_by_hashtag(db, hashtag, page.after, page.limit, fields.stored)
+    return SnapJSONResponse({"data": fields.select(snaps), "next_cursor": next_cursor(snaps, page.limit)})
+
+@snap_router.get("/search", summary="Search snaps by text")
+async def search_snaps_by_text(q: str, page: RankedPageParams = Depends(), fields: FieldsParams = Depends()):
+    """
+    Search for TwitSnaps whose message contains the words of q, best matches and newest first.
+    """
+    snaps = await snap_service.search_snaps(q, page.after, page.limit, fields.stored)
+    cursor = encode_score_cursor(snaps[-1]["rank"], snaps[-1]["_id"]) if len(snaps) == page.limit else None
+    return SnapJSONResponse({"data": fields.select(snaps), "next_cursor": cursor})
 
 @snap_router.get("/{snap_id}", response_model=SnapResponse)
-def get_snap(snap_id: str, db: Session = Depends(get_db)):
+async def get_snap(snap_id: str, request: Request, response: Response, db: Session = Depends(get_db)):
     """
     Get a Snap post by ID.
-    """
-    snap = snap_service.get_snap_by_id(db, snap_id)
-    if snap:
-        return {"data": snap}
-    raise HTTPException(status_code=404, detail="Snap not found.")
+
+    The ETag comes from the snap's version, so a client that already has it gets a 304
+    after reading only the version, without loading the snap.
+    """
+    if request.headers.get("if-none-match"):
+        version = await snap_service.get_snap_version(snap_id)
+        cached = version is not None and not_modified(request, version_etag(snap_id, version), CACHE_CONTROL_SNAP)
+        if cached:
+            return cached
+    snap = await snap_service.get_snap_by_id(db, snap_id)
+    if not snap:
+        raise HTTPException(status_code=404, detail="Snap not found.")
+    etag = version_etag(snap["id"], snap.get("version", 0))
+    cached = not_modified(request, etag, CACHE_CONTROL_SNAP)
+    if cached:
+        return cached
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL_SNAP
+    return {"data": snap}
 
 @snap_router.post("/like", summary="Like a snap")
-def like_snap(snap_id: str, user_data: dict = Depends(get_user_from_token)):
+async def like_snap(snap_id: str, user_data: dict = Depends(get_user_from_token)):
     """
     Like a Snap post.
     """
     user_email = user_data["email"]
     username = user_data["username"]
-    snap_service.like_snap(snap_id, user_email, username)
+    await snap_service.like_snap(snap_id, user_email, username)
     return {"detail": "Snap liked successfully"}
 
 @snap_router.post("/unlike", summary="Unlike a snap")
-def unlike_snap(snap_id: str, user_data: dict = Depends(get_user_from_token)):
+async def unlike_snap(snap_id: str, user_data: dict = Depends(get_user_from_token)):
     """
     Unlike a Snap post.
     """
     user_email = user_data["email"]
-    snap_service.unlike_snap(snap_id, user_email)
+    await snap_service.unlike_snap(snap_id, user_email)
     return {"detail": "Snap unliked successfully"}
 
+@snap_router.post(
+        "/interactions/batch",
+        summary="Apply several likes, favourites and shares",
+        response_model=SnapInteractionBatchResponse,
+        status_code=status.HTTP_207_MULTI_STATUS,
+        responses={
+            status.HTTP_401_UNAUTHORIZED: {"model": ErrorResponse},
+        })
+async def apply_interactions(batch: SnapInteractionBatch, user_data: dict = Depends(get_user_from_token)):
+    """
+    Apply a batch of interactions with Snap posts in order, reporting the result of each one.
+    """
+    results = await snap_service.apply_interactions(user_data["email"], user_data["username"], batch.operations)
+    return {"data": results}
+
 @snap_router.get("/liked/", summary="Get user's liked snaps")
-def get_liked_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def get_liked_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db), snap_loader: SnapLoader = Depends(get_snap_loader), fields: FieldsParams = Depends()):
     """
     Get all Snap posts liked by the user.
     """
     user_email = user_data["email"]
-    snaps = snap_service.get_liked_snaps(user_email)
+    snaps = await snap_service.get_liked_snaps(user_email, snap_loader)
 
-    return {"data": snaps}
+    return SnapJSONResponse({"data": fields.select(snaps)})
 
 @snap_router.post("/favourite", summary="Favourite a snap")
-def favourite_snap(snap_id: str, user_data: dict = Depends(get_user_from_token)):
+async def favourite_snap(snap_id: str, user_data: dict = Depends(get_user_from_token)):
     """
     Favourite a Snap post.
     """
     user_email = user_data["email"]
-    snap_service.favourite_snap(snap_id, user_email)
+    await snap_service.favourite_snap(snap_id, user_email)
     return {"detail": "Snap favourited successfully"}
 
 @snap_router.post("/unfavourite", summary="Unfavourite a snap")
-def unfavourite_snap(snap_id: str, user_data: dict = Depends(get_user_from_token)):
+async def unfavourite_snap(snap_id: str, user_data: dict = Depends(get_user_from_token)):
     """
     Unfavourite a Snap post.
     """
     user_email = user_data["email"]
-    snap_service.unfavourite_snap(snap_id, user_email)
+    await snap_service.unfavourite_snap(snap_id, user_email)
     return {"detail": "Snap unfavourited successfully"}
 
 @snap_router.get("/favourites/", summary="Get user's favourite snaps")
-def get_favourite_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def get_favourite_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db), snap_loader: SnapLoader = Depends(get_snap_loader), fields: FieldsParams = Depends()):
     """
     Get all Snap posts favourited by the user.
     """
     user_email = user_data["email"]
-    snaps = snap_service.get_favourite_snaps(user_email)
+    snaps = await snap_service.get_favourite_snaps(user_email, snap_loader)
 
-    return {"data": snaps}
+    return SnapJSONResponse({"data": fields.select(snaps)})
 
 
 @snap_router.get("/by-username/{username}", summary="Get TwitSnaps by username")
-def get_snaps_by_username(
+async def get_snaps_by_username(
     username: str,  
-    db: Session = Depends(get_db)
+    request: Request,
+    db: Session = Depends(get_db),
+    page: PageParams = Depends(),
+    snap_loader: SnapLoader = Depends(get_snap_loader),
+    fields: FieldsParams = Depends()
 ):
     """
     Get TwitSnaps for a particular user based on their username.
     """
-    user_email = get_profile_by_username(username)["email"]
+    user_email = (await get_profile_by_username(username))["email"]
     
-    snaps = snap_service.get_snaps(db, user_email)
-    for snap in snaps:
-        snap["retweet_user"] = ""
+    snaps, cursor = await snap_service.get_snaps_and_retweets(user_email, page.after, page.limit, snap_loader, fields.stored)
 
-    retweeted_snaps = snap_service.get_retweeted_snaps(user_email)
-
-    return {"data": sorted(snaps + retweeted_snaps, key=lambda x: x["created_at"], reverse=True)}
+    return conditional_json(request, {"data": fields.select(snaps), "next_cursor": cursor}, CACHE_CONTROL_SNAP_LIST)
 
 @snap_router.post("/block", summary="Block a twitsnap")
-def block_snap(snap_id: str, user_data: dict = Depends(get_admin_from_token)):
+async def block_snap(snap_id: str, user_data: dict = Depends(get_admin_from_token)):
     """
     Block a Snap post.
     """
     user_email = user_data["email"]
-    snap_service.block_snap(snap_id, user_email)
+    await snap_service.block_snap(snap_id, user_email)
     return {"detail": "Snap blocked successfully"}
 
 @snap_router.post("/unblock", summary="Unblocke a twitsnap")
-def unblock_snap(snap_id: str, user_data: dict = Depends(get_admin_from_token)):
+async def unblock_snap(snap_id: str, user_data: dict = Depends(get_admin_from_token)):
     """
     Unblock a Snap post.
     """
     user_email = user_data["email"]
-    snap_service.unblock_snap(snap_id, user_email)
+    await snap_service.unblock_snap(snap_id, user_email)
     return {"detail": "Snap unblocked successfully"}
 
 @snap_router.get("/unblocked/", summary="Get unblocked snaps")
-def get_unblocked_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def get_unblocked_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db), fields: FieldsParams = Depends()):
     """
     Get all unblocked Snap posts.
     """
     user_email = user_data["email"]
-    snaps = snap_service.get_unblocked_snaps(user_email)
+    snaps = await snap_service.get_unblocked_snaps(user_email, fields.stored)
 
-    return {"data": snaps}
+    return SnapJSONResponse({"data": fields.select(snaps)})
 
 @snap_router.get("/trending-topics/", summary="Get trending hashtags")
-def get_trending_hashtags():
+async def get_trending_hashtags(request: Request, window: str = TRENDING_DEFAULT_WINDOW):
+    """
+    Get trending hashtags based on Snap posts, over the last 1h, 24h or 7d.
+    """
+    hashtags = await snap_service.get_trending_hashtags(window)
+    return conditional_json(request, {"data": hashtags}, CACHE_CONTROL_TRENDING)
+
+@snap_router.get("/hashtags/suggest", summary="Autocomplete hashtags")
+async def suggest_hashtags(prefix: str, limit: int = Query(HASHTAG_SUGGEST_TOP_K, ge=1, le=HASHTAG_SUGGEST_TOP_K)):
     """
-    Get trending hashtags based on Snap posts.
+    Get the most used hashtags starting with a prefix, most used first.
     """
-    hashtags = snap_service.get_trending_hashtags()
+    hashtags = await snap_service.suggest_hashtags(prefix, limit)
     return {"data": hashtags}
 
 @snap_router.post("/snap-share", summary="Retweet a snap")
-def snap_share(snap_id: str, user_data: dict = Depends(get_user_from_token)):
+async def snap_share(snap_id: str, user_data: dict = Depends(get_user_from_token)):
     """
     Retweet a Snap post.
     """
     user_email = user_data["email"]
     username = user_data["username"]
-    snap_service.snap_share(snap_id, user_email, username)
+    await snap_service.snap_share(snap_id, user_email, username)
     return {"detail": "Snap shared successfully"}
 
 @snap_router.get("/shared/", summary="Get shared snaps")
-def get_shared_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db)):
+async def get_shared_snaps(user_data: dict = Depends(get_user_from_token), db: Session = Depends(get_db), snap_loader: SnapLoader = Depends(get_snap_loader), fields: FieldsParams = Depends()):
     """
     Get all Snap posts shared by the user.
     """
     user_email = user_data["email"]
-    snaps = snap_service.get_shared_snaps(user_email)
+    snaps = await snap_service.get_shared_snaps(user_email, snap_loader)
 
-    return {"data": snaps}
+    return SnapJSONResponse({"data": fields.select(snaps)})
 
 
 @snap_router.get("/users-interactions/", summary="Get users iteractions with my snaps")
-def get_users_interactions(user_data: dict = Depends(get_user_from_token)):
+async def get_users_interactions(user_data: dict = Depends(get_user_from_token), page: PageParams = Depends(), since: Optional[datetime.datetime] = None):
     """
-    Get all users who interacted with user's Snap posts.
+    Get all users who interacted with user's Snap posts, optionally only since a given time.
     """
     user_email = user_data["email"]
-    users = snap_service.get_users_liked_and_retweeted_snaps(user_email)
+    users, cursor = await snap_service.get_users_liked_and_retweeted_snaps(user_email, page.after, page.limit, since)
 
-    return {"data": users}
\ No newline at end of file
+    return SnapJSONResponse({"data": users, "next_cursor": cursor})
\ No newline at end of file
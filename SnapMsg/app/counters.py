@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import datetime
+from collections import Counter
+from typing import Dict, Hashable, List, Optional
+
+from .config import logger
+from .constants import WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_MAX_PENDING
+from .repositories import AsyncSnapRepository
+
+# Pending increments by counter name ("likes" or "hashtag_scores"), then by key.
+CounterBatch = Dict[str, Dict[Hashable, int]]
+
+
+def hashtag_scores(hashtags: List[str], bucket: datetime.datetime, amount: int) -> Dict[tuple, int]:
+    """
+    Score increments for each hashtag occurrence in the bucket, keyed by (hashtag, bucket).
+    """
+    return {(hashtag, bucket): amount * occurrences for hashtag, occurrences in Counter(hashtags).items()}
+
+
+class DirectCounters:
+    """
+    Writes the likes counters and hashtag scores to the database right away.
+    """
+    def __init__(self, snap_repository: AsyncSnapRepository):
+        self.snap_repository = snap_repository
+
+    async def add_likes(self, snap_id: str, amount: int):
+        await self.snap_repository.increment_snap_likes({snap_id: amount})
+
+    async def add_hashtag_scores(self, hashtags: List[str], bucket: datetime.datetime, amount: int):
+        await self.snap_repository.increment_hashtag_scores(hashtag_scores(hashtags, bucket, amount))
+
+    async def add_many_likes(self, likes: Dict[str, int]):
+        await self.snap_repository.increment_snap_likes(likes)
+
+    async def add_many_hashtag_scores(self, scores: Dict[tuple, int]):
+        await self.snap_repository.increment_hashtag_scores(scores)
+
+    async def flush(self):
+        pass
+
+    async def flush_likes(self, snap_id: str):
+        pass
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class WriteBehindHooks:
+    """
+    Extension points of WriteBehindCounters, e.g. to journal the increments not written yet.
+    """
+    def recorded(self, counter: str, key: Hashable, amount: int):
+        """
+        An increment was buffered.
+        """
+
+    def flushed(self, counter: str, increments: Dict[Hashable, int]):
+        """
+        The buffered increments of a counter were written.
+        """
+
+    def failed(self, counter: str, increments: Dict[Hashable, int], exc: Exception):
+        """
+        Writing the buffered increments of a counter failed; they are kept for the next flush.
+        """
+
+
+class WriteBehindCounters:
+    """
+    Buffers the likes counters and hashtag scores in memory and writes them in bulk.
+
+    Increments to the same snap or (hashtag, bucket) are coalesced, so a burst of likes on
+    one snap becomes a single $inc. Buffered increments are written when max_pending keys
+    are waiting, every flush_interval seconds once start has been called, and on stop.
+    Increments not written yet are lost if the process dies; hooks can journal them.
+    """
+    def __init__(
+        self,
+        snap_repository: AsyncSnapRepository,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+        hooks: Optional[WriteBehindHooks] = None,
+    ):
+        self.snap_repository = snap_repository
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.hooks = hooks or WriteBehindHooks()
+        self.pending: CounterBatch = {"likes": {}, "hashtag_scores": {}}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return sum(len(increments) for increments in self.pending.values())
+
+    async def _add(self, counter: str, key: Hashable, amount: int):
+        increments = self.pending[counter]
+        increments[key] = increments.get(key, 0) + amount
+        self.hooks.recorded(counter, key, amount)
+        if len(self) >= self.max_pending:
+            await self.flush()
+
+    async def add_likes(self, snap_id: str, amount: int):
+        await self._add("likes", snap_id, amount)
+
+    async def add_hashtag_scores(self, hashtags: List[str], bucket: datetime.datetime, amount: int):
+        for key, score in hashtag_scores(hashtags, bucket, amount).items():
+            await self._add("hashtag_scores", key, score)
+
+    async def add_many_likes(self, likes: Dict[str, int]):
+        for snap_id, amount in likes.items():
+            await self._add("likes", snap_id, amount)
+
+    async def add_many_hashtag_scores(self, scores: Dict[tuple, int]):
+        for key, score in scores.items():
+            await self._add("hashtag_scores", key, score)
+
+    async def _write(self, counter: str, increments: Dict[Hashable, int]):
+        """
+        Write increments of a counter, putting them back in the buffer if the write fails.
+        """
+        increments = {key: amount for key, amount in increments.items() if amount}
+        if not increments:
+            return
+        writers = {
+            "likes": self.snap_repository.increment_snap_likes,
+            "hashtag_scores": self.snap_repository.increment_hashtag_scores,
+        }
+        try:
+            await writers[counter](increments)
+        except Exception as exc:
+            logger.error(f"Could not write {len(increments)} buffered {counter} increments: {exc}")
+            for key, amount in increments.items():
+                self.pending[counter][key] = self.pending[counter].get(key, 0) + amount
+            self.hooks.failed(counter, increments, exc)
+        else:
+            self.hooks.flushed(counter, increments)
+
+    async def flush(self):
+        """
+        Write the buffered increments.
+        """
+        batch, self.pending = self.pending, {counter: {} for counter in self.pending}
+        for counter, increments in batch.items():
+            await self._write(counter, increments)
+
+    async def flush_likes(self, snap_id: str):
+        """
+        Write the buffered likes increment of one snap, leaving the others buffered.
+        """
+        amount = self.pending["likes"].pop(snap_id, 0)
+        await self._write("likes", {snap_id: amount})
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """
+        Flush the buffered increments every flush_interval seconds from a background task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """
+        Stop the periodic flush and write what is still buffered.
+        """
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        await self.flush()
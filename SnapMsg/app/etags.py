@@ -0,0 +1,54 @@
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request, Response, status
+
+from .serialization import dumps
+
+
+def version_etag(item_id: str, version: int) -> str:
+    """
+    ETag of a document that bumps its version on every change, known before building the body.
+    """
+    return f'"{item_id}.{version}"'
+
+
+def content_etag(body: bytes) -> str:
+    """
+    ETag of an encoded response body.
+    """
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header lists the ETag, comparing weakly as GET requests do.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def not_modified(request: Request, etag: str, cache_control: str) -> Optional[Response]:
+    """
+    A 304 response if the request already holds the ETag, None otherwise.
+    """
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+def conditional_json(request: Request, content: Any, cache_control: str) -> Response:
+    """
+    Encode content once and answer with it, tagged with a hash of the body, or with a 304
+    if the request already holds it.
+    """
+    body = dumps(content)
+    etag = content_etag(body)
+    return not_modified(request, etag, cache_control) or Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": cache_control},
+    )
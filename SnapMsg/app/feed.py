@@ -0,0 +1,86 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from fastapi import HTTPException
+
+from .config import logger
+
+_REQUIRED = object()
+
+
+class FeedAssembly:
+    """
+    Runs the sources of a feed page concurrently under one overall deadline.
+
+    Each source is started as a task as soon as it is added, so sources that depend on
+    others can await them while the independent ones keep running. Essential sources must
+    finish before the deadline. Optional sources that fail or miss it are replaced by a
+    default value and the feed is marked as partial.
+    """
+    def __init__(self, deadline: float, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.deadline_at = clock() + deadline
+        self.timings: Dict[str, float] = {}
+        self.missing: List[str] = []
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.missing)
+
+    def add(self, name: str, source: Awaitable) -> asyncio.Task:
+        """
+        Start running a source.
+        """
+        async def timed():
+            started = self.clock()
+            try:
+                return await source
+            finally:
+                self.timings[name] = self.clock() - started
+
+        task = self._tasks[name] = asyncio.ensure_future(timed())
+        return task
+
+    async def result(self, name: str, default: Any = _REQUIRED):
+        """
+        Wait for the result of a source until the deadline.
+
+        Without a default the source is essential: missing the deadline raises HTTPException
+        504 and its errors propagate. With a default, the default is returned instead.
+        """
+        task = self._tasks[name]
+        await asyncio.wait({task}, timeout=max(self.deadline_at - self.clock(), 0))
+
+        if default is _REQUIRED:
+            if not task.done():
+                self.cancel()
+                logger.warning(f"Feed source {name} missed the deadline")
+                raise HTTPException(status_code=504, detail="The feed could not be assembled in time.")
+            return task.result()
+
+        if not task.done():
+            task.cancel()
+            logger.warning(f"Feed source {name} missed the deadline, serving a partial feed")
+        elif task.cancelled():
+            logger.warning(f"Feed source {name} was cancelled, serving a partial feed")
+        elif task.exception() is not None:
+            logger.warning(f"Feed source {name} failed, serving a partial feed: {task.exception()!r}")
+        else:
+            return task.result()
+        self.missing.append(name)
+        return default
+
+    def cancel(self):
+        """
+        Cancel the sources that are still running.
+        """
+        for task in self._tasks.values():
+            task.cancel()
+
+    def server_timing(self) -> str:
+        """
+        Durations of the sources, in the format of the Server-Timing header.
+        """
+        return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in self.timings.items())
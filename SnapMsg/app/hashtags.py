@@ -0,0 +1,177 @@
+import asyncio
+import contextlib
+import heapq
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .config import logger
+from .constants import HASHTAG_SUGGEST_REFRESH_INTERVAL, HASHTAG_SUGGEST_TOP_K
+from .repositories import AsyncSnapRepository
+
+
+def hashtag_usage(removed: Iterable[str] = (), added: Iterable[str] = ()) -> Dict[str, int]:
+    """
+    Usage count changes when a snap stops using the removed hashtags and starts using the added ones.
+    """
+    removed, added = set(removed), set(added)
+    usage = {hashtag: 1 for hashtag in added - removed}
+    usage.update((hashtag, -1) for hashtag in removed - added)
+    return usage
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # The most used hashtags below the node as (-count, hashtag), None until computed.
+        self.top: Optional[List[Tuple[int, str]]] = []
+
+
+class HashtagTrie:
+    """
+    Prefix tree of hashtags answering the top_k most used hashtags starting with a prefix.
+
+    Every node keeps its top hashtags, updated in place when a count grows, so a lookup only
+    walks the prefix. When a count shrinks the nodes listing that hashtag drop their top,
+    which is recomputed from their subtree on the next lookup.
+    """
+    def __init__(self, top_k: int = HASHTAG_SUGGEST_TOP_K):
+        self.top_k = top_k
+        self.root = _Node()
+        self.counts: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _path(self, hashtag: str, create: bool) -> List[_Node]:
+        path = [self.root]
+        for char in hashtag:
+            node = path[-1].children.get(char)
+            if node is None:
+                if not create:
+                    return []
+                node = path[-1].children[char] = _Node()
+            path.append(node)
+        return path
+
+    def add(self, hashtag: str, amount: int):
+        """
+        Add amount, which may be negative, to the usage count of hashtag.
+        """
+        count = self.counts.get(hashtag, 0) + amount
+        if count > 0:
+            self.counts[hashtag] = count
+        else:
+            self.counts.pop(hashtag, None)
+
+        for node in self._path(hashtag, create=amount > 0):
+            if node.top is None:
+                continue
+            listed = any(entry[1] == hashtag for entry in node.top)
+            if amount < 0 and listed:
+                node.top = None
+            elif amount > 0 and (listed or len(node.top) < self.top_k or (-count, hashtag) < node.top[-1]):
+                node.top = sorted([entry for entry in node.top if entry[1] != hashtag] + [(-count, hashtag)])[:self.top_k]
+
+    def _compute_top(self, node: _Node, prefix: str) -> List[Tuple[int, str]]:
+        candidates = []
+        stack = [(node, prefix)]
+        while stack:
+            node, word = stack.pop()
+            if word in self.counts:
+                candidates.append((-self.counts[word], word))
+            stack.extend((child, word + char) for char, child in node.children.items())
+        return heapq.nsmallest(self.top_k, candidates)
+
+    def suggest(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Get the most used hashtags starting with prefix, most used first.
+        """
+        path = self._path(prefix, create=False)
+        if not path:
+            return []
+        node = path[-1]
+        if node.top is None:
+            node.top = self._compute_top(node, prefix)
+        return [hashtag for _, hashtag in node.top[:limit]]
+
+
+class HashtagSuggestions:
+    """
+    Hashtag autocomplete served from an in-memory HashtagTrie.
+
+    The usage counts are stored in the database and updated by every snap write; the writes
+    made by this instance are applied to the trie right away, and the whole dictionary is
+    reloaded every refresh_interval seconds to pick up the writes of other instances.
+    When no counts are stored yet they are rebuilt from the snaps.
+    """
+    def __init__(self, snap_repository: AsyncSnapRepository, refresh_interval: float = HASHTAG_SUGGEST_REFRESH_INTERVAL, top_k: int = HASHTAG_SUGGEST_TOP_K):
+        self.snap_repository = snap_repository
+        self.refresh_interval = refresh_interval
+        self.top_k = top_k
+        self.trie: Optional[HashtagTrie] = None
+        self._refreshing: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def record(self, usage: Dict[str, int]):
+        """
+        Store changes to the usage counts of hashtags, as built by hashtag_usage.
+        """
+        usage = {hashtag: amount for hashtag, amount in usage.items() if amount}
+        if not usage:
+            return
+        await self.snap_repository.increment_hashtag_counts(usage)
+        if self.trie is not None:
+            for hashtag, amount in usage.items():
+                self.trie.add(hashtag, amount)
+
+    async def _load(self):
+        counts = await self.snap_repository.get_hashtag_counts()
+        if not counts:
+            counts = await self.snap_repository.rebuild_hashtag_counts()
+        trie = HashtagTrie(self.top_k)
+        for hashtag, count in counts.items():
+            trie.add(hashtag, count)
+        self.trie = trie
+        logger.info(f"Loaded {len(trie)} hashtags for suggestions")
+
+    async def refresh(self):
+        """
+        Reload the usage counts, joining the reload already running if there is one.
+        """
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._load())
+        await asyncio.shield(self._refreshing)
+
+    async def suggest(self, prefix: str, limit: int = HASHTAG_SUGGEST_TOP_K) -> List[str]:
+        """
+        Get the most used hashtags starting with prefix, loading the dictionary on first use.
+        """
+        if self.trie is None:
+            await self.refresh()
+        return self.trie.suggest(prefix, limit)
+
+    async def _refresh_periodically(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as exc:
+                logger.error(f"Could not reload the hashtag suggestions: {exc}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """
+        Keep the suggestions reloaded from a background task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._refresh_periodically())
+
+    async def stop(self):
+        """
+        Stop the background reload.
+        """
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
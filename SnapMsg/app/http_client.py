@@ -0,0 +1,187 @@
+import asyncio
+import random
+import time
+from typing import Callable, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from .config import logger
+from .metrics import OUTBOUND_LATENCY
+from .constants import (
+    HTTP_BACKOFF,
+    HTTP_CIRCUIT_FAILURE_THRESHOLD,
+    HTTP_CIRCUIT_RESET_TIMEOUT,
+    HTTP_DEADLINE,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_RETRIES,
+    HTTP_TIMEOUT,
+)
+
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+class CircuitBreaker:
+    """
+    Stops calling a service after consecutive failures.
+
+    After failure_threshold consecutive failures the circuit opens and calls are rejected
+    right away. Once reset_timeout seconds have passed a single trial call is let through:
+    the circuit closes again if it succeeds and stays open otherwise.
+    """
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        """
+        Whether a call may be made now.
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self.trial_running = False
+
+    def record_abandoned(self):
+        """
+        A call ended without an outcome, e.g. it was cancelled: let another trial call through.
+        """
+        self.trial_running = False
+
+
+class ServiceClient:
+    """
+    Pooled, keep-alive HTTP client for calls to another microservice.
+
+    Each call runs under an overall deadline. Connection errors, timeouts and 502/503/504
+    responses are retried with exponential backoff and full jitter while the deadline allows.
+    A circuit breaker rejects calls while the service keeps failing. When a call cannot be
+    completed it raises HTTPException 503.
+    """
+    def __init__(
+        self,
+        name: str,
+        base_url: Optional[str],
+        timeout: float = HTTP_TIMEOUT,
+        deadline: float = HTTP_DEADLINE,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF,
+        breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(HTTP_CIRCUIT_FAILURE_THRESHOLD, HTTP_CIRCUIT_RESET_TIMEOUT)
+        self.transport = transport
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+    def _client(self) -> httpx.AsyncClient:
+        """
+        Connection pools cannot be shared between event loops, so keep one client per loop.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            for other_loop in [other for other in self._clients if other.is_closed()]:
+                del self._clients[other_loop]
+            client = self._clients[loop] = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS),
+                transport=self.transport,
+            )
+        return client
+
+    def unavailable(self, reason: str) -> HTTPException:
+        logger.warning(f"{self.name} service unavailable: {reason}")
+        return HTTPException(status_code=503, detail=f"The {self.name} service is unavailable.")
+
+    async def request(self, method: str, path: str, deadline: Optional[float] = None, **kwargs) -> httpx.Response:
+        """
+        Send a request to the service and return its response.
+
+        Only send idempotent requests: they may be retried.
+        """
+        if not self.base_url:
+            raise self.unavailable("no URL configured")
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        url = self.base_url + path
+        attempt = 0
+
+        while True:
+            if not self.breaker.allow():
+                raise self.unavailable("circuit open")
+
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise self.unavailable(f"deadline exceeded calling {path}")
+            started = time.perf_counter()
+            try:
+                response = await self._client().request(method, url, timeout=min(self.timeout, remaining), **kwargs)
+            except httpx.TransportError as exc:
+                OUTBOUND_LATENCY.labels(self.name, method, type(exc).__name__).observe(time.perf_counter() - started)
+                self.breaker.record_failure()
+                failure = f"{type(exc).__name__} calling {path}"
+            except Exception as exc:
+                OUTBOUND_LATENCY.labels(self.name, method, type(exc).__name__).observe(time.perf_counter() - started)
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                self.breaker.record_abandoned()
+                raise
+            else:
+                OUTBOUND_LATENCY.labels(self.name, method, str(response.status_code)).observe(time.perf_counter() - started)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                failure = f"status {response.status_code} calling {path}"
+
+            pause = random.uniform(0, self.backoff * 2 ** attempt)
+            attempt += 1
+            if attempt > self.retries or time.monotonic() + pause >= deadline_at:
+                raise self.unavailable(failure)
+            logger.info(f"Retrying {self.name} service call after {failure}")
+            await asyncio.sleep(pause)
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def aclose(self):
+        """
+        Close the connection pools of the client.
+        """
+        clients, self._clients = self._clients, {}
+        for loop, client in clients.items():
+            if loop is asyncio.get_running_loop():
+                await client.aclose()
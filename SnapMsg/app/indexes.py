@@ -0,0 +1,110 @@
+import argparse
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.database import Database
+
+from .config import logger
+from .constants import TRENDING_WINDOWS
+from .db import db
+from .repositories import SnapRepository
+
+
+# Every query issued by SnapRepository must be served by one of these indexes.
+# Tests/test_indexes.py explains each repository query and fails on collection scans.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "twitsnaps": [
+        IndexModel([("email", ASCENDING), ("is_blocked", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="email_blocked_created_at"),
+        IndexModel([("hashtags", ASCENDING), ("is_blocked", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="hashtags_blocked_created_at"),
+        IndexModel([("is_blocked", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="blocked_created_at"),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at"),
+        # Searches must match is_blocked: False, so blocked snaps are skipped by the index scan.
+        # No language: messages mix languages, and one language's stemming and stop words would mangle the others.
+        IndexModel([("is_blocked", ASCENDING), ("message", TEXT)], name="blocked_message_text", default_language="none"),
+    ],
+    "likes": [
+        IndexModel([("snap_id", ASCENDING), ("email", ASCENDING)], name="snap_id_email", unique=True),
+        IndexModel([("email", ASCENDING), ("snap_id", ASCENDING)], name="email_snap_id"),
+    ],
+    "favourites": [
+        IndexModel([("snap_id", ASCENDING), ("email", ASCENDING)], name="snap_id_email", unique=True),
+        IndexModel([("email", ASCENDING), ("snap_id", ASCENDING)], name="email_snap_id"),
+    ],
+    "snap_shares": [
+        IndexModel([("snap_id", ASCENDING), ("created_at", DESCENDING)], name="snap_id_created_at"),
+        IndexModel([("email", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="email_created_at"),
+    ],
+    "timelines": [
+        IndexModel([("owner", ASCENDING), ("entry_id", ASCENDING)], name="owner_entry_id", unique=True),
+        IndexModel([("owner", ASCENDING), ("created_at", DESCENDING), ("entry_id", DESCENDING)], name="owner_created_at"),
+        IndexModel([("snap_id", ASCENDING)], name="snap_id"),
+    ],
+    "timeline_sizes": [
+        IndexModel([("owner", ASCENDING)], name="owner", unique=True),
+    ],
+    "followers": [
+        IndexModel([("follower", ASCENDING), ("followed", ASCENDING)], name="follower_followed", unique=True),
+        IndexModel([("followed", ASCENDING)], name="followed"),
+    ],
+    "pull_authors": [
+        IndexModel([("email", ASCENDING)], name="email", unique=True),
+    ],
+    "hashtag_scores": [
+        IndexModel([("hashtag", ASCENDING), ("bucket", ASCENDING)], name="hashtag_bucket", unique=True),
+        IndexModel([("bucket", ASCENDING)], name="bucket_ttl", expireAfterSeconds=(max(TRENDING_WINDOWS.values()) + 1) * 3600),
+    ],
+    "hashtags": [
+        IndexModel([("hashtag", ASCENDING)], name="hashtag", unique=True),
+        IndexModel([("count", DESCENDING)], name="count"),
+    ],
+    "hashtag_candidates": [
+        IndexModel([("hashtag", ASCENDING)], name="hashtag", unique=True),
+    ],
+}
+
+
+def ensure_indexes(db: Database):
+    """
+    Create the indexes of the registry that do not exist yet.
+    """
+    for collection_name, indexes in INDEXES.items():
+        created = db[collection_name].create_indexes(indexes)
+        logger.info(f"Indexes ensured for collection {collection_name}: {created}")
+
+
+def missing_indexes(db: Database):
+    """
+    Get the names of the registry indexes that do not exist, keyed by collection.
+    """
+    missing = {}
+    for collection_name, indexes in INDEXES.items():
+        existing = db[collection_name].index_information()
+        names = [index.document["name"] for index in indexes if index.document["name"] not in existing]
+        if names:
+            missing[collection_name] = names
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or verify the SnapMsg MongoDB indexes.")
+    parser.add_argument("--check", action="store_true", help="only report missing indexes, exit with status 1 if any")
+    parser.add_argument("--rebuild-hashtag-counts", action="store_true", help="also recount the usage of every hashtag from the snaps")
+    args = parser.parse_args()
+
+    if not args.check:
+        ensure_indexes(db)
+
+    missing = missing_indexes(db)
+    for collection_name, names in missing.items():
+        print(f"{collection_name}: missing {', '.join(names)}")
+    if args.check and missing:
+        raise SystemExit(1)
+    print("All indexes are in place." if not missing else "Some indexes are missing.")
+
+    if args.rebuild_hashtag_counts:
+        counts = SnapRepository(db).rebuild_hashtag_counts()
+        print(f"Rebuilt the usage counts of {len(counts)} hashtags.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from typing import Dict, Iterable, List, Optional
+
+from .repositories import AsyncSnapRepository
+
+
+class SnapLoader:
+    """
+    Request-scoped batch loader for snaps, in the spirit of DataLoader.
+
+    Every snap ID requested through the loader is read at most once during its lifetime,
+    and the IDs that are not known yet are fetched together with a single $in query.
+    Blocked and missing snaps load as None. Only the given fields are fetched, all of them
+    by default.
+    """
+    def __init__(self, snap_repository: AsyncSnapRepository, fields: Optional[Iterable[str]] = None):
+        self.snap_repository = snap_repository
+        self.fields = fields
+        self._snaps: Dict[str, Optional[dict]] = {}
+
+    async def load_many(self, snap_ids: Iterable[str]) -> List[Optional[dict]]:
+        """
+        Load the snaps with the given IDs, in the same order.
+
+        Each call returns fresh copies, so callers may modify the snaps they get.
+        """
+        snap_ids = list(snap_ids)
+        missing = [snap_id for snap_id in dict.fromkeys(snap_ids) if snap_id not in self._snaps]
+        if missing:
+            found = await self.snap_repository.get_snaps_by_ids(missing, self.fields)
+            for snap_id in missing:
+                self._snaps[snap_id] = found.get(snap_id)
+
+        return [dict(self._snaps[snap_id]) if self._snaps[snap_id] else None for snap_id in snap_ids]
+
+    async def load(self, snap_id: str) -> Optional[dict]:
+        """
+        Load a single snap.
+        """
+        return (await self.load_many([snap_id]))[0]
+
@@ -1,10 +1,46 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
+from pymongo.errors import PyMongoError
 from .middleware import ErrorHandlingMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from .config import logger
-from .controllers import snap_router
+from .controllers import snap_repository, snap_router, snap_service
+from .snap_cache import CachedSnapRepository
+from .db import close_async_clients, db
+from .indexes import ensure_indexes
+from .metrics import MetricsMiddleware, metrics_router
+from .serialization import SnapJSONResponse
+from .authentication import auth_client
+from .users import profile_client, verified_users
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Prepare the database and start the background tasks before serving requests. On
+    shutdown, stop them, write the buffered counters and release the connection pools.
+    """
+    if os.getenv("CREATE_INDEXES_ON_STARTUP", "true").lower() == "true":
+        try:
+            ensure_indexes(db)
+        except PyMongoError as exc:
+            logger.error(f"Could not ensure indexes on startup: {exc}")
+    verified_users.start()
+    snap_service.counters.start()
+    snap_service.hashtags.start()
+    yield
+    await snap_service.hashtags.stop()
+    await snap_service.counters.stop()
+    if isinstance(snap_repository, CachedSnapRepository):
+        await snap_repository.close()
+    await verified_users.stop()
+    await profile_client.aclose()
+    await auth_client.aclose()
+    await close_async_clients()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=SnapJSONResponse)
 app.add_middleware(ErrorHandlingMiddleware)
 app.add_middleware(
     CORSMiddleware,
@@ -13,6 +49,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 @app.exception_handler(HTTPException)
 async def custom_http_exception_handler(request: Request, exc: HTTPException):
@@ -23,6 +60,7 @@ async def custom_http_exception_handler(request: Request, exc: HTTPException):
 
 
 app.include_router(snap_router, prefix="/snaps", tags=["snaps"])
+app.include_router(metrics_router)
 
 logger.info("FastAPI application is starting...")
 
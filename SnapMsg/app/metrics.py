@@ -0,0 +1,148 @@
+import contextvars
+import time
+from typing import Any
+
+from anyio import to_thread
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+
+REQUEST_LATENCY = Histogram(
+    "snapmsg_request_duration_seconds",
+    "Time to answer a request, by route template.",
+    ["method", "route", "status"],
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "snapmsg_mongo_command_duration_seconds",
+    "Time of the MongoDB commands, by the repository method that sent them.",
+    ["repository_method", "command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "snapmsg_mongo_command_failures_total",
+    "MongoDB commands that failed, by the repository method that sent them.",
+    ["repository_method", "command"],
+)
+OUTBOUND_LATENCY = Histogram(
+    "snapmsg_outbound_request_duration_seconds",
+    "Time of each attempt to call another microservice, by the status code or transport error it got.",
+    ["service", "method", "status"],
+)
+SNAP_CACHE_HITS = Counter("snapmsg_snap_cache_hits_total", "Snap reads by id answered by the snap cache.", ["backend"])
+SNAP_CACHE_MISSES = Counter("snapmsg_snap_cache_misses_total", "Snap reads by id that had to load the snap from MongoDB.", ["backend"])
+THREADPOOL_SIZE = Gauge("snapmsg_threadpool_size", "Threads the threadpool may run at once.")
+THREADPOOL_BUSY = Gauge("snapmsg_threadpool_busy", "Threads of the threadpool running a call.")
+THREADPOOL_WAITING = Gauge("snapmsg_threadpool_waiting", "Calls waiting for a thread of the threadpool.")
+
+# The repository method running in the current task or thread, to label its Mongo commands.
+repository_method: contextvars.ContextVar[str] = contextvars.ContextVar("repository_method", default="other")
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Records the duration of every MongoDB command, labelled with the repository method that
+    sent it. pymongo already measures the duration, so nothing is done when a command starts.
+    """
+    def started(self, event: monitoring.CommandStartedEvent):
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        MONGO_COMMAND_LATENCY.labels(repository_method.get(), event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        method = repository_method.get()
+        MONGO_COMMAND_LATENCY.labels(method, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(method, event.command_name).inc()
+
+
+class InstrumentedSnapRepository:
+    """
+    Exposes a repository with the coroutine interface of AsyncSnapRepository, labelling the
+    MongoDB commands of each call with the name of the method.
+
+    The label is a context variable, which the threadpool calls of ThreadedSnapRepository
+    inherit.
+    """
+    def __init__(self, snap_repository: Any):
+        self.snap_repository = snap_repository
+
+    def __getattr__(self, name):
+        attribute = getattr(self.snap_repository, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            token = repository_method.set(name)
+            try:
+                return await attribute(*args, **kwargs)
+            finally:
+                repository_method.reset(token)
+        return call
+
+
+def route_template(scope) -> str:
+    """
+    Path template of the route that handled a request, e.g. /snaps/{snap_id}.
+
+    Depending on the FastAPI version, routes of an included router carry the router's prefix
+    or not; the prefix is taken from the part of the path before the route's own pattern.
+    """
+    route = scope.get("route")
+    path_regex = getattr(route, "path_regex", None)
+    if path_regex is None:
+        return "unmatched"
+    path = scope["path"]
+    for index, char in enumerate(path):
+        if char == "/" and path_regex.match(path[index:]):
+            return path[:index] + route.path_format
+    return route.path_format
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of every request, labelled with the template of
+    the route that handled it so that path parameters do not multiply the series.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_LATENCY.labels(scope["method"], route_template(scope), str(status)).observe(time.perf_counter() - started)
+
+
+def update_threadpool_gauges():
+    """
+    Read the saturation of the threadpool running the sync repository and sync endpoints.
+    """
+    limiter = to_thread.current_default_thread_limiter()
+    THREADPOOL_SIZE.set(limiter.total_tokens)
+    THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+    THREADPOOL_WAITING.set(limiter.statistics().tasks_waiting)
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Expose the metrics in the Prometheus text format.
+    """
+    update_threadpool_gauges()
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
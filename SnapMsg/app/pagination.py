@@ -0,0 +1,169 @@
+import base64
+import binascii
+import datetime
+import heapq
+import json
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Query
+
+from .constants import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+Cursor = Tuple[datetime.datetime, ObjectId]
+ScoreCursor = Tuple[float, ObjectId]
+
+
+def encode_cursor(created_at: datetime.datetime, item_id) -> str:
+    """
+    Build an opaque cursor pointing right after the given (created_at, id) position.
+    """
+    payload = json.dumps([created_at.isoformat(), str(item_id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """
+    Decode a cursor built by encode_cursor.
+    """
+    try:
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(created_at), ObjectId(item_id)
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def encode_score_cursor(score: float, item_id) -> str:
+    """
+    Build an opaque cursor pointing right after the given (score, id) position of a ranked list.
+    """
+    payload = json.dumps([score, str(item_id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_score_cursor(cursor: str) -> ScoreCursor:
+    """
+    Decode a cursor built by encode_score_cursor.
+    """
+    try:
+        score, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), ObjectId(item_id)
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def keyset_filter(after: Cursor, id_field: str = "_id") -> dict:
+    """
+    Mongo filter matching the documents that come after the cursor in (created_at, id) descending order.
+    """
+    created_at, item_id = after
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, id_field: {"$lt": item_id}},
+    ]}
+
+
+def sort_key(item: dict):
+    """
+    Ordering key of a list item, matching the order used by the repository queries.
+    """
+    return item["created_at"], ObjectId(item["_id"])
+
+
+def next_cursor(items: List[dict], limit: int) -> Optional[str]:
+    """
+    Cursor for the page after items, or None if items is the last page.
+    """
+    if len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor(last["created_at"], last["_id"])
+
+
+async def fill_page(fetch_page: Callable[[Optional[Cursor], Optional[int]], Awaitable[List[dict]]], hydrate: Callable[[List[dict]], Awaitable[List[dict]]], after: Optional[Cursor], limit: Optional[int], id_field: str = "_id"):
+    """
+    Fetch pages of documents and hydrate them until limit items are kept or the source runs out.
+
+    hydrate may drop documents (e.g. shares of blocked snaps); the missing items are made up
+    with the following documents so a short page still means the source is exhausted.
+    """
+    items = []
+    while True:
+        documents = await fetch_page(after, limit)
+        items.extend(await hydrate(documents))
+        if not limit or len(documents) < limit or len(items) >= limit:
+            return items[:limit] if limit else items
+        last = documents[-1]
+        after = (last["created_at"], ObjectId(last[id_field]))
+
+
+def merge_pages(sources: List[Iterable[dict]], limit: int):
+    """
+    Merge pages fetched with the same cursor and limit from several sources into one page.
+
+    Each source must already be sorted like the repository queries. The sources are merged
+    lazily with a heap, so they can be iterators such as database cursors, and consumed only
+    until the page is full. Items are deduplicated by ID, keeping the first occurrence.
+    Returns the page and the cursor for the next one.
+    """
+    consumed = [0] * len(sources)
+
+    def counted(index, source):
+        for item in source:
+            consumed[index] += 1
+            yield item
+
+    merged = heapq.merge(*(counted(index, source) for index, source in enumerate(sources)), key=sort_key, reverse=True)
+    seen = set()
+    page = []
+    has_more = False
+    for item in merged:
+        if item["_id"] in seen:
+            continue
+        if len(page) == limit:
+            has_more = True
+            break
+        seen.add(item["_id"])
+        page.append(item)
+    else:
+        # Every source was exhausted: a full one may still continue past its own page.
+        has_more = any(count >= limit for count in consumed)
+
+    if not has_more or not page:
+        return page, None
+    return page, encode_cursor(page[-1]["created_at"], page[-1]["_id"])
+
+
+class PageParams:
+    """
+    Query parameters of the paginated list endpoints.
+
+    Attributes:
+        after (Optional[Cursor]): The decoded position to continue from, None for the first page.
+        limit (int): The maximum number of items to return.
+    """
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(None, description="Opaque cursor returned as next_cursor by the previous page."),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    ):
+        self.after = decode_cursor(cursor) if cursor else None
+        self.limit = limit
+
+
+class RankedPageParams:
+    """
+    Query parameters of the paginated list endpoints ranked by a score.
+
+    Attributes:
+        after (Optional[ScoreCursor]): The decoded position to continue from, None for the first page.
+        limit (int): The maximum number of items to return.
+    """
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(None, description="Opaque cursor returned as next_cursor by the previous page."),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    ):
+        self.after = decode_score_cursor(cursor) if cursor else None
+        self.limit = limit
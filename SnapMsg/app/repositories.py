@@ -1,17 +1,330 @@
+import asyncio
+import contextvars
 import datetime
-from typing import List
+import heapq
+import inspect
+import itertools
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.asynchronous.database import AsyncDatabase
+from starlette.concurrency import run_in_threadpool
 from .config import logger
+from .constants import RELEVANT_CANDIDATES_PER_HASHTAG, SEARCH_RECENCY_SCALE, TIMELINE_TRIM_SLACK
+from .pagination import Cursor, ScoreCursor, keyset_filter
+from .serialization import SNAP_FIELDS, snap_projection
 
+# Set while run_synchronously drives a repository coroutine on the sync driver.
+_synchronous: contextvars.ContextVar[bool] = contextvars.ContextVar("synchronous", default=False)
 
-class SnapRepository:
-    def __init__(self, db):
-        self.snaps_collection = db["twitsnaps"]
-        self.likes_collection = db["likes"]
-        self.favourites_collection = db["favourites"]
-        self.snap_shares_collection = db["snap_shares"]
 
-    def create_snap(self, email, message, is_private, hashtags, username):
+def page_query(query: dict, after: Optional[Cursor], id_field: str = "_id") -> dict:
+    """
+    Restrict a query to the documents that come after the cursor.
+    """
+    return {"$and": [query, keyset_filter(after, id_field)]} if after else query
+
+
+def users_interactions_pipeline(email, after: Optional[Cursor], limit: Optional[int], since: Optional[datetime.datetime], likes_collection: str, snap_shares_collection: str) -> List[dict]:
+    """
+    Aggregation pipeline over the snaps collection returning a page of the user's snaps with
+    the username and time of their likes and shares.
+    """
+    def interactions(field):
+        matching = {"$filter": {"input": f"${field}", "as": "interaction", "cond": {"$gte": ["$$interaction.created_at", since]}}} if since else f"${field}"
+        return {"$map": {"input": matching, "as": "interaction", "in": {"username": "$$interaction.username", "created_at": "$$interaction.created_at"}}}
+
+    pipeline = [
+        {"$match": page_query({"email": email, "is_blocked": False}, after)},
+        {"$sort": {"created_at": -1, "_id": -1}},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline += [
+        {"$addFields": {"snap_id": {"$toString": "$_id"}}},
+        {"$lookup": {"from": likes_collection, "localField": "snap_id", "foreignField": "snap_id", "as": "likes"}},
+        {"$lookup": {"from": snap_shares_collection, "localField": "snap_id", "foreignField": "snap_id", "as": "retweets"}},
+        {"$project": {"created_at": 1, "likes": interactions("likes"), "retweets": interactions("retweets")}},
+    ]
+    return pipeline
+
+
+def search_pipeline(text: str, after: Optional[ScoreCursor], limit: Optional[int], projection: dict) -> List[dict]:
+    """
+    Aggregation pipeline over the unblocked snaps whose message matches a text search,
+    ranked by text score plus recency.
+
+    The rank only depends on the snap, not on the current time, so pages can be walked with
+    a (rank, _id) cursor. Blocked snaps are excluded by the prefix of the text index.
+    """
+    pipeline = [
+        {"$match": {"is_blocked": False, "$text": {"$search": text}}},
+        {"$addFields": {"rank": {"$add": [
+            {"$meta": "textScore"},
+            {"$divide": [{"$toLong": "$created_at"}, SEARCH_RECENCY_SCALE * 1000]},
+        ]}}},
+    ]
+    if after:
+        rank, item_id = after
+        pipeline.append({"$match": {"$or": [{"rank": {"$lt": rank}}, {"rank": rank, "_id": {"$lt": item_id}}]}})
+    pipeline.append({"$sort": {"rank": -1, "_id": -1}})
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": {**projection, "rank": 1}})
+    return pipeline
+
+
+def timeline_entries(snaps, shares) -> List[dict]:
+    """
+    Build timeline entries from snap documents and share documents.
+    """
+    entries = [
+        {"entry_id": snap["_id"], "snap_id": str(snap["_id"]), "author_email": snap["email"], "retweet_user": "", "created_at": snap["created_at"]}
+        for snap in snaps
+    ]
+    entries.extend(
+        {"entry_id": share["_id"], "snap_id": share["snap_id"], "author_email": share["email"], "retweet_user": share["username"], "created_at": share["created_at"]}
+        for share in shares
+    )
+    return entries
+
+
+def new_snap_documents(email, snaps: List[Tuple[str, bool, List[str]]], username) -> List[dict]:
+    """
+    Build the documents of new snaps from (message, is_private, hashtags) tuples.
+    """
+    created_at = datetime.datetime.now()
+    return [
+        {
+            "email": email,
+            "username": username,
+            "message": message,
+            "created_at": created_at,
+            "is_private": is_private,
+            "hashtags": hashtags,
+            "likes": 0,
+            "is_blocked": False,
+            "version": 0
+        }
+        for message, is_private, hashtags in snaps
+    ]
+
+
+def stored_snaps(new_snaps: List[dict], error: Optional[BulkWriteError], ordered: bool) -> List[Optional[dict]]:
+    """
+    The snaps stored by an insert_many, with their ids as strings, and None for those whose
+    insert failed. An ordered insert_many stops at its first failure, so the list ends there:
+    the snaps after it were not attempted.
+    """
+    failed = {write_error["index"] for write_error in error.details.get("writeErrors", [])} if error else set()
+    if ordered and failed:
+        new_snaps = new_snaps[:min(failed) + 1]
+    stored = []
+    for index, new_snap in enumerate(new_snaps):
+        if index in failed:
+            stored.append(None)
+        else:
+            new_snap["_id"] = str(new_snap["_id"])
+            stored.append(new_snap)
+    return stored
+
+
+def interaction_operations(user_email, changes: Dict[str, bool], document: Callable[[str], dict]) -> List:
+    """
+    Upserts of the interactions of a user with the snaps mapped to True, and deletes of the
+    ones with the snaps mapped to False.
+    """
+    return [
+        UpdateOne({"snap_id": snap_id, "email": user_email}, {"$setOnInsert": document(snap_id)}, upsert=True)
+        if present else DeleteOne({"snap_id": snap_id, "email": user_email})
+        for snap_id, present in changes.items()
+    ]
+
+
+def raise_unless_duplicates(error: BulkWriteError):
+    """
+    Re-raise a bulk write error unless every failed write hit a unique index, i.e. it was already applied.
+    """
+    if error.details.get("writeConcernErrors") or any(write_error["code"] != 11000 for write_error in error.details.get("writeErrors", [])):
+        raise error
+
+
+def hashtag_score_operations(scores: Dict[Tuple[str, datetime.datetime], int]) -> List[UpdateOne]:
+    """
+    Upserts adding each amount to the score of its (hashtag, bucket).
+    """
+    return [
+        UpdateOne({"hashtag": hashtag, "bucket": bucket}, {"$inc": {"score": amount}}, upsert=True)
+        for (hashtag, bucket), amount in scores.items()
+        if amount
+    ]
+
+
+def hashtag_count_operations(counts: Dict[str, int]) -> List[UpdateOne]:
+    """
+    Upserts adding each amount to the usage count of its hashtag.
+    """
+    return [
+        UpdateOne({"hashtag": hashtag}, {"$inc": {"count": amount}}, upsert=True)
+        for hashtag, amount in counts.items()
+        if amount
+    ]
+
+
+def snap_likes_operations(likes: Dict[str, int]) -> List[UpdateOne]:
+    """
+    Updates adding each amount to the likes counter of its snap.
+    """
+    return [
+        UpdateOne({"_id": ObjectId(snap_id)}, {"$inc": {"likes": amount}})
+        for snap_id, amount in likes.items()
+        if amount
+    ]
+
+
+def candidate_push_operations(snaps: List[dict], max_candidates: int) -> List[UpdateOne]:
+    """
+    Upserts adding new snaps to the candidate lists of their hashtags, keeping the newest
+    max_candidates of each list.
+    """
+    entries: Dict[str, List[dict]] = {}
+    for snap in snaps:
+        for hashtag in set(snap["hashtags"]):
+            entries.setdefault(hashtag, []).append({"_id": ObjectId(snap["_id"]), "created_at": snap["created_at"]})
+    return [
+        UpdateOne(
+            {"hashtag": hashtag},
+            {"$push": {"recent_snaps": {"$each": hashtag_entries, "$sort": {"created_at": -1, "_id": -1}, "$slice": max_candidates}}},
+            upsert=True,
+        )
+        for hashtag, hashtag_entries in entries.items()
+    ]
+
+
+def merge_candidates(candidate_lists: Iterable[List[dict]], after: Optional[Cursor], limit: Optional[int]) -> List[dict]:
+    """
+    Merge candidate lists sorted by (created_at, _id) descending into the entries of one page,
+    without duplicates, starting after the cursor.
+    """
+    merged = heapq.merge(*candidate_lists, key=lambda entry: (entry["created_at"], entry["_id"]), reverse=True)
+    entries, seen = [], set()
+    for entry in merged:
+        if after and (entry["created_at"], entry["_id"]) >= after:
+            continue
+        if entry["_id"] in seen:
+            continue
+        seen.add(entry["_id"])
+        entries.append(entry)
+        if limit and len(entries) == limit:
+            break
+    return entries
+
+
+def in_candidate_order(snaps: List[dict], snap_ids: List[ObjectId]) -> List[dict]:
+    """
+    Sort the snaps fetched for a page of candidates in the order of the page.
+    """
+    position = {snap_id: index for index, snap_id in enumerate(snap_ids)}
+    snaps.sort(key=lambda snap: position[snap["_id"]])
+    for snap in snaps:
+        snap["_id"] = str(snap["_id"])
+    return snaps
+
+
+def top_hashtags_pipeline(since: datetime.datetime, limit: int) -> List[dict]:
+    """
+    Aggregation pipeline over the hashtag scores returning the top hashtags since a bucket.
+    """
+    return [
+        {"$match": {"bucket": {"$gte": since}}},
+        {"$group": {"_id": "$hashtag", "score": {"$sum": "$score"}}},
+        {"$match": {"score": {"$gt": 0}}},
+        {"$sort": {"score": -1, "_id": 1}},
+        {"$limit": limit},
+    ]
+
+
+def hashtag_counts_pipeline() -> List[dict]:
+    """
+    Aggregation pipeline over the snaps counting the snaps using each hashtag.
+    """
+    return [
+        # Matches every hashtag, so only the snaps with hashtags are read, through the hashtags index.
+        {"$match": {"hashtags": {"$gt": ""}}},
+        {"$project": {"hashtags": {"$setUnion": ["$hashtags"]}}},
+        {"$unwind": "$hashtags"},
+        {"$group": {"_id": "$hashtags", "count": {"$sum": 1}}},
+    ]
+
+
+async def concurrently(*awaitables) -> list:
+    """
+    Await several database calls: together on the event loop, or one after the other when
+    the repository is run synchronously.
+    """
+    if _synchronous.get():
+        return [await awaitable for awaitable in awaitables]
+    return await asyncio.gather(*awaitables)
+
+
+class AsyncSnapRepository:
+    """
+    Reads and writes snaps and their interactions, as coroutines.
+
+    get_db returns the database to use: an AsyncDatabase of the running event loop, or a
+    SyncDatabase when the repository is run synchronously by SnapRepository.
+    """
+    def __init__(self, get_db: Callable[[], Union[AsyncDatabase, "SyncDatabase"]]):
+        self.get_db = get_db
+
+    @property
+    def snaps_collection(self):
+        return self.get_db()["twitsnaps"]
+
+    @property
+    def likes_collection(self):
+        return self.get_db()["likes"]
+
+    @property
+    def favourites_collection(self):
+        return self.get_db()["favourites"]
+
+    @property
+    def snap_shares_collection(self):
+        return self.get_db()["snap_shares"]
+
+    @property
+    def timelines_collection(self):
+        return self.get_db()["timelines"]
+
+    @property
+    def timeline_sizes_collection(self):
+        return self.get_db()["timeline_sizes"]
+
+    @property
+    def followers_collection(self):
+        return self.get_db()["followers"]
+
+    @property
+    def pull_authors_collection(self):
+        return self.get_db()["pull_authors"]
+
+    @property
+    def hashtag_scores_collection(self):
+        return self.get_db()["hashtag_scores"]
+
+    @property
+    def hashtags_collection(self):
+        return self.get_db()["hashtags"]
+
+    @property
+    def hashtag_candidates_collection(self):
+        return self.get_db()["hashtag_candidates"]
+
+    async def create_snap(self, email, message, is_private, hashtags, username):
         """
         Create a new snap.
         """
@@ -23,28 +336,59 @@ class SnapRepository:
             "is_private": is_private,
             "hashtags": hashtags,
             "likes": 0,
-            "is_blocked": False
+            "is_blocked": False,
+            "version": 0
         }
-        result = self.snaps_collection.insert_one(new_snap)
+        result = await self.snaps_collection.insert_one(new_snap)
         new_snap["_id"] = str(result.inserted_id)
         logger.info(f"Snap created with id {new_snap['_id']}")
         return new_snap
 
-    def get_snaps(self, email):
+    async def create_snaps(self, email, snaps: List[Tuple[str, bool, List[str]]], username, ordered: bool = False):
+        """
+        Create several snaps, given as (message, is_private, hashtags), with a single insert_many.
+
+        Returns the new snaps in the same order, with None for those that could not be stored.
+        In an ordered batch the list ends at the first snap that could not be stored.
+        """
+        if not snaps:
+            return []
+        new_snaps = new_snap_documents(email, snaps, username)
+        error = None
+        try:
+            await self.snaps_collection.insert_many(new_snaps, ordered=ordered)
+        except BulkWriteError as exc:
+            logger.error(f"Could not store {len(exc.details.get('writeErrors', []))} of {len(new_snaps)} snaps: {exc}")
+            error = exc
+        stored = stored_snaps(new_snaps, error, ordered)
+        logger.info(f"Created {sum(new_snap is not None for new_snap in stored)} snaps in a batch")
+        return stored
+
+    async def _find_page(self, collection, query: dict, after: Optional[Cursor] = None, limit: Optional[int] = None, id_field: str = "_id", projection: Optional[dict] = None):
         """
-        Fetch all snaps for a user.
+        Run a query sorted by (created_at, id) descending, starting after the cursor and
+        returning at most limit documents.
         """
-        snaps = list(self.snaps_collection.find({"email": email, "is_blocked": False}).sort("created_at", -1))
+        cursor = collection.find(page_query(query, after, id_field), projection).sort([("created_at", -1), (id_field, -1)])
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list()
+
+    async def get_snaps(self, email, after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
+        """
+        Fetch the snaps of a user, a page at a time.
+        """
+        snaps = await self._find_page(self.snaps_collection, {"email": email, "is_blocked": False}, after, limit, projection=snap_projection(fields))
         for snap in snaps:
             snap["_id"] = str(snap["_id"])
         logger.info(f"Snaps retrieved for user {email}")
         return snaps
-    
-    def get_snap_by_id(self, snap_id):
+
+    async def get_snap_by_id(self, snap_id):
         """
         Fetch a snap by its ID.
         """
-        snap = self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
+        snap = await self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
         if snap and not snap["is_blocked"]:
             snap['id'] = str(snap.pop('_id'))
             logger.info(f"Snap with id {snap_id} retrieved")
@@ -53,227 +397,687 @@ class SnapRepository:
             snap = "Snap is blocked"
         return snap
 
-    def delete_snap(self, snap_id):
+    async def get_snap_version(self, snap_id):
+        """
+        Fetch only the version of an unblocked snap, None if it does not exist or is blocked.
+        """
+        snap = await self.snaps_collection.find_one({"_id": ObjectId(snap_id), "is_blocked": False}, {"version": 1})
+        return snap.get("version", 0) if snap else None
+
+    async def delete_snap(self, snap_id):
         """
         Delete a snap.
         """
-        result = self.snaps_collection.delete_one({"_id": ObjectId(snap_id)})
+        result = await self.snaps_collection.delete_one({"_id": ObjectId(snap_id)})
         logger.info(f"Snap with id {snap_id} deleted")
         return result.deleted_count
 
-    def update_snap(self, snap_id, update_data):
+    async def update_snap(self, snap_id, update_data):
         """
-        Update a snap.
+        Update a snap, bumping its version.
         """
         update_data = update_data.dict()
-        result = self.snaps_collection.update_one({"_id": ObjectId(snap_id)}, {"$set": update_data})
+        result = await self.snaps_collection.update_one({"_id": ObjectId(snap_id)}, {"$set": update_data, "$inc": {"version": 1}})
         logger.info(f"Snap with id {snap_id} updated")
         return result.modified_count
-    
-    def get_all_snaps(self):
+
+    async def get_all_snaps(self, after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
         """
-        Fetch all public and private snaps from the database.
+        Fetch public and private snaps from the database, a page at a time.
         """
-        snaps = list(self.snaps_collection.find().sort("created_at", -1))
+        snaps = await self._find_page(self.snaps_collection, {}, after, limit, projection=snap_projection(fields))
         for snap in snaps:
             snap["_id"] = str(snap["_id"])
         logger.info(f"Retrieved all snaps")
         return snaps
-    
-    def search_snaps_by_hashtag(self, hashtag):
+
+    async def search_snaps_by_hashtag(self, hashtag, after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
         """
-        Search for snaps that contain a specific hashtag.
+        Search for snaps that contain a specific hashtag, a page at a time.
         """
-        snaps = list(self.snaps_collection.find({"hashtags": hashtag, "is_blocked": False}).sort("created_at", -1))
+        snaps = await self._find_page(self.snaps_collection, {"hashtags": hashtag, "is_blocked": False}, after, limit, projection=snap_projection(fields))
         for snap in snaps:
             snap["_id"] = str(snap["_id"])
         logger.info(f"Retrieved snaps with hashtag {hashtag}")
         return snaps
-    
-    def get_snaps_from_users(self, followed_users: List[str]):
+
+    async def search_snaps(self, text: str, after: Optional[ScoreCursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
+        """
+        Search the unblocked snaps by the words of their message, best ranked first.
+        """
+        pipeline = search_pipeline(text, after, limit, snap_projection(fields))
+        snaps = await (await self.snaps_collection.aggregate(pipeline)).to_list()
+        for snap in snaps:
+            snap["_id"] = str(snap["_id"])
+        logger.info(f"Found {len(snaps)} snaps searching for {text!r}")
+        return snaps
+
+    async def get_snaps_from_users(self, followed_users: List[str], after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
         """
-        obtains the snaps from the users followed by the user.
+        obtains the snaps from the users followed by the user, a page at a time.
         """
         logger.info(f"Fetching snaps for followed users: {followed_users}")
-        snaps = list(self.snaps_collection.find({"email": {"$in": followed_users}, "is_blocked": False}).sort("created_at", -1))
-        print(snaps)
+        snaps = await self._find_page(self.snaps_collection, {"email": {"$in": followed_users}, "is_blocked": False}, after, limit, projection=snap_projection(fields))
         for snap in snaps:
             snap["_id"] = str(snap["_id"])
         logger.info(f"Retrieved snaps from followed users")
         return snaps
-    
-    def like_snap(self, snap_id, user_email, username):
+
+    async def like_snap(self, snap_id, user_email, username):
         """
-        Like a snap.
+        Like a snap, unless the user already did.
+
+        Returns the ID of the new like, or None if the user had already liked the snap. The
+        likes counter of the snap is left to increment_snap_likes.
         """
-        snap = self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
-        if not snap or snap["is_blocked"]:
-            return False
-        
-        result = self.likes_collection.insert_one({"snap_id": snap_id, "email": user_email, "username": username, "created_at": datetime.datetime.now()})
+        like = {"snap_id": snap_id, "email": user_email, "username": username, "created_at": datetime.datetime.now()}
+        try:
+            result = await self.likes_collection.update_one({"snap_id": snap_id, "email": user_email}, {"$setOnInsert": like}, upsert=True)
+        except DuplicateKeyError:
+            return None
+        return result.upserted_id
 
-        self.snaps_collection.update_one({"_id": ObjectId(snap_id)}, {"$inc": {"likes": 1}})
+    async def apply_interactions(self, user_email, username, likes: Dict[str, bool], favourites: Dict[str, bool], shares: List[str]):
+        """
+        Apply interactions of a user with one bulk write per collection.
+
+        likes and favourites map a snap ID to whether the user should end up liking or
+        favouriting it, and shares lists the snap IDs to share.
 
-        return result.inserted_id
-    
-    def get_snap_likes(self, snap_id):
+        Returns the change in the likes of each snap, 1 or -1, and the new shares. Inserted
+        likes are read from the upserts of the bulk write, and removed ones from the likes the
+        user still had right before it. The likes counters of the snaps are left to
+        increment_snap_likes.
+        """
+        now = datetime.datetime.now()
+        unliked = [snap_id for snap_id, present in likes.items() if not present]
+        new_shares = [{"_id": ObjectId(), "snap_id": snap_id, "email": user_email, "username": username, "created_at": now} for snap_id in shares]
+
+        async def write(collection, operations):
+            """
+            Run a bulk write, returning the positions of the operations that upserted a document.
+            """
+            if not operations:
+                return []
+            try:
+                result = await collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as exc:
+                raise_unless_duplicates(exc)
+                return [upsert["index"] for upsert in exc.details.get("upserted", [])]
+            return list(result.upserted_ids)
+
+        removed_likes = []
+        if unliked:
+            removed_likes = [like["snap_id"] for like in await self.likes_collection.find({"email": user_email, "snap_id": {"$in": unliked}}, {"snap_id": 1, "_id": 0}).to_list()]
+        inserted_likes, _, _ = await concurrently(
+            write(self.likes_collection, interaction_operations(user_email, likes, lambda snap_id: {"snap_id": snap_id, "email": user_email, "username": username, "created_at": now})),
+            write(self.favourites_collection, interaction_operations(user_email, favourites, lambda snap_id: {"snap_id": snap_id, "email": user_email})),
+            write(self.snap_shares_collection, [InsertOne(share) for share in new_shares]),
+        )
+        like_changes = dict.fromkeys(removed_likes, -1)
+        snap_ids = list(likes)
+        like_changes.update((snap_ids[index], 1) for index in inserted_likes)
+        logger.info(f"Applied {len(likes)} likes, {len(favourites)} favourites and {len(shares)} shares of user {user_email}")
+        return like_changes, new_shares
+
+    async def get_snap_likes(self, snap_id):
         """
         Get the emails of likes for snap.
         """
-        likes = [x["email"] for x in list(self.likes_collection.find({"snap_id": snap_id}, {"email": 1, "_id": 0}))]
+        likes = [x["email"] for x in await self.likes_collection.find({"snap_id": snap_id}, {"email": 1, "_id": 0}).to_list()]
         return likes
-    
-    def get_users_and_time_snap_likes(self, snap_id):
+
+    async def get_users_and_time_snap_likes(self, snap_id):
         """
         Get the emails and time of likes for snap.
         """
-        likes = list(self.likes_collection.find({"snap_id": snap_id}, {"username": 1, "created_at": 1, "_id": 0}))
-        return likes
-    
-    def get_users_and_time_snap_shares(self, snap_id):
+        return await self.likes_collection.find({"snap_id": snap_id}, {"username": 1, "created_at": 1, "_id": 0}).to_list()
+
+    async def get_users_and_time_snap_shares(self, snap_id):
         """
         Get the emails and time of shares for snap.
         """
-        shares = list(self.snap_shares_collection.find({"snap_id": snap_id}, {"username": 1, "created_at": 1, "_id": 0}))
-        return shares
-    
-    def unlike_snap(self, snap_id, user_email):
+        return await self.snap_shares_collection.find({"snap_id": snap_id}, {"username": 1, "created_at": 1, "_id": 0}).to_list()
+
+    async def get_users_interactions(self, email, after: Optional[Cursor] = None, limit: Optional[int] = None, since: Optional[datetime.datetime] = None):
         """
-        Unlike a snap.
+        Get a page of the user's snaps with the username and time of their likes and shares,
+        optionally only the ones made since a given moment.
         """
-        snap = self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
-        if not snap or snap["is_blocked"]:
-            return False
-        
-        result = self.likes_collection.delete_one({"snap_id": snap_id, "email": user_email})
+        pipeline = users_interactions_pipeline(email, after, limit, since, self.likes_collection.name, self.snap_shares_collection.name)
+        snaps = await (await self.snaps_collection.aggregate(pipeline)).to_list()
+        for snap in snaps:
+            snap["_id"] = str(snap["_id"])
+        logger.info(f"Retrieved interactions with the snaps of user {email}")
+        return snaps
 
-        self.snaps_collection.update_one({"_id": ObjectId(snap_id)}, {"$inc": {"likes": -1}})
+    async def unlike_snap(self, snap_id, user_email):
+        """
+        Unlike a snap.
 
+        Returns the number of likes removed, 0 if the user had not liked the snap. The likes
+        counter of the snap is left to increment_snap_likes.
+        """
+        result = await self.likes_collection.delete_one({"snap_id": snap_id, "email": user_email})
         return result.deleted_count
-    
-    def favourite_snap(self, snap_id, user_email):
+
+    async def favourite_snap(self, snap_id, user_email):
         """
-        Favourite a snap.
+        Favourite a snap, unless the user already did.
+
+        Returns the ID of the new favourite, or None if the user had already favourited the snap.
         """
-        snap = self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
-        if not snap or snap["is_blocked"]:
-            return False
-        
-        result = self.favourites_collection.insert_one({"snap_id": snap_id, "email": user_email})
-        return result.inserted_id
-    
-    def get_snap_favourites(self, user_email):
+        favourite = {"snap_id": snap_id, "email": user_email}
+        try:
+            result = await self.favourites_collection.update_one(favourite, {"$setOnInsert": favourite}, upsert=True)
+        except DuplicateKeyError:
+            return None
+        return result.upserted_id
+
+    async def get_snap_favourites(self, user_email):
         """
         Get the IDs of snaps favourited by user.
         """
-        favourites = [x["snap_id"] for x in list(self.favourites_collection.find({"email": user_email}, {"snap_id": 1, "_id": 0}))]
+        favourites = [x["snap_id"] for x in await self.favourites_collection.find({"email": user_email}, {"snap_id": 1, "_id": 0}).to_list()]
         return favourites
-    
-    def unfavourite_snap(self, snap_id, user_email):
+
+    async def unfavourite_snap(self, snap_id, user_email):
         """
         Unfavourite a snap.
+
+        Returns the number of favourites removed, 0 if the user had not favourited the snap.
         """
-        snap = self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
-        if not snap or snap["is_blocked"]:
-            return False
-        
-        result = self.favourites_collection.delete_one({"snap_id": snap_id, "email": user_email})
+        result = await self.favourites_collection.delete_one({"snap_id": snap_id, "email": user_email})
         return result.deleted_count
-    
-    def get_all_snap_favourites(self, user_email):
+
+    async def get_all_snap_favourites(self, user_email):
         """
         Get all the favourites for all snaps.
         """
-        favourites = list(self.favourites_collection.find({"email": user_email}))
-        for favourite in favourites:
-            favourite["_id"] = str(favourite["_id"])
+        favourites = await self.favourites_collection.find({"email": user_email}).to_list()
         return [x["snap_id"] for x in favourites]
-    
-    def get_all_snap_likes(self, user_email):
+
+    async def get_all_snap_likes(self, user_email):
         """
         Get all the likes for all snaps.
         """
-        likes = list(self.likes_collection.find({"email": user_email}))
-        for like in likes:
-            like["_id"] = str(like["_id"])
+        likes = await self.likes_collection.find({"email": user_email}).to_list()
         return [x["snap_id"] for x in likes]
-    
-    def get_relevant_snaps(self, interests: List[str]):
+
+    async def get_relevant_snaps(self, interests: List[str], after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
         """
-        Get snaps relevant to the user's interests.
+        Get snaps relevant to the user's interests, a page at a time.
+
+        Pages are merged from the candidate lists of the interests, so only the newest
+        RELEVANT_CANDIDATES_PER_HASHTAG snaps of each hashtag are reachable. Candidates that
+        were blocked or deleted since they were listed are skipped, merging further down the
+        lists until the page is full or the lists run out.
         """
         interests = ["#" + x.lower() for x in interests]
-        snaps = list(self.snaps_collection.find({"hashtags": {"$in": interests}, "is_blocked": False}).sort("created_at", -1))
-        for snap in snaps:
-            snap["_id"] = str(snap["_id"])
-        return snaps
-    
-    def block_snap(self, snap_id, user_email):
+        candidate_lists = list((await self.get_hashtag_candidates(interests)).values())
+        snaps = []
+        while True:
+            wanted = limit - len(snaps) if limit else None
+            entries = merge_candidates(candidate_lists, after, wanted)
+            if not entries:
+                return snaps
+            snap_ids = [entry["_id"] for entry in entries]
+            found = await self.snaps_collection.find({"_id": {"$in": snap_ids}, "is_blocked": False}, snap_projection(fields)).to_list()
+            snaps.extend(in_candidate_order(found, snap_ids))
+            if not limit or len(snaps) >= limit or len(entries) < wanted:
+                return snaps
+            after = (entries[-1]["created_at"], entries[-1]["_id"])
+
+    async def get_hashtag_candidates(self, hashtags: List[str]):
+        """
+        Get the candidate lists of the hashtags, keyed by hashtag, building the missing ones.
+        """
+        documents = await self.hashtag_candidates_collection.find({"hashtag": {"$in": hashtags}}, {"hashtag": 1, "recent_snaps": 1, "_id": 0}).to_list()
+        candidates = {document["hashtag"]: document["recent_snaps"] for document in documents}
+        missing = [hashtag for hashtag in hashtags if hashtag not in candidates]
+        if missing:
+            candidates.update(await self.rebuild_hashtag_candidates(missing))
+        return candidates
+
+    async def push_hashtag_candidates(self, snaps: List[dict], max_candidates: int = RELEVANT_CANDIDATES_PER_HASHTAG):
+        """
+        Add new snaps to the candidate lists of their hashtags.
+        """
+        operations = candidate_push_operations(snaps, max_candidates)
+        if operations:
+            await self.hashtag_candidates_collection.bulk_write(operations, ordered=False)
+
+    async def rebuild_hashtag_candidates(self, hashtags: Iterable[str], max_candidates: int = RELEVANT_CANDIDATES_PER_HASHTAG):
+        """
+        Rebuild the candidate lists of the hashtags from their newest unblocked snaps, e.g.
+        after one of their snaps was blocked or deleted.
+        """
+        hashtags = list(set(hashtags))
+        pages = await concurrently(*(
+            self._find_page(self.snaps_collection, {"hashtags": hashtag, "is_blocked": False}, None, max_candidates, projection={"created_at": 1})
+            for hashtag in hashtags
+        ))
+        candidates = dict(zip(hashtags, pages))
+        if candidates:
+            await self.hashtag_candidates_collection.bulk_write([
+                UpdateOne({"hashtag": hashtag}, {"$set": {"recent_snaps": entries}}, upsert=True)
+                for hashtag, entries in candidates.items()
+            ], ordered=False)
+        logger.info(f"Rebuilt the candidate lists of {len(candidates)} hashtags")
+        return candidates
+
+    async def block_snap(self, snap_id, user_email):
         """
         Block a snap.
         """
-        snap = self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
+        snap = await self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
         if not snap or snap["is_blocked"]:
             return False
-        
-        result = self.snaps_collection.update_one({"_id": ObjectId(snap_id)}, {"$set": {"is_blocked": True}})
+
+        result = await self.snaps_collection.update_one({"_id": ObjectId(snap_id)}, {"$set": {"is_blocked": True}})
         return result.modified_count
-    
-    def unblock_snap(self, snap_id, user_email):
+
+    async def unblock_snap(self, snap_id, user_email):
         """
         Unblock a snap.
         """
-        snap = self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
+        snap = await self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
         if not snap or not snap["is_blocked"]:
             return False
-        
-        result = self.snaps_collection.update_one({"_id": ObjectId(snap_id)}, {"$set": {"is_blocked": False}})
+
+        result = await self.snaps_collection.update_one({"_id": ObjectId(snap_id)}, {"$set": {"is_blocked": False}})
         return result.modified_count
-    
-    def get_snaps_unblocked(self, user_email):
+
+    async def get_snaps_unblocked(self, user_email, fields: Optional[Iterable[str]] = None):
         """
         Get all unblocked snaps.
         """
-        snaps = list(self.snaps_collection.find({"is_blocked": False}).sort("created_at", -1))
+        snaps = await self.snaps_collection.find({"is_blocked": False}, snap_projection(fields)).sort("created_at", -1).to_list()
         for snap in snaps:
             snap["_id"] = str(snap["_id"])
         return snaps
-    
-    def get_last_24_hours_snaps(self):
+
+    async def get_last_24_hours_snaps(self):
         """
         Get all snaps from the last 24 hours.
         """
-        snaps = list(self.snaps_collection.find({"created_at": {"$gte": datetime.datetime.now() - datetime.timedelta(days=1)}}).sort("created_at", -1))
+        snaps = await self.snaps_collection.find({"created_at": {"$gte": datetime.datetime.now() - datetime.timedelta(days=1)}}, SNAP_FIELDS).sort("created_at", -1).to_list()
         for snap in snaps:
             snap["_id"] = str(snap["_id"])
         return snaps
-    
-    def snap_share(self, snap_id, user_email, username):
+
+    async def snap_share(self, snap_id, user_email, username):
         """
         Share a snap.
         """
-        snap = self.snaps_collection.find_one({"_id": ObjectId(snap_id)})
-        if not snap or snap["is_blocked"]:
-            return False
-        
-        result = self.snap_shares_collection.insert_one({"snap_id": snap_id, "email": user_email, "username": username, "created_at": datetime.datetime.now()})
-        return result.inserted_id
-    
-    def get_snap_shares_by_email(self, user_email):
+        share = {"snap_id": snap_id, "email": user_email, "username": username, "created_at": datetime.datetime.now()}
+        result = await self.snap_shares_collection.insert_one(share)
+        share["_id"] = result.inserted_id
+        return share
+
+    async def get_snap_shares_by_email(self, user_email, after: Optional[Cursor] = None, limit: Optional[int] = None):
         """
-        Get all snap shares.
+        Get the snap shares of a user, newest first.
         """
-        shares = list(self.snap_shares_collection.find({"email": user_email}))
+        shares = await self._find_page(self.snap_shares_collection, {"email": user_email}, after, limit)
         for share in shares:
             share["_id"] = str(share["_id"])
         return shares
-    
-    def get_snap_shares(self, snap_id):
+
+    async def count_snap_shares(self, snap_id):
+        """
+        Count the shares of a snap.
+        """
+        return await self.snap_shares_collection.count_documents({"snap_id": snap_id})
+
+    async def get_snap_shares(self, snap_id):
         """
         Get all shares for a snap.
         """
-        shares = list(self.snap_shares_collection.find({"snap_id": snap_id}))
+        shares = await self.snap_shares_collection.find({"snap_id": snap_id}).to_list()
         for share in shares:
             share["_id"] = str(share["_id"])
         return shares
 
+    async def get_snaps_by_ids(self, snap_ids: List[str], fields: Optional[Iterable[str]] = None):
+        """
+        Fetch the unblocked snaps with the given IDs, keyed by ID.
+        """
+        object_ids = [ObjectId(snap_id) for snap_id in set(snap_ids) if ObjectId.is_valid(snap_id)]
+        result = {}
+        async for snap in self.snaps_collection.find({"_id": {"$in": object_ids}, "is_blocked": False}, snap_projection(fields)):
+            snap["_id"] = str(snap["_id"])
+            result[snap["_id"]] = snap
+        return result
+
+    async def get_liked_snap_ids(self, user_email, snap_ids: List[str]):
+        """
+        Get which of the given snaps the user liked.
+        """
+        likes = await self.likes_collection.find({"snap_id": {"$in": snap_ids}, "email": user_email}, {"snap_id": 1, "_id": 0}).to_list()
+        return {like["snap_id"] for like in likes}
+
+    async def get_favourited_snap_ids(self, user_email, snap_ids: List[str]):
+        """
+        Get which of the given snaps the user favourited.
+        """
+        favourites = await self.favourites_collection.find({"snap_id": {"$in": snap_ids}, "email": user_email}, {"snap_id": 1, "_id": 0}).to_list()
+        return {favourite["snap_id"] for favourite in favourites}
+
+    async def get_shared_snap_ids(self, user_email, snap_ids: List[str]):
+        """
+        Get which of the given snaps the user shared.
+        """
+        shares = await self.snap_shares_collection.find({"snap_id": {"$in": snap_ids}, "email": user_email}, {"snap_id": 1, "_id": 0}).to_list()
+        return {share["snap_id"] for share in shares}
+
+    async def get_followed_emails(self, user_email):
+        """
+        Get the emails the user follows, as last synced from the profile service.
+        """
+        edges = await self.followers_collection.find({"follower": user_email}, {"followed": 1, "_id": 0}).to_list()
+        return {edge["followed"] for edge in edges}
+
+    async def get_follower_emails(self, user_email):
+        """
+        Get the emails of the known followers of a user.
+        """
+        edges = await self.followers_collection.find({"followed": user_email}, {"follower": 1, "_id": 0}).to_list()
+        return [edge["follower"] for edge in edges]
+
+    async def count_followers(self, user_email, limit: int):
+        """
+        Count the known followers of a user, stopping at limit.
+        """
+        return await self.followers_collection.count_documents({"followed": user_email}, limit=limit)
+
+    async def add_follow_edges(self, user_email, followed_users: List[str]):
+        """
+        Record that the user follows the given users.
+        """
+        operations = [
+            UpdateOne({"follower": user_email, "followed": followed}, {"$setOnInsert": {"follower": user_email, "followed": followed}}, upsert=True)
+            for followed in followed_users
+        ]
+        if operations:
+            await self.followers_collection.bulk_write(operations, ordered=False)
+
+    async def remove_follow_edges(self, user_email, followed_users: List[str]):
+        """
+        Forget that the user follows the given users.
+        """
+        result = await self.followers_collection.delete_many({"follower": user_email, "followed": {"$in": followed_users}})
+        return result.deleted_count
+
+    async def mark_pull_author(self, user_email):
+        """
+        Flag an author whose snaps are pulled at read time instead of fanned out.
+        """
+        await self.pull_authors_collection.update_one({"email": user_email}, {"$set": {"email": user_email}}, upsert=True)
+
+    async def get_pull_authors(self, emails: List[str]):
+        """
+        Get which of the given authors are served by pulling at read time.
+        """
+        authors = await self.pull_authors_collection.find({"email": {"$in": emails}}, {"email": 1, "_id": 0}).to_list()
+        return [author["email"] for author in authors]
+
+    async def push_timeline_entries(self, owners: List[str], entries: List[dict], max_entries: Optional[int] = None):
+        """
+        Insert entries into the timelines of the given owners, ignoring the ones already there.
+
+        With max_entries, the number of entries pushed to each timeline is added up in
+        timeline_sizes, and the timelines that grow past max_entries + TIMELINE_TRIM_SLACK
+        are trimmed back to max_entries.
+        """
+        operations = [
+            UpdateOne({"owner": owner, "entry_id": entry["entry_id"]}, {"$setOnInsert": {**entry, "owner": owner}}, upsert=True)
+            for owner in owners
+            for entry in entries
+        ]
+        if not operations:
+            return
+        result = await self.timelines_collection.bulk_write(operations, ordered=False)
+        logger.info(f"Pushed {len(entries)} timeline entries to {len(owners)} timelines")
+        if max_entries is None:
+            return
+
+        pushed: Dict[str, int] = {}
+        for index in result.upserted_ids:
+            owner = owners[index // len(entries)]
+            pushed[owner] = pushed.get(owner, 0) + 1
+        if not pushed:
+            return
+        await self.timeline_sizes_collection.bulk_write(
+            [UpdateOne({"owner": owner}, {"$inc": {"size": count}}, upsert=True) for owner, count in pushed.items()],
+            ordered=False,
+        )
+        oversized = await self.timeline_sizes_collection.find(
+            {"owner": {"$in": list(pushed)}, "size": {"$gt": max_entries + TIMELINE_TRIM_SLACK}},
+            {"owner": 1, "_id": 0}
+        ).to_list()
+        await concurrently(*(self.trim_timeline(size["owner"], max_entries) for size in oversized))
+
+    async def get_timeline_entries_from_users(self, authors: List[str], limit: int):
+        """
+        Build the most recent timeline entries (snaps and shares) published by the given users.
+        """
+        snaps = await self.snaps_collection.find(
+            {"email": {"$in": authors}, "is_blocked": False},
+            {"email": 1, "created_at": 1}
+        ).sort("created_at", -1).limit(limit).to_list()
+        shares = await self.snap_shares_collection.find({"email": {"$in": authors}}).sort("created_at", -1).limit(limit).to_list()
+        return timeline_entries(snaps, shares)
+
+    async def get_timeline(self, owner, after: Optional[Cursor] = None, limit: Optional[int] = None):
+        """
+        Get the entries of a user's timeline, a page at a time.
+        """
+        entries = await self._find_page(self.timelines_collection, {"owner": owner}, after, limit, id_field="entry_id")
+        logger.info(f"Retrieved {len(entries)} timeline entries for user {owner}")
+        return entries
+
+    async def remove_timeline_authors(self, owner, authors: List[str]):
+        """
+        Remove from a user's timeline every entry published by the given users.
+        """
+        result = await self.timelines_collection.delete_many({"owner": owner, "author_email": {"$in": authors}})
+        return result.deleted_count
+
+    async def remove_snap_from_timelines(self, snap_id):
+        """
+        Remove a snap and its shares from every timeline.
+        """
+        result = await self.timelines_collection.delete_many({"snap_id": snap_id})
+        return result.deleted_count
+
+    async def trim_timeline(self, owner, max_entries: int):
+        """
+        Drop the entries of a user's timeline that are older than the newest max_entries, and
+        record the size left in timeline_sizes.
+        """
+        oldest_kept = await self.timelines_collection.find({"owner": owner}, {"created_at": 1}).sort("created_at", -1).skip(max_entries - 1).limit(1).to_list()
+        deleted = 0
+        if oldest_kept:
+            result = await self.timelines_collection.delete_many({"owner": owner, "created_at": {"$lt": oldest_kept[0]["created_at"]}})
+            deleted = result.deleted_count
+        size = await self.timelines_collection.count_documents({"owner": owner})
+        await self.timeline_sizes_collection.update_one({"owner": owner}, {"$set": {"size": size}}, upsert=True)
+        return deleted
+
+    async def increment_hashtag_scores(self, scores: Dict[Tuple[str, datetime.datetime], int]):
+        """
+        Add to the trending score of each (hashtag, hourly bucket) the given amount.
+        """
+        operations = hashtag_score_operations(scores)
+        if operations:
+            await self.hashtag_scores_collection.bulk_write(operations, ordered=False)
+
+    async def increment_snap_likes(self, likes: Dict[str, int]):
+        """
+        Add to the likes counter of each snap the given amount.
+        """
+        operations = snap_likes_operations(likes)
+        if operations:
+            await self.snaps_collection.bulk_write(operations, ordered=False)
+
+    async def increment_hashtag_counts(self, counts: Dict[str, int]):
+        """
+        Add to the usage count of each hashtag, i.e. the number of snaps using it, the given amount.
+        """
+        operations = hashtag_count_operations(counts)
+        if operations:
+            await self.hashtags_collection.bulk_write(operations, ordered=False)
+
+    async def get_hashtag_counts(self):
+        """
+        Get the usage count of every hashtag in use.
+        """
+        hashtags = await self.hashtags_collection.find({"count": {"$gt": 0}}, {"hashtag": 1, "count": 1, "_id": 0}).to_list()
+        return {hashtag["hashtag"]: hashtag["count"] for hashtag in hashtags}
+
+    async def rebuild_hashtag_counts(self):
+        """
+        Recount the usage of every hashtag from the snaps, replacing the stored counts.
+
+        Seeds the counts of snaps written before they were kept, and repairs drifted ones.
+        Increments made by other writes while it runs may be lost. Returns the new counts.
+        """
+        rebuilt = await (await self.snaps_collection.aggregate(hashtag_counts_pipeline())).to_list()
+        counts = {hashtag["_id"]: hashtag["count"] for hashtag in rebuilt}
+        stored = await self.hashtags_collection.find({"count": {"$ne": 0}}, {"hashtag": 1, "_id": 0}).to_list()
+        operations = [UpdateOne({"hashtag": hashtag}, {"$set": {"count": count}}, upsert=True) for hashtag, count in counts.items()]
+        operations.extend(UpdateOne({"hashtag": hashtag["hashtag"]}, {"$set": {"count": 0}}) for hashtag in stored if hashtag["hashtag"] not in counts)
+        if operations:
+            await self.hashtags_collection.bulk_write(operations, ordered=False)
+        logger.info(f"Rebuilt the usage counts of {len(counts)} hashtags")
+        return counts
+
+    async def get_top_hashtags(self, since: datetime.datetime, limit: int):
+        """
+        Get the hashtags with the highest score summed over the buckets starting at since.
+        """
+        hashtags = await (await self.hashtag_scores_collection.aggregate(top_hashtags_pipeline(since, limit))).to_list()
+        return [hashtag["_id"] for hashtag in hashtags]
+
+
+class SyncCursor:
+    """
+    A cursor of pymongo's sync driver with the to_list and async iteration of the asyncio
+    driver's cursors.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit: int):
+        self.cursor = self.cursor.limit(limit)
+        return self
+
+    def skip(self, skip: int):
+        self.cursor = self.cursor.skip(skip)
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> list:
+        return list(itertools.islice(self.cursor, length))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class SyncCollection:
+    """
+    A collection of pymongo's sync driver with the interface of the asyncio driver's. Its
+    coroutines block on the command and never suspend.
+    """
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    @property
+    def name(self) -> str:
+        return self.collection.name
+
+    def find(self, *args, **kwargs) -> SyncCursor:
+        return SyncCursor(self.collection.find(*args, **kwargs))
+
+    async def aggregate(self, *args, **kwargs) -> SyncCursor:
+        return SyncCursor(self.collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class SyncDatabase:
+    """
+    A database of pymongo's sync driver handing out SyncCollections.
+    """
+    def __init__(self, db: Database):
+        self.db = db
+
+    def __getitem__(self, name: str) -> SyncCollection:
+        return SyncCollection(self.db[name])
+
+
+def run_synchronously(coroutine):
+    """
+    Run a coroutine of a repository on a SyncDatabase to completion on the calling thread.
+    """
+    token = _synchronous.set(True)
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        _synchronous.reset(token)
+    coroutine.close()
+    raise RuntimeError("A repository coroutine suspended while run synchronously.")
+
+
+class SnapRepository:
+    """
+    AsyncSnapRepository on pymongo's sync driver, with plain methods: each call blocks the
+    calling thread on its MongoDB commands.
+    """
+    def __init__(self, db: Database):
+        database = SyncDatabase(db)
+        self.repository = AsyncSnapRepository(lambda: database)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.repository, name)
+        if name.startswith("_") or not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return run_synchronously(attribute(*args, **kwargs))
+        return call
+
+
+class ThreadedSnapRepository:
+    """
+    Exposes a SnapRepository with the coroutine interface of AsyncSnapRepository, running
+    each call in the threadpool.
+    """
+    def __init__(self, snap_repository: SnapRepository):
+        self.snap_repository = snap_repository
+
+    def __getattr__(self, name):
+        attribute = getattr(self.snap_repository, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            return await run_in_threadpool(attribute, *args, **kwargs)
+        return call
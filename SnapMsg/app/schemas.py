@@ -1,5 +1,7 @@
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+
+from .constants import SNAP_BATCH_MAX_SIZE, SNAP_INTERACTIONS_BATCH_MAX_SIZE
 
 class SnapCreate(BaseModel):
     """
@@ -12,6 +14,17 @@ class SnapCreate(BaseModel):
     message: str
     is_private: bool
 
+class SnapBatchCreate(BaseModel):
+    """
+    Model for creating several Snaps at once.
+
+    Attributes:
+        snaps (List[SnapCreate]): The Snaps to create, at most SNAP_BATCH_MAX_SIZE.
+        ordered (bool): Whether to stop at the first Snap that cannot be created.
+    """
+    snaps: List[SnapCreate] = Field(..., min_length=1, max_length=SNAP_BATCH_MAX_SIZE)
+    ordered: bool = False
+
 class SnapData(BaseModel):
     """
     Model for representing Snap data.
@@ -46,6 +59,82 @@ class SnapListResponse(BaseModel):
     data: List[SnapData]
 
 
+class SnapBatchItem(BaseModel):
+    """
+    Model for the result of one Snap of a batch.
+
+    Attributes:
+        index (int): The position of the Snap in the batch.
+        status (int): 201 if it was created, 400 if it is invalid, 424 if it was not tried
+            because an earlier Snap of an ordered batch failed, 500 if it could not be stored.
+        id (Optional[str]): The identifier of the created Snap.
+        hashtags (Optional[List[str]]): The hashtags of the created Snap.
+        detail (Optional[str]): Why the Snap was not created.
+    """
+    index: int
+    status: int
+    id: Optional[str] = None
+    hashtags: Optional[List[str]] = None
+    detail: Optional[str] = None
+
+class SnapBatchResponse(BaseModel):
+    """
+    Model for the response of a batch creation, with one result per Snap in the same order.
+
+    Attributes:
+        data (List[SnapBatchItem]): The result of each Snap.
+    """
+    data: List[SnapBatchItem]
+
+
+class SnapInteraction(BaseModel):
+    """
+    Model for an interaction of the user with a Snap.
+
+    Attributes:
+        action (str): One of like, unlike, favourite, unfavourite or share.
+        snap_id (str): The identifier of the Snap.
+    """
+    action: Literal["like", "unlike", "favourite", "unfavourite", "share"]
+    snap_id: str
+
+class SnapInteractionBatch(BaseModel):
+    """
+    Model for applying several interactions at once, in order.
+
+    Attributes:
+        operations (List[SnapInteraction]): The interactions, at most SNAP_INTERACTIONS_BATCH_MAX_SIZE.
+    """
+    operations: List[SnapInteraction] = Field(..., min_length=1, max_length=SNAP_INTERACTIONS_BATCH_MAX_SIZE)
+
+class SnapInteractionResult(BaseModel):
+    """
+    Model for the result of one interaction of a batch.
+
+    Attributes:
+        index (int): The position of the interaction in the batch.
+        action (str): The action of the interaction.
+        snap_id (str): The identifier of the Snap.
+        status (int): 200 if it was applied, 400 if it conflicts with the state of the Snap,
+            404 if the Snap does not exist or is blocked.
+        detail (Optional[str]): Why the interaction was not applied.
+    """
+    index: int
+    action: str
+    snap_id: str
+    status: int
+    detail: Optional[str] = None
+
+class SnapInteractionBatchResponse(BaseModel):
+    """
+    Model for the response of a batch of interactions, with one result per interaction in the same order.
+
+    Attributes:
+        data (List[SnapInteractionResult]): The result of each interaction.
+    """
+    data: List[SnapInteractionResult]
+
+
 class ErrorResponse(BaseModel):
     """
     Model for representing an error response.
@@ -0,0 +1,113 @@
+from typing import Any, FrozenSet, Iterable, List, Optional
+
+import orjson
+from bson import ObjectId
+from fastapi import HTTPException, Query
+from fastapi.responses import JSONResponse
+
+# Fields of a snap document returned by the API; list queries fetch only these (and _id).
+SNAP_FIELDS = {
+    "email": 1,
+    "username": 1,
+    "message": 1,
+    "created_at": 1,
+    "is_private": 1,
+    "hashtags": 1,
+    "likes": 1,
+    "is_blocked": 1,
+}
+
+# Flags marking the interactions of the user with each snap of the feed.
+VIEWER_STATE_FIELDS = ("is_liked", "is_shared", "is_favourited")
+
+# Fields the services add to the snaps of a list.
+ANNOTATION_FIELDS = frozenset({"retweet_user", "is_verified", *VIEWER_STATE_FIELDS})
+
+# Fields identifying the items of a list, always returned.
+ID_FIELDS = frozenset({"_id", "id", "snap_id"})
+
+
+def snap_projection(fields: Optional[Iterable[str]] = None) -> dict:
+    """
+    Projection fetching the given snap fields, or every API field if fields is None.
+
+    created_at is always fetched: lists are sorted and paginated on it.
+    """
+    if fields is None:
+        return SNAP_FIELDS
+    fields = set(fields)
+    return {field: 1 for field in SNAP_FIELDS if field in fields or field == "created_at"}
+
+
+def encode_default(value: Any):
+    """
+    Encode the values orjson does not support natively.
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encode content as JSON in one pass, with datetimes in ISO 8601 and ObjectIds as strings.
+    """
+    return orjson.dumps(content, default=encode_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class SnapJSONResponse(JSONResponse):
+    """
+    JSON response encoded with orjson.
+
+    Returning it from an endpoint skips jsonable_encoder, which walks the whole content in
+    Python before encoding it; use it for large lists of documents.
+    """
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class FieldsParams:
+    """
+    Query parameter of the snap list endpoints selecting the fields returned for each snap.
+
+    Attributes:
+        fields (Optional[FrozenSet[str]]): The requested fields, None for all of them.
+    """
+    def __init__(
+        self,
+        fields: Optional[str] = Query(None, description="Comma-separated snap fields to return, e.g. username,message,created_at,likes. Identifiers are always returned."),
+    ):
+        self.fields: Optional[FrozenSet[str]] = None
+        if fields is not None:
+            requested = frozenset(field.strip() for field in fields.split(",") if field.strip())
+            unknown = requested - SNAP_FIELDS.keys() - ANNOTATION_FIELDS - ID_FIELDS
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}.")
+            self.fields = requested
+
+    def wants(self, field: str) -> bool:
+        """
+        Whether field was requested, so the work to compute it can be skipped otherwise.
+        """
+        return self.fields is None or field in self.fields
+
+    @property
+    def stored(self) -> Optional[FrozenSet[str]]:
+        """
+        The stored fields to fetch: the requested ones and the ones the requested annotations
+        are computed from.
+        """
+        if self.fields is None:
+            return None
+        return self.fields | ({"username"} if "is_verified" in self.fields else set())
+
+    def select(self, items: List[dict]) -> List[dict]:
+        """
+        Drop the fields that were not requested from each item.
+        """
+        if self.fields is None:
+            return items
+        keep = self.fields | ID_FIELDS
+        return [{field: value for field, value in item.items() if field in keep} for item in items]
@@ -1,16 +1,45 @@
+import asyncio
+import datetime
 import logging
 import re
-from typing import List
+from collections import Counter
+from typing import Iterable, List, Optional, Union
+from bson import ObjectId
 from fastapi import HTTPException
 
-from .constants import MAX_MESSAGE_LENGTH
-from .schemas import SnapUpdate
-from .repositories import SnapRepository
+from .counters import DirectCounters, WriteBehindCounters, hashtag_scores
+from .hashtags import HashtagSuggestions, hashtag_usage
+from .loaders import SnapLoader
+from .constants import (
+    FANOUT_MAX_FOLLOWERS,
+    HASHTAG_SUGGEST_TOP_K,
+    MAX_MESSAGE_LENGTH,
+    TIMELINE_BACKFILL_SIZE,
+    TIMELINE_MAX_ENTRIES,
+    TRENDING_DEFAULT_WINDOW,
+    TRENDING_LIKE_SCORE,
+    TRENDING_SHARE_SCORE,
+    TRENDING_SNAP_SCORE,
+    TRENDING_TOP_K,
+    TRENDING_WINDOWS,
+)
+from .pagination import Cursor, ScoreCursor, fill_page, merge_pages, next_cursor
+from .schemas import SnapCreate, SnapInteraction, SnapUpdate
+from .repositories import AsyncSnapRepository
 from pymongo.database import Database
 from .config import logger
 
 
 
+# For each batch action: the interaction it changes, whether it adds it, and the conflict detail.
+INTERACTION_ACTIONS = {
+    "like": ("like", True, "You have already liked this snap."),
+    "unlike": ("like", False, "You have not liked this snap."),
+    "favourite": ("favourite", True, "You have already favourited this snap."),
+    "unfavourite": ("favourite", False, "You have not favourited this snap."),
+}
+
+
 def extract_hashtags(message: str) -> List[str]:
     """
     Extract hashtags from the message, including the '#' symbol.
@@ -18,43 +47,122 @@ def extract_hashtags(message: str) -> List[str]:
     return [hashtag.lower() for hashtag in re.findall(r"(#\w+)", message)]
 
 
+def snap_entry(snap: dict) -> dict:
+    """
+    Timeline entry of a newly created snap.
+    """
+    return {
+        "entry_id": ObjectId(snap["_id"]),
+        "snap_id": snap["_id"],
+        "author_email": snap["email"],
+        "retweet_user": "",
+        "created_at": snap["created_at"],
+    }
+
+
+def trending_bucket(moment: datetime.datetime) -> datetime.datetime:
+    """
+    Hourly bucket that holds the trending score of the snaps created at the given moment.
+
+    Naive moments are local time, like the created_at of snaps. Buckets are naive UTC, which
+    is how MongoDB reads naive dates, so the TTL index expires them on time on any host.
+    """
+    return moment.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0, tzinfo=None)
+
+
 class SnapService:
-    def __init__(self, snap_repository: SnapRepository, auth_service_url: str):
+    def __init__(self, snap_repository: AsyncSnapRepository, auth_service_url: str, counters: Optional[Union[DirectCounters, WriteBehindCounters]] = None):
         self.snap_repository = snap_repository
         self.auth_service_url = auth_service_url
+        self.counters = counters if counters is not None else DirectCounters(snap_repository)
+        self.hashtags = HashtagSuggestions(snap_repository)
     
-    def create_snap(self, db: Database, user_email: str, message: str, is_private: bool, username: str):
+    async def create_snap(self, db: Database, user_email: str, message: str, is_private: bool, username: str):
         """
         Create a new snap.
         """
 
         hashtags = extract_hashtags(message)
-        return self.snap_repository.create_snap(user_email, message, is_private, hashtags, username)
+        snap = await self.snap_repository.create_snap(user_email, message, is_private, hashtags, username)
+        await self.add_trending_score(snap, TRENDING_SNAP_SCORE)
+        await self.hashtags.record(hashtag_usage(added=hashtags))
+        await self.snap_repository.push_hashtag_candidates([snap])
+        await self.fan_out(user_email, [snap_entry(snap)])
+        return snap
 
-    def get_snaps(self, db: Database, user_email: str):
+    async def create_snaps(self, db: Database, user_email: str, snaps: List[SnapCreate], username: str, ordered: bool = False):
         """
-        Fetch all snaps for a user.
+        Create several snaps with a single write, reporting a result for each one.
+
+        Messages are validated and their hashtags extracted in one pass. In an ordered batch
+        nothing after the first invalid or unstored snap is created: that snap gets a 400 or a
+        500, and the ones after it a 424.
+        """
+        results = [{"index": index} for index in range(len(snaps))]
+        valid = []
+        for index, snap in enumerate(snaps):
+            if len(snap.message) > MAX_MESSAGE_LENGTH:
+                results[index].update(status=400, detail=f"Message exceeds {MAX_MESSAGE_LENGTH} characters.")
+                if ordered:
+                    break
+            else:
+                valid.append((index, (snap.message, snap.is_private, extract_hashtags(snap.message))))
+
+        stored = await self.snap_repository.create_snaps(user_email, [fields for _, fields in valid], username, ordered)
+        created = []
+        for (index, _), snap in zip(valid, stored):
+            if snap is None:
+                results[index].update(status=500, detail="The snap could not be stored.")
+            else:
+                results[index].update(status=201, id=snap["_id"], hashtags=snap["hashtags"])
+                created.append(snap)
+        for result in results:
+            result.setdefault("status", 424)
+            result.setdefault("detail", "Not created: an earlier snap of the ordered batch failed.")
+
+        if created:
+            hashtags = [hashtag for snap in created for hashtag in snap["hashtags"]]
+            await self.add_trending_score({"hashtags": hashtags, "created_at": created[0]["created_at"]}, TRENDING_SNAP_SCORE)
+            usage = Counter()
+            for snap in created:
+                usage.update(hashtag_usage(added=snap["hashtags"]))
+            await self.hashtags.record(usage)
+            await self.snap_repository.push_hashtag_candidates(created)
+            await self.fan_out(user_email, [snap_entry(snap) for snap in created])
+        return results
+
+    async def get_snaps(self, db: Database, user_email: str, after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
+        """
+        Fetch the snaps of a user, a page at a time.
         """
 
-        return self.snap_repository.get_snaps(user_email)
+        return await self.snap_repository.get_snaps(user_email, after, limit, fields)
 
-    def get_snap_by_id(self, db: Database, snap_id: str):
+    async def get_snap_by_id(self, db: Database, snap_id: str):
         """
         Fetch a snap by its ID.
         """
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
         if not snap:
             raise HTTPException(status_code=404, detail="Snap not found.")
         if snap == "Snap is blocked":
             raise HTTPException(status_code=400, detail="Snap is blocked.")
         return snap
 
-    def delete_snap(self, db: Database, snap_id: str, user_email: str):
+    async def get_snap_version(self, snap_id: str):
+        """
+        Get the version of a snap, None if it does not exist or is blocked.
+        """
+        return await self.snap_repository.get_snap_version(snap_id)
+
+    async def delete_snap(self, db: Database, snap_id: str, user_email: str):
         """
         Delete a snap.
         """
 
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        # The trending score removed below is computed from the stored likes counter.
+        await self.counters.flush_likes(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
 
         if not snap:
             raise HTTPException(status_code=404, detail=f"Snap with ID {snap_id} not found.")
@@ -65,17 +173,25 @@ class SnapService:
         if snap["email"] != user_email:
             raise HTTPException(status_code=403, detail="Not authorized to delete this snap.")
         
-        return self.snap_repository.delete_snap(snap_id)
+        score = await self.get_trending_score(snap_id, snap)
+        deleted = await self.snap_repository.delete_snap(snap_id)
+        await self.snap_repository.remove_snap_from_timelines(snap_id)
+        await self.add_trending_score(snap, -score)
+        await self.hashtags.record(hashtag_usage(removed=snap["hashtags"]))
+        await self.snap_repository.rebuild_hashtag_candidates(snap["hashtags"])
+        return deleted
 
     
-    def update_snap(self, db: Database, user_email: str, snap_id: str, snap_update: SnapUpdate):
+    async def update_snap(self, db: Database, user_email: str, snap_id: str, snap_update: SnapUpdate):
         """
         Update a snap.
         """
         if len(snap_update.message) > MAX_MESSAGE_LENGTH:
             raise HTTPException(status_code=400, detail="Message exceeds the allowed length.")
          
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        # The trending score moved below is computed from the stored likes counter.
+        await self.counters.flush_likes(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
     
         if snap["email"] != user_email:
             raise HTTPException(status_code=403, detail="Not authorized to update this snap.")
@@ -87,282 +203,482 @@ class SnapService:
         if snap_update.message:
             snap_update.hashtags = extract_hashtags(snap_update.message)
 
-        return self.snap_repository.update_snap(snap_id, snap_update)
+        updated = await self.snap_repository.update_snap(snap_id, snap_update)
+
+        if snap_update.hashtags is not None and snap_update.hashtags != snap["hashtags"]:
+            score = await self.get_trending_score(snap_id, snap)
+            await self.add_trending_score(snap, -score)
+            await self.add_trending_score({**snap, "hashtags": snap_update.hashtags}, score)
+            await self.hashtags.record(hashtag_usage(snap["hashtags"], snap_update.hashtags))
+            await self.snap_repository.rebuild_hashtag_candidates(snap["hashtags"] + snap_update.hashtags)
+
+        return updated
     
-    def search_snaps_by_hashtag(self, db: Database, hashtag: str):
+    async def search_snaps_by_hashtag(self, db: Database, hashtag: str, after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
         """
-        Search for snaps containing a specific hashtag.
+        Search for snaps containing a specific hashtag, a page at a time.
         """
-        snaps = self.snap_repository.search_snaps_by_hashtag(hashtag)
-        if not snaps:
+        snaps = await self.snap_repository.search_snaps_by_hashtag(hashtag, after, limit, fields)
+        if not snaps and not after:
             raise HTTPException(status_code=404, detail="No snaps found with that hashtag.")
         return snaps
     
-    def get_all_snaps(self, db: Database):
+    async def search_snaps(self, text: str, after: Optional[ScoreCursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
+        """
+        Search snaps by the words of their message, ranked by relevance plus recency.
+        """
+        if not text.strip():
+            raise HTTPException(status_code=400, detail="The search query is empty.")
+        return await self.snap_repository.search_snaps(text, after, limit, fields)
+
+    async def get_all_snaps(self, db: Database, after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
         """
-        Fetch all snaps from the database.
+        Fetch snaps from the database, a page at a time.
         """
-        snaps = self.snap_repository.get_all_snaps()
+        snaps = await self.snap_repository.get_all_snaps(after, limit, fields)
         return snaps
 
-    def get_snaps_from_followed_users(self, db: Database, followed_users: List[str]):
+    async def get_snaps_from_followed_users(self, db: Database, followed_users: List[str], after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
         """
         obtains the snaps from the users followed by the user chronologically.
         """
-        snaps = self.snap_repository.get_snaps_from_users(followed_users)
+        snaps = await self.snap_repository.get_snaps_from_users(followed_users, after, limit, fields)
         for snap in snaps:
             snap["retweet_user"] = ""
         return snaps
     
-    def like_snap(self, snap_id: str, user_email: str, username: str):
+    async def like_snap(self, snap_id: str, user_email: str, username: str):
         """
         Like a snap.
         """
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
         if not snap:
             raise HTTPException(status_code=404, detail="Snap not found.")
         
         if snap == "Snap is blocked":
             raise HTTPException(status_code=400, detail="Snap is blocked.")
         
-        post_likes = self.snap_repository.get_snap_likes(snap_id)
-        
-        if user_email in post_likes:
+        liked = await self.snap_repository.like_snap(snap_id, user_email, username)
+        if not liked:
             raise HTTPException(status_code=400, detail="You have already liked this snap.")
-        
-        return self.snap_repository.like_snap(snap_id, user_email, username)
+
+        await self.counters.add_likes(snap_id, 1)
+        await self.add_trending_score(snap, TRENDING_LIKE_SCORE)
+        return liked
     
-    def unlike_snap(self, snap_id: str, user_email: str):
+    async def unlike_snap(self, snap_id: str, user_email: str):
         """
         Unlike a snap.
         """
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
         if not snap:
             raise HTTPException(status_code=404, detail="Snap not found.")
         
         if snap == "Snap is blocked":
             raise HTTPException(status_code=400, detail="Snap is blocked.")
         
-        post_likes = self.snap_repository.get_snap_likes(snap_id)
-
-        if user_email not in post_likes:
+        unliked = await self.snap_repository.unlike_snap(snap_id, user_email)
+        if not unliked:
             raise HTTPException(status_code=400, detail="You have not liked this snap.")
-        
-        return self.snap_repository.unlike_snap(snap_id, user_email)
+
+        await self.counters.add_likes(snap_id, -1)
+        await self.add_trending_score(snap, -TRENDING_LIKE_SCORE)
+        return unliked
     
-    def favourite_snap(self, snap_id: str, user_email: str):
+    async def favourite_snap(self, snap_id: str, user_email: str):
         """
         Favourite a snap.
         """
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
         if not snap:
             raise HTTPException(status_code=404, detail="Snap not found.")
         
         if snap == "Snap is blocked":
             raise HTTPException(status_code=400, detail="Snap is blocked.")
         
-        post_favourites = self.snap_repository.get_snap_favourites(user_email)
-        
-        if snap_id in post_favourites:
+        favourited = await self.snap_repository.favourite_snap(snap_id, user_email)
+        if not favourited:
             raise HTTPException(status_code=400, detail="You have already favourited this snap.")
-        
-        return self.snap_repository.favourite_snap(snap_id, user_email)
+        return favourited
     
-    def unfavourite_snap(self, snap_id: str, user_email: str):
+    async def unfavourite_snap(self, snap_id: str, user_email: str):
         """
         Unfavourite a snap.
         """
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
         if not snap:
             raise HTTPException(status_code=404, detail="Snap not found.")
         
         if snap == "Snap is blocked":
             raise HTTPException(status_code=400, detail="Snap is blocked.")
         
-        post_favourites = self.snap_repository.get_snap_favourites(user_email)
-
-        if snap_id not in post_favourites:
+        unfavourited = await self.snap_repository.unfavourite_snap(snap_id, user_email)
+        if not unfavourited:
             raise HTTPException(status_code=400, detail="You have not favourited this snap.")
-        
-        return self.snap_repository.unfavourite_snap(snap_id, user_email)
+        return unfavourited
     
-    def get_favourite_snaps(self, user_email: str):
+    async def apply_interactions(self, user_email: str, username: str, operations: List[SnapInteraction]):
         """
-        Get the snaps favourited by user.
+        Apply a batch of likes, unlikes, favourites, unfavourites and shares in order,
+        reporting a result for each one.
+
+        The snaps and the user's likes and favourites of them are read once for the whole
+        batch, the operations are replayed against that state, and only the net changes are
+        written, with one bulk write per collection.
+        """
+        snap_ids = list({operation.snap_id for operation in operations})
+        snaps, liked, favourited = await asyncio.gather(
+            self.snap_repository.get_snaps_by_ids(snap_ids),
+            self.snap_repository.get_liked_snap_ids(user_email, snap_ids),
+            self.snap_repository.get_favourited_snap_ids(user_email, snap_ids),
+        )
+        initial = {"like": set(liked), "favourite": set(favourited)}
+        state = {interaction: set(ids) for interaction, ids in initial.items()}
+        shares = []
+        results = []
+        for index, operation in enumerate(operations):
+            result = {"index": index, "action": operation.action, "snap_id": operation.snap_id, "status": 200}
+            if operation.snap_id not in snaps:
+                result.update(status=404, detail="Snap not found.")
+            elif operation.action == "share":
+                shares.append(operation.snap_id)
+            else:
+                interaction, adds, conflict = INTERACTION_ACTIONS[operation.action]
+                if (operation.snap_id in state[interaction]) == adds:
+                    result.update(status=400, detail=conflict)
+                elif adds:
+                    state[interaction].add(operation.snap_id)
+                else:
+                    state[interaction].discard(operation.snap_id)
+            results.append(result)
+
+        likes, favourites = (
+            {snap_id: snap_id in state[interaction] for snap_id in state[interaction] ^ initial[interaction]}
+            for interaction in ("like", "favourite")
+        )
+        like_amounts, new_shares = await self.snap_repository.apply_interactions(user_email, username, likes, favourites, shares)
+
+        scores = Counter()
+        for snap_id, amount in like_amounts.items():
+            scores.update(hashtag_scores(snaps[snap_id]["hashtags"], trending_bucket(snaps[snap_id]["created_at"]), TRENDING_LIKE_SCORE * amount))
+        for snap_id in shares:
+            scores.update(hashtag_scores(snaps[snap_id]["hashtags"], trending_bucket(snaps[snap_id]["created_at"]), TRENDING_SHARE_SCORE))
+        if like_amounts:
+            await self.counters.add_many_likes(like_amounts)
+        if scores:
+            await self.counters.add_many_hashtag_scores(dict(scores))
+        if new_shares:
+            await self.fan_out(user_email, [{
+                "entry_id": share["_id"],
+                "snap_id": share["snap_id"],
+                "author_email": user_email,
+                "retweet_user": username,
+                "created_at": share["created_at"],
+            } for share in new_shares])
+        return results
+
+    async def _load_snaps(self, snaps_ids: List[str], snap_loader: Optional[SnapLoader]):
         """
-        snaps_ids = self.snap_repository.get_all_snap_favourites(user_email)
+        Load the unblocked snaps with the given IDs in a single batch, with the snap ID under "id".
+        """
+        snap_loader = snap_loader or SnapLoader(self.snap_repository)
         snaps = []
-        for snaps_id in snaps_ids:
-            snap = self.snap_repository.get_snap_by_id(snaps_id)
-            if snap and snap != "Snap is blocked":
+        for snap in await snap_loader.load_many(snaps_ids):
+            if snap:
+                snap["id"] = snap.pop("_id")
                 snaps.append(snap)
         return snaps
+
+    async def get_favourite_snaps(self, user_email: str, snap_loader: Optional[SnapLoader] = None):
+        """
+        Get the snaps favourited by user.
+        """
+        snaps_ids = await self.snap_repository.get_all_snap_favourites(user_email)
+        return await self._load_snaps(snaps_ids, snap_loader)
     
-    def get_liked_snaps(self, user_email: str):
+    async def get_liked_snaps(self, user_email: str, snap_loader: Optional[SnapLoader] = None):
         """
         Get the snaps liked by user.
         """
-        snaps_ids = self.snap_repository.get_all_snap_likes(user_email)
-        print("snaps_ids", snaps_ids)
-        snaps = []
-        for snaps_id in snaps_ids:
-            snap = self.snap_repository.get_snap_by_id(snaps_id)
-            if snap and snap != "Snap is blocked":
-                snaps.append(snap)
-        return snaps
+        snaps_ids = await self.snap_repository.get_all_snap_likes(user_email)
+        return await self._load_snaps(snaps_ids, snap_loader)
     
-    def get_relevant_snaps(self, interests: List[str]):
+    async def get_relevant_snaps(self, interests: List[str], after: Optional[Cursor] = None, limit: Optional[int] = None, fields: Optional[Iterable[str]] = None):
         """
         Get the snaps that are relevant to the user.
         """
-        snaps = self.snap_repository.get_relevant_snaps(interests)
+        snaps = await self.snap_repository.get_relevant_snaps(interests, after, limit, fields)
         for snap in snaps:
             snap["retweet_user"] = ""
         return snaps
     
-    def block_snap(self, snap_id: str, user_email: str):
+    async def block_snap(self, snap_id: str, user_email: str):
         """
         Block a snap.
         """
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
         if not snap:
             raise HTTPException(status_code=404, detail="Snap not found.")
         
-        blocked_snap = self.snap_repository.block_snap(snap_id, user_email)
+        blocked_snap = await self.snap_repository.block_snap(snap_id, user_email)
         if not blocked_snap:
             raise HTTPException(status_code=400, detail="Snap already blocked.")
+        await self.snap_repository.rebuild_hashtag_candidates(snap["hashtags"])
         return blocked_snap
     
-    def unblock_snap(self, snap_id: str, user_email: str):
+    async def unblock_snap(self, snap_id: str, user_email: str):
         """
         Unblock a snap.
         """
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
         if not snap:
             raise HTTPException(status_code=404, detail="Snap not found.")
         
-        unblocked_snap = self.snap_repository.unblock_snap(snap_id, user_email)
+        unblocked_snap = await self.snap_repository.unblock_snap(snap_id, user_email)
         if not unblocked_snap:
             raise HTTPException(status_code=400, detail="Snap already unblocked.")
+        # The snap was fetched while blocked, without its fields.
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
+        await self.snap_repository.rebuild_hashtag_candidates(snap["hashtags"])
         return unblocked_snap
     
-    def get_unblocked_snaps(self, user_email: str):
+    async def annotate_viewer_state(self, user_email: str, snaps: List[dict], fields: Optional[Iterable[str]] = None):
+        """
+        Mark whether the user liked, shared and favourited each of the snaps, or only the
+        flags among is_liked, is_shared and is_favourited that are in fields.
+
+        Only the user's interactions with these snaps are read. Feed items for shares keep
+        the ID of the shared snap under "snap_id".
+        """
+        lookups = {
+            "is_liked": self.snap_repository.get_liked_snap_ids,
+            "is_shared": self.snap_repository.get_shared_snap_ids,
+            "is_favourited": self.snap_repository.get_favourited_snap_ids,
+        }
+        if fields is not None:
+            lookups = {flag: lookup for flag, lookup in lookups.items() if flag in fields}
+        snap_ids = list({snap.get("snap_id", snap["_id"]) for snap in snaps})
+        found = await asyncio.gather(*(lookup(user_email, snap_ids) for lookup in lookups.values()))
+        for snap in snaps:
+            snap_id = snap.get("snap_id", snap["_id"])
+            for flag, ids in zip(lookups, found):
+                snap[flag] = snap_id in ids
+        return snaps
+
+    async def get_unblocked_snaps(self, user_email: str, fields: Optional[Iterable[str]] = None):
         """
         Get all the snaps that are unblocked.
         """
-        snaps = self.snap_repository.get_snaps_unblocked(user_email)
+        snaps = await self.snap_repository.get_snaps_unblocked(user_email, fields)
         return snaps
     
-    def get_trending_hashtags(self):
-        """
-        Get the trending hashtags.
-        """
-        # traer los snaps de las ultimas 24 horas
-        last_24_hours_snaps = self.snap_repository.get_last_24_hours_snaps()
-        #obtener hashtags unicos
-        posible_hashtags = {} # (hashtag, puntaje)
-        for snap in last_24_hours_snaps:
-            
-            likes = self.snap_repository.get_snap_likes(snap["_id"])
-            retweets = self.snap_repository.get_snap_shares(snap["_id"])
-
-            for hashtag in snap["hashtags"]:
-                if hashtag not in posible_hashtags:
-                    posible_hashtags[hashtag] = 0
-                posible_hashtags[hashtag] += 10 + len(likes) + (2 * len(retweets))
-
-        sorted_hashtags = sorted(posible_hashtags.items(), key=lambda x: x[1], reverse=True)
-        sorted_hashtags = [hashtag for hashtag, _ in sorted_hashtags]
-
-        if len(sorted_hashtags) > 5:
-            return sorted_hashtags[:5]
-        return sorted_hashtags
+    async def add_trending_score(self, snap: dict, amount: int):
+        """
+        Add amount to the trending score of the snap's hashtags.
+
+        Scores go to the bucket of the hour the snap was created, so a snap counts towards
+        a window while it is younger than the window, likes and shares included.
+        """
+        if snap["hashtags"] and amount:
+            await self.counters.add_hashtag_scores(snap["hashtags"], trending_bucket(snap["created_at"]), amount)
+
+    async def get_trending_score(self, snap_id: str, snap: dict):
+        """
+        Get the score a snap currently adds to each of its hashtags.
+        """
+        shares = await self.snap_repository.count_snap_shares(snap_id)
+        return TRENDING_SNAP_SCORE + TRENDING_LIKE_SCORE * snap["likes"] + TRENDING_SHARE_SCORE * shares
+
+    async def get_trending_hashtags(self, window: str = TRENDING_DEFAULT_WINDOW):
+        """
+        Get the trending hashtags of the snaps created during the window.
+        """
+        if window not in TRENDING_WINDOWS:
+            raise HTTPException(status_code=400, detail=f"Window must be one of {', '.join(TRENDING_WINDOWS)}.")
+
+        since = trending_bucket(datetime.datetime.now(datetime.timezone.utc)) - datetime.timedelta(hours=TRENDING_WINDOWS[window] - 1)
+        return await self.snap_repository.get_top_hashtags(since, TRENDING_TOP_K)
     
-    def snap_share(self, snap_id: str, user_email: str, username: str):
+    async def suggest_hashtags(self, prefix: str, limit: int = HASHTAG_SUGGEST_TOP_K):
+        """
+        Get the most used hashtags starting with prefix, with or without its leading '#'.
+        """
+        prefix = prefix.strip().lower()
+        if not prefix.startswith("#"):
+            prefix = "#" + prefix
+        return await self.hashtags.suggest(prefix, limit)
+
+    async def snap_share(self, snap_id: str, user_email: str, username: str):
         """
         Share a snap.
         """
-        snap = self.snap_repository.get_snap_by_id(snap_id)
+        snap = await self.snap_repository.get_snap_by_id(snap_id)
         if not snap:
             raise HTTPException(status_code=404, detail="Snap not found.")
         
         if snap == "Snap is blocked":
             raise HTTPException(status_code=400, detail="Snap is blocked.")
         
-        return self.snap_repository.snap_share(snap_id, user_email, username)
+        share = await self.snap_repository.snap_share(snap_id, user_email, username)
+        await self.add_trending_score(snap, TRENDING_SHARE_SCORE)
+        await self.fan_out(user_email, [{
+            "entry_id": share["_id"],
+            "snap_id": snap_id,
+            "author_email": user_email,
+            "retweet_user": username,
+            "created_at": share["created_at"],
+        }])
+        return share
     
-    def get_retweeted_snaps(self, user_email: str):
+    async def get_retweeted_snaps(self, user_email: str, after: Optional[Cursor] = None, limit: Optional[int] = None, snap_loader: Optional[SnapLoader] = None):
         """
         Get the snaps retweeted by user.
         """
-        snap_shares = self.snap_repository.get_snap_shares_by_email(user_email)
-        print("snap_shares", snap_shares)
-        snaps = []
-        for snap_share in snap_shares:
-            snap = self.snap_repository.get_snap_by_id(snap_share["snap_id"])
-            if snap and snap != "Snap is blocked":
-                snap["created_at"] = snap_share["created_at"]
-                snap["retweet_user"] = snap_share["username"]
-                print("snap_share", snap_share)
-                snap["_id"] = snap_share["_id"]
-                snap.pop("id")
-                snaps.append(snap)
+        snap_loader = snap_loader or SnapLoader(self.snap_repository)
 
-        return snaps
+        async def fetch_shares(after, limit):
+            return await self.snap_repository.get_snap_shares_by_email(user_email, after, limit)
+
+        async def hydrate(snap_shares):
+            loaded = await snap_loader.load_many([snap_share["snap_id"] for snap_share in snap_shares])
+            snaps = []
+            for snap_share, snap in zip(snap_shares, loaded):
+                if snap:
+                    snap["created_at"] = snap_share["created_at"]
+                    snap["retweet_user"] = snap_share["username"]
+                    snap["snap_id"] = snap["_id"]
+                    snap["_id"] = snap_share["_id"]
+                    snaps.append(snap)
+            return snaps
+
+        return await fill_page(fetch_shares, hydrate, after, limit)
     
-    def get_followed_retweeted_snaps(self, followed_users: List[str]):
+    async def get_followed_retweeted_snaps(self, followed_users: List[str], after: Optional[Cursor] = None, limit: Optional[int] = None, snap_loader: Optional[SnapLoader] = None):
         """
         Get the snaps retweeted by the users followed by user.
         """
-        print("followed_users", followed_users)
-        retweets = []
-        for user_email in followed_users:
-            retweets.extend(self.get_retweeted_snaps(user_email))
+        snap_loader = snap_loader or SnapLoader(self.snap_repository)
+        pages = await asyncio.gather(*(self.get_retweeted_snaps(user_email, after, limit, snap_loader) for user_email in followed_users))
 
-        return retweets
+        return [snap for page in pages for snap in page]
     
-    def get_shared_snaps(self, user_email: str):
+    async def get_shared_snaps(self, user_email: str, snap_loader: Optional[SnapLoader] = None):
         """
         Get the snaps shared by user.
         """
-        snap_shares = self.snap_repository.get_snap_shares_by_email(user_email)
+        snap_loader = snap_loader or SnapLoader(self.snap_repository)
+        snap_shares = await self.snap_repository.get_snap_shares_by_email(user_email)
+        loaded = await snap_loader.load_many([snap_share["snap_id"] for snap_share in snap_shares])
         snaps = []
-        for snap_share in snap_shares:
-            snap = self.snap_repository.get_snap_by_id(snap_share["snap_id"])
-            if snap and snap != "Snap is blocked":
+        for snap_share, snap in zip(snap_shares, loaded):
+            if snap:
+                snap["id"] = snap.pop("_id")
                 snap["created_at"] = snap_share["created_at"]
                 snap["retweet_user"] = snap_share["username"]
                 snaps.append(snap)
 
         return snaps
     
-    def get_users_liked_and_retweeted_snaps(self, user_email: str):
+    async def get_users_liked_and_retweeted_snaps(self, user_email: str, after: Optional[Cursor] = None, limit: Optional[int] = None, since: Optional[datetime.datetime] = None):
         """
         Get the users who liked and retweeted the user's snaps, grouped by snap ID.
+
+        Returns a page of snaps and the cursor for the next one.
         """
-        snaps = self.snap_repository.get_snaps(user_email)
+        snaps = await self.snap_repository.get_users_interactions(user_email, after, limit, since)
         users_interactions_by_snap = {}
 
         for snap in snaps:
-            snap_id = str(snap["_id"])
-            if snap_id not in users_interactions_by_snap:
-                users_interactions_by_snap[snap_id] = {"likes": [], "retweets": []}
-            
-            likes = self.snap_repository.get_users_and_time_snap_likes(snap["_id"])
-            for like in likes:
-                users_interactions_by_snap[snap_id]["likes"].append({
-                    "username": like["username"],
-                    "created_at": like["created_at"]
-                })
-            
-            retweets = self.snap_repository.get_users_and_time_snap_shares(snap["_id"])
-            for retweet in retweets:
-                users_interactions_by_snap[snap_id]["retweets"].append({
-                    "username": retweet["username"],
-                    "created_at": retweet["created_at"]
-                })
-
-        return users_interactions_by_snap
-
-           
-        
\ No newline at end of file
+            users_interactions_by_snap[snap["_id"]] = {
+                "likes": sorted(snap["likes"], key=lambda like: like["created_at"]),
+                "retweets": sorted(snap["retweets"], key=lambda retweet: retweet["created_at"]),
+            }
+
+        return users_interactions_by_snap, next_cursor(snaps, limit) if limit else None
+
+    async def fan_out(self, author_email: str, entries: List[dict]):
+        """
+        Push new timeline entries to the followers of their author.
+
+        Authors with too many followers are not fanned out; their entries are pulled
+        when their followers read the feed.
+        """
+        if await self.snap_repository.get_pull_authors([author_email]):
+            return
+        if await self.snap_repository.count_followers(author_email, FANOUT_MAX_FOLLOWERS + 1) > FANOUT_MAX_FOLLOWERS:
+            logger.info(f"User {author_email} has more than {FANOUT_MAX_FOLLOWERS} followers, serving their snaps by pull")
+            await self.snap_repository.mark_pull_author(author_email)
+            return
+        followers = await self.snap_repository.get_follower_emails(author_email)
+        await self.snap_repository.push_timeline_entries(followers, entries, TIMELINE_MAX_ENTRIES)
+
+    async def sync_followed_users(self, user_email: str, followed_users: List[str]):
+        """
+        Reconcile the stored follow edges of a user with the ones reported by the profile service.
+
+        Timeline entries of unfollowed users are removed and the recent entries of newly
+        followed users are backfilled, so a user's first feed read builds their timeline.
+        """
+        known = await self.snap_repository.get_followed_emails(user_email)
+        current = set(followed_users)
+        unfollowed = list(known - current)
+        followed = list(current - known)
+
+        if unfollowed:
+            await self.snap_repository.remove_follow_edges(user_email, unfollowed)
+            await self.snap_repository.remove_timeline_authors(user_email, unfollowed)
+
+        if followed:
+            await self.snap_repository.add_follow_edges(user_email, followed)
+            pull_authors = set(await self.snap_repository.get_pull_authors(followed))
+            push_authors = [author for author in followed if author not in pull_authors]
+            if push_authors:
+                entries = await self.snap_repository.get_timeline_entries_from_users(push_authors, TIMELINE_BACKFILL_SIZE)
+                await self.snap_repository.push_timeline_entries([user_email], entries)
+            await self.snap_repository.trim_timeline(user_email, TIMELINE_MAX_ENTRIES)
+
+    async def get_snaps_and_retweets(self, user_email: str, after: Optional[Cursor] = None, limit: Optional[int] = None, snap_loader: Optional[SnapLoader] = None, fields: Optional[Iterable[str]] = None):
+        """
+        Get a page of the snaps posted and retweeted by user, newest first.
+        """
+        snaps, retweeted_snaps = await asyncio.gather(
+            self.snap_repository.get_snaps(user_email, after, limit, fields),
+            self.get_retweeted_snaps(user_email, after, limit, snap_loader),
+        )
+        for snap in snaps:
+            snap["retweet_user"] = ""
+        return merge_pages([snaps, retweeted_snaps], limit)
+
+    async def get_timeline_snaps(self, user_email: str, followed_users: List[str], after: Optional[Cursor] = None, limit: Optional[int] = None, snap_loader: Optional[SnapLoader] = None, fields: Optional[Iterable[str]] = None):
+        """
+        Get the snaps and shares of the users followed by user from their materialized timeline.
+
+        Returns one page per source: the timeline itself and, for followed authors served by
+        pull, their snaps and their shares.
+        """
+        await self.sync_followed_users(user_email, followed_users)
+        snap_loader = snap_loader or SnapLoader(self.snap_repository)
+
+        async def fetch_entries(after, limit):
+            return await self.snap_repository.get_timeline(user_email, after, limit)
+
+        async def hydrate(entries):
+            loaded = await snap_loader.load_many([entry["snap_id"] for entry in entries])
+            snaps = []
+            for entry, snap in zip(entries, loaded):
+                if not snap:
+                    continue
+                snap["snap_id"] = snap["_id"]
+                snap["_id"] = str(entry["entry_id"])
+                snap["created_at"] = entry["created_at"]
+                snap["retweet_user"] = entry["retweet_user"]
+                snaps.append(snap)
+            return snaps
+
+        sources = [fill_page(fetch_entries, hydrate, after, limit, id_field="entry_id")]
+        pull_authors = await self.snap_repository.get_pull_authors(followed_users)
+        if pull_authors:
+            sources.append(self.get_snaps_from_followed_users(None, pull_authors, after, limit, fields))
+            sources.extend(self.get_retweeted_snaps(author, after, limit, snap_loader) for author in pull_authors)
+
+        return list(await asyncio.gather(*sources))
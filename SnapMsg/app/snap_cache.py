@@ -0,0 +1,208 @@
+import copy
+import os
+from typing import Any, Awaitable, Callable, Iterable, Optional, Union
+
+import bson
+
+from .cache import TTLCache
+from .config import logger
+from .constants import SNAP_CACHE_MAXSIZE, SNAP_CACHE_TTL
+from .metrics import SNAP_CACHE_HITS, SNAP_CACHE_MISSES
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+# What get_snap_by_id returns: the snap, "Snap is blocked" or None.
+CachedSnap = Union[dict, str, None]
+
+# Returned by peek for a snap that is not cached.
+MISSING = object()
+
+
+class LocalSnapCache:
+    """
+    In-process LRU of snaps, on a TTLCache.
+
+    Concurrent misses on the same snap share a single load. Callers get a copy of the cached
+    snap, so they can modify it.
+    """
+    backend = "local"
+
+    def __init__(self, maxsize: int = SNAP_CACHE_MAXSIZE, ttl: float = SNAP_CACHE_TTL):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get_or_load(self, snap_id: str, load: Callable[[], Awaitable[CachedSnap]]) -> CachedSnap:
+        async def load_with_ttl():
+            return await load(), None
+        return copy.deepcopy(await self.entries.get_or_load_async(snap_id, load_with_ttl))
+
+    async def peek(self, snap_id: str) -> Any:
+        snap = self.entries.get(snap_id, MISSING)
+        return snap if snap is MISSING else copy.deepcopy(snap)
+
+    async def delete(self, snap_ids: Iterable[str]):
+        for snap_id in snap_ids:
+            self.entries.delete(snap_id)
+
+    async def close(self):
+        self.entries.clear()
+
+
+class RedisSnapCache:
+    """
+    Snaps cached in a server speaking the Redis protocol, shared by every instance.
+
+    Snaps are stored BSON-encoded, so datetimes and ObjectIds survive the round trip. When
+    the server cannot be reached, snaps are loaded from the database.
+
+    client is any object with the coroutines get, set(key, value, ex=seconds), delete and
+    aclose of redis.asyncio.Redis; from_url builds one with the redis package.
+    """
+    backend = "redis"
+
+    def __init__(self, client: Any, ttl: float = SNAP_CACHE_TTL, prefix: str = "snap:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        if redis is None:
+            raise RuntimeError("The redis package is needed to cache snaps in Redis.")
+        return cls(redis.from_url(url), **kwargs)
+
+    async def get_or_load(self, snap_id: str, load: Callable[[], Awaitable[CachedSnap]]) -> CachedSnap:
+        key = self.prefix + snap_id
+        try:
+            cached = await self.client.get(key)
+        except Exception as exc:
+            logger.error(f"Could not read snap {snap_id} from the cache: {exc}")
+            return await load()
+        if cached is not None:
+            return bson.decode(cached)["snap"]
+
+        snap = await load()
+        try:
+            await self.client.set(key, bson.encode({"snap": snap}), ex=max(1, round(self.ttl)))
+        except Exception as exc:
+            logger.error(f"Could not cache snap {snap_id}: {exc}")
+        return snap
+
+    async def peek(self, snap_id: str) -> Any:
+        try:
+            cached = await self.client.get(self.prefix + snap_id)
+        except Exception as exc:
+            logger.error(f"Could not read snap {snap_id} from the cache: {exc}")
+            return MISSING
+        return MISSING if cached is None else bson.decode(cached)["snap"]
+
+    async def delete(self, snap_ids: Iterable[str]):
+        keys = [self.prefix + snap_id for snap_id in snap_ids]
+        if keys:
+            await self.client.delete(*keys)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+SnapCache = Union[LocalSnapCache, RedisSnapCache]
+
+
+def create_snap_cache() -> Optional[SnapCache]:
+    """
+    Create the snap cache selected by SNAP_CACHE: "local" (the default), "redis", which
+    connects to REDIS_URL, or "none".
+    """
+    backend = os.getenv("SNAP_CACHE", "local").lower()
+    if backend == "none":
+        return None
+    if backend == "redis":
+        return RedisSnapCache.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return LocalSnapCache()
+
+
+class CachedSnapRepository:
+    """
+    Exposes a repository with the coroutine interface of AsyncSnapRepository, reading
+    get_snap_by_id through a snap cache. Hits and misses are counted in the
+    snapmsg_snap_cache_hits_total and snapmsg_snap_cache_misses_total metrics.
+
+    The writes that change what get_snap_by_id returns drop the snaps they touch from the
+    cache; a read racing with a write may still cache the old snap, for at most the cache's
+    time to live.
+    """
+    def __init__(self, snap_repository: Any, cache: SnapCache):
+        self.snap_repository = snap_repository
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.snap_repository, name)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Fraction of the get_snap_by_id calls answered without reading the database.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    async def get_snap_by_id(self, snap_id):
+        loaded = False
+
+        async def load():
+            nonlocal loaded
+            loaded = True
+            return await self.snap_repository.get_snap_by_id(snap_id)
+
+        snap = await self.cache.get_or_load(snap_id, load)
+        if loaded:
+            self.misses += 1
+            SNAP_CACHE_MISSES.labels(self.cache.backend).inc()
+        else:
+            self.hits += 1
+            SNAP_CACHE_HITS.labels(self.cache.backend).inc()
+        return snap
+
+    async def get_snap_version(self, snap_id):
+        """
+        The version of the cached snap, or of the stored one if it is not cached.
+        """
+        snap = await self.cache.peek(snap_id)
+        if snap is MISSING:
+            return await self.snap_repository.get_snap_version(snap_id)
+        return snap.get("version", 0) if isinstance(snap, dict) else None
+
+    async def _invalidate(self, snap_ids: Iterable[str], write: Awaitable):
+        try:
+            return await write
+        finally:
+            try:
+                await self.cache.delete(snap_ids)
+            except Exception as exc:
+                logger.error(f"Could not drop snaps from the cache: {exc}")
+
+    async def update_snap(self, snap_id, update_data):
+        return await self._invalidate([snap_id], self.snap_repository.update_snap(snap_id, update_data))
+
+    async def delete_snap(self, snap_id):
+        return await self._invalidate([snap_id], self.snap_repository.delete_snap(snap_id))
+
+    async def block_snap(self, snap_id, user_email):
+        return await self._invalidate([snap_id], self.snap_repository.block_snap(snap_id, user_email))
+
+    async def unblock_snap(self, snap_id, user_email):
+        return await self._invalidate([snap_id], self.snap_repository.unblock_snap(snap_id, user_email))
+
+    async def increment_snap_likes(self, likes):
+        return await self._invalidate(list(likes), self.snap_repository.increment_snap_likes(likes))
+
+    async def close(self):
+        """
+        Log the hit rate and release the cache.
+        """
+        logger.info(f"Snap cache: {self.hits} hits, {self.misses} misses, hit rate {self.hit_rate:.1%}")
+        await self.cache.close()
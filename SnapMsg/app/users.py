@@ -1,20 +1,28 @@
+import asyncio
+import contextlib
+import time
+from typing import Callable, FrozenSet, Optional
 from dotenv import load_dotenv
 from fastapi import HTTPException, Header
-import requests
 import os
 from .config import logger
+from .constants import VERIFIED_USERS_REFRESH_INTERVAL
+from .http_client import ServiceClient
 
 load_dotenv()
 
 PROFILE_SERVICE_URL = os.getenv("PROFILE_SERVICE_URL")
 
-def get_followed_users(token: str, username: str):
+profile_client = ServiceClient("profile", PROFILE_SERVICE_URL)
+
+async def get_followed_users(token: str, username: str):
     """
     Obtain the users followed by the current user, using the token for authentication.
     """
     logger.info(f"Getting followed users")
-    response = requests.get(
-        PROFILE_SERVICE_URL + f'/profiles/followed-emails?username={username}',
+    response = await profile_client.get(
+        '/profiles/followed-emails',
+        params={"username": username},
         headers={
             "accept": "application/json",
             "token": token
@@ -26,17 +34,112 @@ def get_followed_users(token: str, username: str):
     followed_users = response.json()
     return followed_users
 
-def get_profile_by_username(username: str):
+async def get_profile_by_username(username: str):
     """
     Get a user profile by username.
     """
     logger.info(f"Getting profile by username {username}")
-    response = requests.get(
-        PROFILE_SERVICE_URL + f'/profiles/by-username?username={username}',
+    response = await profile_client.get(
+        '/profiles/by-username',
+        params={"username": username},
         headers={"accept": "application/json"}
     )
     
     if response.status_code != 200:
         raise HTTPException(status_code=404, detail="Profile not found.")
     profile = response.json()
-    return profile
\ No newline at end of file
+    return profile
+
+class VerifiedUsersRegistry:
+    """
+    Usernames of the verified users, kept in memory and refreshed from the profile service.
+
+    Refreshes are conditional requests, so an unchanged list is not downloaded again. If a
+    refresh fails the last known usernames keep being served.
+    """
+    def __init__(self, client: ServiceClient, refresh_interval: float = VERIFIED_USERS_REFRESH_INTERVAL, clock: Callable[[], float] = time.monotonic):
+        self.client = client
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.usernames: FrozenSet[str] = frozenset()
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self._refreshing: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def is_stale(self) -> bool:
+        return self.checked_at is None or self.clock() - self.checked_at >= self.refresh_interval
+
+    async def _fetch(self):
+        headers = {"accept": "application/json"}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        try:
+            response = await self.client.get('/profiles/verified-users', headers=headers)
+        except HTTPException as exc:
+            logger.warning(f"Could not refresh verified users, serving the last known ones: {exc.detail}")
+            return
+        finally:
+            self.checked_at = self.clock()
+
+        if response.status_code == 304:
+            return
+        if response.status_code != 200:
+            logger.warning(f"Could not refresh verified users, profile service answered {response.status_code}")
+            return
+        self.usernames = frozenset(response.json())
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        logger.info(f"Refreshed {len(self.usernames)} verified users")
+
+    async def refresh(self):
+        """
+        Refetch the verified users, joining the refresh already running if there is one.
+        """
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._fetch())
+        await asyncio.shield(self._refreshing)
+
+    async def get(self) -> FrozenSet[str]:
+        """
+        Get the usernames of the verified users, refreshing them first if they are stale.
+        """
+        if self.is_stale():
+            await self.refresh()
+        return self.usernames
+
+    async def _refresh_periodically(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """
+        Keep the verified users refreshed from a background task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._refresh_periodically())
+
+    async def stop(self):
+        """
+        Stop the background refresh.
+        """
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+
+verified_users = VerifiedUsersRegistry(profile_client)
+
+
+async def get_verified_users() -> FrozenSet[str]:
+    """
+    Get the usernames of the verified users.
+    """
+    return await verified_users.get()
@@ -0,0 +1,50 @@
+"""
+Compare the time to encode a list response with FastAPI's default path (jsonable_encoder
+and JSONResponse) and with SnapJSONResponse.
+
+Run from the SnapMsg directory: python -m benchmarks.serialization [items] [repeat]
+"""
+import datetime
+import sys
+import timeit
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.serialization import SnapJSONResponse
+
+
+def snaps(items: int):
+    created_at = datetime.datetime.now()
+    return [
+        {
+            "_id": str(ObjectId()),
+            "email": f"user{index % 100}@example.com",
+            "username": f"user{index % 100}",
+            "message": f"Snap number {index} about #python and #mongodb",
+            "created_at": created_at - datetime.timedelta(seconds=index),
+            "is_private": index % 5 == 0,
+            "hashtags": ["#python", "#mongodb"],
+            "likes": index % 50,
+            "is_blocked": False,
+        }
+        for index in range(items)
+    ]
+
+
+def main(items: int = 10_000, repeat: int = 20):
+    content = {"data": snaps(items), "next_cursor": None}
+    timings = {
+        "jsonable_encoder + JSONResponse": lambda: JSONResponse(jsonable_encoder(content)),
+        "SnapJSONResponse": lambda: SnapJSONResponse(content),
+    }
+    results = {name: min(timeit.repeat(encode, number=1, repeat=repeat)) for name, encode in timings.items()}
+    for name, seconds in results.items():
+        print(f"{name:<32} {seconds * 1000:8.1f} ms")
+    baseline, fast = results.values()
+    print(f"{items} items: {baseline / fast:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))